@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import tracemalloc
+
+# The webapp module creates boto3 clients on import, which need a region
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "webapp"))
+
+import stepfn
+
+EVENT_COUNT = 10000
+EVENTS_PER_POLL = 50
+
+
+# Previous implementation of the task lookup, kept here as the baseline:
+# keep the raw history events, and walk back through previousEventId links
+# for every event, on every poll
+def get_task_started_by_raw_event(event):
+    return stepfn.get_task_started_by_event(
+        stepfn.EventRecord.from_history_event(event)
+    )
+
+
+def recursive_find_task_id(event, events_by_id):
+    task = get_task_started_by_raw_event(event)
+    if task:
+        return task
+    return recursive_find_task_id(events_by_id[event["previousEventId"]], events_by_id)
+
+
+def recursive_task_status(events):
+    events_by_id = {event["id"]: event for event in events}
+    task_status = {}
+    for event in events:
+        if event["type"] not in stepfn.known_event_types:
+            continue
+        task = recursive_find_task_id(event, events_by_id)
+        task_status[task["task_id"]] = get_task_status_entry(task, event)
+    return task_status
+
+
+def get_task_status_entry(task, event):
+    return {
+        "task_id": task["task_id"],
+        "task_name": task["task_name"],
+        "task_status": stepfn.get_task_status(event["type"]),
+    }
+
+
+# A history of short Bedrock tasks, similar to a MealPlanner debate loop:
+# each task is entered, scheduled, started, succeeded, and exited
+def generate_task_history(event_count):
+    events = [{"id": 1, "type": "ExecutionStarted", "previousEventId": 0}]
+    task_number = 0
+    while len(events) < event_count:
+        task_number += 1
+        entered_id = len(events) + 1
+        events.append(
+            {
+                "id": entered_id,
+                "type": "TaskStateEntered",
+                "previousEventId": entered_id - 1,
+                "stateEnteredEventDetails": {"name": f"Task {task_number}"},
+            }
+        )
+        for event_type in [
+            "TaskScheduled",
+            "TaskStarted",
+            "TaskSucceeded",
+            "TaskStateExited",
+        ]:
+            events.append(
+                {
+                    "id": len(events) + 1,
+                    "type": event_type,
+                    "previousEventId": len(events),
+                }
+            )
+    return events[:event_count]
+
+
+# A history where a single task owns every event, so the previousEventId chain
+# is as long as the history itself
+def generate_long_chain_history(event_count):
+    events = [
+        {"id": 1, "type": "ExecutionStarted", "previousEventId": 0},
+        {
+            "id": 2,
+            "type": "TaskStateEntered",
+            "previousEventId": 1,
+            "stateEnteredEventDetails": {"name": "Long Running Task"},
+        },
+    ]
+    while len(events) < event_count:
+        events.append(
+            {
+                "id": len(events) + 1,
+                "type": "TaskStarted",
+                "previousEventId": len(events),
+            }
+        )
+    return events
+
+
+def benchmark_recursive(events):
+    start = time.perf_counter()
+    for poll_end in range(
+        EVENTS_PER_POLL, len(events) + EVENTS_PER_POLL, EVENTS_PER_POLL
+    ):
+        recursive_task_status(events[:poll_end])
+    return time.perf_counter() - start
+
+
+def benchmark_index(events):
+    start = time.perf_counter()
+    event_index = stepfn.EventTaskIndex()
+    task_status = {}
+    for poll_start in range(0, len(events), EVENTS_PER_POLL):
+        new_events = [
+            stepfn.EventRecord.from_history_event(event)
+            for event in events[poll_start : poll_start + EVENTS_PER_POLL]
+        ]
+        for event in new_events:
+            event_index.add_event(event)
+        stepfn.update_task_status(task_status, new_events, event_index)
+    return time.perf_counter() - start
+
+
+# Memory kept per execution after reading the whole history:
+# the raw events and their ID lookup, compared with the event index
+def measure_memory(build_fn, events):
+    tracemalloc.start()
+    result = build_fn(events)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return memory
+
+
+def build_raw_events(events):
+    # Copy the events, as if they had just been parsed from GetExecutionHistory responses
+    raw_events = [
+        dict(event, timestamp=1700000000.0, stateExitedEventDetails={"name": "x"})
+        for event in events
+    ]
+    return raw_events, {event["id"]: event for event in raw_events}
+
+
+def build_event_index(events):
+    event_index = stepfn.EventTaskIndex()
+    for event in events:
+        event_index.add_event(stepfn.EventRecord.from_history_event(event))
+    return event_index
+
+
+def main():
+    print(
+        f"Resolving tasks for {EVENT_COUNT} events, polling every {EVENTS_PER_POLL} new events\n"
+    )
+    for name, events in [
+        ("Short tasks", generate_task_history(EVENT_COUNT)),
+        ("Long chain", generate_long_chain_history(EVENT_COUNT)),
+    ]:
+        try:
+            recursive_result = f"{benchmark_recursive(events):.3f}s"
+        except RecursionError:
+            recursive_result = "RecursionError"
+        index_result = f"{benchmark_index(events):.3f}s"
+        print(
+            f"{name}: recursive lookup {recursive_result}, event index {index_result}"
+        )
+
+    events = generate_task_history(EVENT_COUNT)
+    raw_memory = measure_memory(build_raw_events, events)
+    index_memory = measure_memory(build_event_index, events)
+    print(
+        f"\nMemory per execution: raw events {raw_memory / 1024:.0f} KiB, event index {index_memory / 1024:.0f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from jsonschema import validate
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "generic", "parse_json_response"
+    )
+)
+
+import index
+
+INVOCATION_COUNT = 2000
+
+
+# The schemas and typical valid responses of the demos' parse steps
+def get_demo_schemas():
+    meal_scores_json_schema = {
+        "type": "object",
+        "properties": {},
+        "required": [],
+        "additionalProperties": False,
+    }
+    meal_scores = {}
+    for chef in ["red", "blue"]:
+        meal_scores_json_schema["properties"][f"{chef}_chef"] = {
+            "type": "object",
+            "properties": {
+                "score": {"type": "number"},
+                "score_reasoning": {"type": "string"},
+            },
+            "required": ["score", "score_reasoning"],
+            "additionalProperties": False,
+        }
+        meal_scores_json_schema["required"].append(f"{chef}_chef")
+        meal_scores[f"{chef}_chef"] = {
+            "score": 8,
+            "score_reasoning": "A balanced meal with fresh ingredients.",
+        }
+
+    referee_json_schema = {
+        "type": "object",
+        "properties": {
+            "reasoning": {"type": "string"},
+            "do_chefs_agree": {"type": "string", "enum": ["yes", "no"]},
+        },
+        "required": ["reasoning", "do_chefs_agree"],
+        "additionalProperties": False,
+    }
+    referee_response = {
+        "reasoning": "Both chefs prefer the pasta.",
+        "do_chefs_agree": "yes",
+    }
+
+    characters_json_schema = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "description": {"type": "string"},
+            },
+            "required": ["name", "description"],
+            "additionalProperties": False,
+        },
+        "minItems": 5,
+        "maxItems": 5,
+        "uniqueItems": True,
+    }
+    characters = [
+        {"name": f"Character {i}", "description": f"Description for character {i}"}
+        for i in range(1, 6)
+    ]
+
+    return [
+        ("Meal scores", meal_scores_json_schema, meal_scores),
+        ("Referee response", referee_json_schema, referee_response),
+        ("Characters", characters_json_schema, characters),
+    ]
+
+
+# Previous implementation of the handler, kept here as the baseline:
+# jsonschema.validate checks the schema and creates a validator on every invocation
+def uncached_handler(event, context):
+    response_object = json.loads(event["response_string"])
+    validate(instance=response_object, schema=event["json_schema"])
+    return response_object
+
+
+# The handler prints its metrics on every invocation, so hide them from the benchmark's output
+def benchmark(handler_fn, event):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(INVOCATION_COUNT):
+            handler_fn(event, None)
+        return (time.perf_counter() - start) / INVOCATION_COUNT
+
+
+def main():
+    print(f"Warm invocations of the JSON response parser, {INVOCATION_COUNT} each\n")
+    for name, json_schema, response in get_demo_schemas():
+        event = {"response_string": json.dumps(response), "json_schema": json_schema}
+        # The first invocation of the cached handler compiles the validator, like a cold start
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.handler(event, None)
+        uncached = benchmark(uncached_handler, event)
+        cached = benchmark(index.handler, event)
+        print(
+            f"{name}: jsonschema.validate {uncached * 1e6:.0f}us, cached validator {cached * 1e6:.0f}us ({uncached / cached:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "functions", "generic", "semantic_cache"
+    )
+)
+
+import index
+
+# The Trip Planner's hotels prompt, which is built from the trip's location
+PROMPT_TEMPLATE = """You are a world-class travel agent and an expert on travel to {}.
+I am going on a weekend vacation to {}.
+Please give me up to 5 suggestions for hotels for my vacation."""
+
+# Locations that should share a cached response
+EQUIVALENT_KEYS = [
+    ("Paris", "Paris, France"),
+    ("New York", "New York City"),
+    ("NYC", "New York City"),
+    ("Rome", "Rome, Italy"),
+    ("Tokyo", "Tokyo, Japan"),
+    ("Barcelona", "Barcelona, Spain"),
+    ("Washington DC", "Washington, D.C."),
+    ("San Francisco", "San Francisco, CA"),
+    ("Lisbon", "Lisbon, Portugal"),
+    ("Sydney", "Sydney, Australia"),
+]
+
+# Locations that must not share a cached response
+DIFFERENT_KEYS = [
+    ("Paris, France", "Paris, Texas"),
+    ("Portland, Oregon", "Portland, Maine"),
+    ("Vienna", "Venice"),
+    ("Sydney", "Melbourne"),
+    ("Rome", "Milan"),
+    ("San Francisco", "San Diego"),
+    ("New York City", "Newark"),
+    ("Barcelona", "Madrid"),
+    ("Birmingham, England", "Birmingham, Alabama"),
+    ("Tokyo", "Kyoto"),
+]
+
+
+def similarity(a, b):
+    return float(np.dot(index.embed(a), index.embed(b)))
+
+
+def measure(name, to_text):
+    equivalent = [similarity(to_text(a), to_text(b)) for a, b in EQUIVALENT_KEYS]
+    different = [similarity(to_text(a), to_text(b)) for a, b in DIFFERENT_KEYS]
+    print(f"{name}:")
+    print(
+        f"  equivalent keys: min {min(equivalent):.3f}, median {np.median(equivalent):.3f}"
+    )
+    print(
+        f"  different keys:  max {max(different):.3f}, median {np.median(different):.3f}"
+    )
+    # The lowest threshold, in steps of 0.01, that keeps every pair of different keys apart
+    threshold = np.ceil(max(different) * 100 + 1e-9) / 100
+    hits = sum(s >= threshold for s in equivalent)
+    print(
+        f"  threshold {threshold:.2f} keeps the different keys apart and matches {hits} of {len(equivalent)} equivalent keys\n"
+    )
+
+
+# Embeds the keys with the semantic cache function's embedding model, so it needs access to Bedrock
+def main():
+    print(f"Similarities of {index.embedding_model_id} embeddings\n")
+    measure("Whole prompts", lambda key: PROMPT_TEMPLATE.format(key, key))
+    measure("Cache keys", lambda key: key)
+
+
+if __name__ == "__main__":
+    main()
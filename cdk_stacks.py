@@ -17,49 +17,71 @@ from stacks.most_popular_repo_strands_stack import (
 from stacks.alarms_stack import AlarmsStack
 import os
 
-
 app = App()
 env = Environment(account=os.environ["CDK_DEFAULT_ACCOUNT"], region="us-west-2")
+
+# Demo workflows to deploy as Express workflows, which the webapp starts synchronously.
+# Only BlogPost, TripPlanner, and StoryWriter can run as Express workflows.
+# run-test-execution.sh (and the pipeline's test stage) runs Express workflows with StartSyncExecution.
+express_workflows = []
+
+# Push execution updates to the webapp through a queue, instead of having the webapp poll for them.
+# The demo state machines only write their execution logs in this mode (or when they run as
+# Express workflows), because the pushed execution events are read from the logs.
+push_execution_status = False
+
 WebappStack(
     app,
     "PromptChaining-StreamlitWebapp",
     env=env,
     parent_domain="TODO FILL IN",
+    push_execution_status=push_execution_status,
+    express_workflows=express_workflows,
 )
 BlogPostStack(
     app,
     "PromptChaining-BlogPostDemo",
     env=env,
+    log_execution_events=push_execution_status,
+    express="BlogPost" in express_workflows,
 )
 TripPlannerStack(
     app,
     "PromptChaining-TripPlannerDemo",
     env=env,
+    log_execution_events=push_execution_status,
+    express="TripPlanner" in express_workflows,
 )
 StoryWriterStack(
     app,
     "PromptChaining-StoryWriterDemo",
     env=env,
+    log_execution_events=push_execution_status,
+    express="StoryWriter" in express_workflows,
 )
 MoviePitchStack(
     app,
     "PromptChaining-MoviePitchDemo",
     env=env,
+    log_execution_events=push_execution_status,
 )
 MealPlannerStack(
     app,
     "PromptChaining-MealPlannerDemo",
     env=env,
+    log_execution_events=push_execution_status,
 )
 MostPopularRepoBedrockAgentStack(
     app,
     "PromptChaining-MostPopularRepoBedrockAgentsDemo",
     env=env,
+    log_execution_events=push_execution_status,
 )
 MostPopularRepoStrandsStack(
     app,
     "PromptChaining-MostPopularRepoStrandsDemo",
     env=env,
+    log_execution_events=push_execution_status,
 )
 AlarmsStack(
     app,
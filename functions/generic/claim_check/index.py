@@ -0,0 +1,90 @@
+import json
+import os
+import uuid
+import boto3
+
+s3_client = boto3.client("s3")
+s3_bucket_name = os.environ.get("CLAIM_CHECK_BUCKET")
+
+
+# A claim check is a reference to a value that was stored in S3, in the form:
+# {"claim_check": {"bucket": "...", "key": "...", "size": 123}}
+def is_claim_check(value):
+    return isinstance(value, dict) and list(value.keys()) == ["claim_check"]
+
+
+def store(value, size_threshold, key_prefix):
+    if is_claim_check(value):
+        return value
+
+    serialized_value = json.dumps(value)
+    size = len(serialized_value.encode("utf-8"))
+    if size <= size_threshold:
+        return value
+
+    s3_object_key = f"{key_prefix}/{uuid.uuid4()}.json"
+    s3_client.put_object(
+        Bucket=s3_bucket_name,
+        Key=s3_object_key,
+        Body=serialized_value,
+        ContentType="application/json",
+    )
+    return {
+        "claim_check": {
+            "bucket": s3_bucket_name,
+            "key": s3_object_key,
+            "size": size,
+        }
+    }
+
+
+def load(value):
+    if not is_claim_check(value):
+        return value
+
+    response = s3_client.get_object(
+        Bucket=value["claim_check"]["bucket"],
+        Key=value["claim_check"]["key"],
+    )
+    return json.loads(response["Body"].read())
+
+
+# Merge the conversations of the Map iterations that continued the same conversation.
+# Map results may carry their conversations as claim checks, and the merged conversation is stored
+# as a claim check when it is larger than the size threshold.
+def merge_map_output(event, context):
+    # Assume every map result contains 2 unique conversation entries (user prompt and assistant response),
+    # and every map result has the same conversation history before that
+    map_results = event["map_results"]
+
+    conversations = [
+        load(item_result["model_outputs"]["conversation"])
+        for item_result in map_results
+    ]
+
+    conversation = conversations[0][:-2]
+
+    for item_conversation in conversations:
+        conversation.extend(item_conversation[-2:])
+
+    # Keep the token usage records of the steps before the map, followed by the records of each map iteration
+    usage_records = list(event.get("usage_records") or [])
+    for item_result in map_results:
+        usage_records.extend(item_result.get("usage_records") or [])
+
+    return {
+        "conversation": store(
+            conversation, event["size_threshold"], event["key_prefix"]
+        ),
+        "usage_records": usage_records,
+    }
+
+
+def handler(event, context):
+    operation = event["operation"]
+    if operation == "store":
+        return store(event["value"], event["size_threshold"], event["key_prefix"])
+    elif operation == "load":
+        return load(event["value"])
+    else:
+        raise ValueError(f"Unknown claim check operation: {operation}")
@@ -1,14 +1,214 @@
+from functools import lru_cache
 import json
-from jsonschema import validate
+import re
+import time
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+metrics_namespace = "PromptChainDemo"
+
+
+# Creating a validator checks the schema and picks the validator class for the schema's draft,
+# so keep the validators for recently seen schemas in warm Lambda environments.
+# The schema is passed in serialized as JSON, which is hashable. Its keys aren't sorted, because
+# their order decides which error is reported when a response has several errors.
+@lru_cache(maxsize=64)
+def get_validator(serialized_json_schema):
+    json_schema = json.loads(serialized_json_schema)
+    validator_class = validator_for(json_schema)
+    validator_class.check_schema(json_schema)
+    return validator_class(json_schema)
+
+
+# The text between the first and the last code fence, so that a fence inside the JSON,
+# like in a string value, doesn't end the fenced response early
+def strip_code_fences(text):
+    match = re.search(r"```(?:json)?\s*(.*)```", text, re.DOTALL)
+    return match.group(1).rstrip() if match else text
+
+
+# The prompts escape the braces in their JSON examples for States.Format, and the model sometimes copies them,
+# either as \\{ \\} or as doubled braces. Only the braces outside of strings are unescaped.
+# An object can't start with another opening brace in JSON, so {{ always opens a doubled object,
+# whose matching closing brace is then doubled too, like the inner object in {"a": {{"b": 1}}}.
+def unescape_braces(text):
+    result = []
+    # Whether each open object or array was opened with a doubled brace
+    doubled = []
+    in_string = False
+    escaped = False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "\\" and text[index + 1 : index + 2] in ["{", "}"]:
+            index += 1
+            continue
+        elif char == "{":
+            doubled.append(text[index + 1 : index + 2] == "{")
+            if doubled[-1]:
+                index += 1
+        elif char == "[":
+            doubled.append(False)
+        elif char in "}]" and doubled:
+            if doubled.pop() and char == "}" and text[index + 1 : index + 2] == "}":
+                index += 1
+        result.append(char)
+        index += 1
+    return "".join(result)
+
+
+# The first balanced JSON object or array in the text, without any text the model added around it
+def extract_json_value(text):
+    starts = [index for index in [text.find("{"), text.find("[")] if index >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start : index + 1]
+    return text[start:]
+
+
+# Remove commas before a closing brace or bracket, outside of strings
+def remove_trailing_commas(text):
+    result = []
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "," and text[index + 1 :].lstrip()[:1] in ["}", "]"]:
+            continue
+        result.append(char)
+    return "".join(result)
+
+
+# Deterministic repairs for the common ways that a model's JSON response is malformed, in the order they are tried
+json_repairs = [
+    ("strip_code_fences", strip_code_fences),
+    ("unescape_braces", unescape_braces),
+    ("extract_json_value", extract_json_value),
+    ("remove_trailing_commas", remove_trailing_commas),
+]
+
+
+# Parse the JSON response string, applying the repairs one by one until it parses.
+# Returns the parsed object and the names of the repairs that were applied.
+# If the repairs don't help, the original parsing error is raised, so that the model is asked to fix its response.
+def parse_json_response(response_string):
+    try:
+        return json.loads(response_string), []
+    except json.JSONDecodeError as original_error:
+        text = response_string
+        repairs = []
+        for repair_name, repair_fn in json_repairs:
+            repaired_text = repair_fn(text)
+            if repaired_text == text:
+                continue
+            text = repaired_text
+            repairs.append(repair_name)
+            try:
+                return json.loads(text), repairs
+            except json.JSONDecodeError:
+                pass
+        raise original_error
+
+
+# Print whether the response needed repairs, or couldn't be parsed even with the repairs,
+# in the CloudWatch embedded metric format.
+# When the state machine validates responses itself, this function is only invoked as a fallback
+# for the responses that the state machine couldn't validate, so the metrics only cover those fallback calls.
+# The average of the repair rate metric is the percentage of fallback calls whose response needed repairs
+# to parse, and the average of the failure rate metric is the percentage whose response didn't parse.
+def emit_metrics(event, repairs, parsed=True):
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": metrics_namespace,
+                            "Dimensions": [["StateMachine", "StateName"]],
+                            "Metrics": [
+                                {"Name": "JsonParserFallbackRepairs", "Unit": "Count"},
+                                {
+                                    "Name": "JsonParserFallbackRepairRate",
+                                    "Unit": "Percent",
+                                },
+                                {
+                                    "Name": "JsonParserFallbackParseFailures",
+                                    "Unit": "Count",
+                                },
+                                {
+                                    "Name": "JsonParserFallbackParseFailureRate",
+                                    "Unit": "Percent",
+                                },
+                            ],
+                        }
+                    ],
+                },
+                "StateMachine": event.get("state_machine_name"),
+                "StateName": event.get("step"),
+                "JsonParserFallbackRepairs": 1 if repairs else 0,
+                "JsonParserFallbackRepairRate": 100 if repairs else 0,
+                "JsonParserFallbackParseFailures": 0 if parsed else 1,
+                "JsonParserFallbackParseFailureRate": 0 if parsed else 100,
+                "Repairs": repairs,
+            }
+        )
+    )
 
 
 # Parse the JSON response string into an object and validate it against the JSON schema.
 # Return the validated object.
 def handler(event, context):
     response_string = event["response_string"]
-    response_object = json.loads(response_string)
+    try:
+        response_object, repairs = parse_json_response(response_string)
+    except json.JSONDecodeError:
+        emit_metrics(event, [], parsed=False)
+        raise
+    emit_metrics(event, repairs)
 
     json_schema = event["json_schema"]
-    validate(instance=response_object, schema=json_schema)
+    validator = get_validator(json.dumps(json_schema))
+    # Raise the same error as jsonschema.validate
+    error = best_match(validator.iter_errors(response_object))
+    if error is not None:
+        raise error
 
     return response_object
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+import boto3
+
+# Set DYNAMODB_ENDPOINT_URL to use a local table instead, such as DynamoDB Local
+dynamodb_client = boto3.client(
+    "dynamodb", endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL") or None
+)
+table_name = os.environ.get("RESPONSE_CACHE_TABLE")
+
+metrics_namespace = "PromptChainDemo"
+
+
+# The cache key is a hash of everything that determines the model's response:
+# the model ID, and the request body with the messages and the inference parameters
+def get_cache_key(model_id, body):
+    canonical_request = json.dumps(
+        {"model_id": model_id, "body": body},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+
+
+# Print the cache hit or miss in the CloudWatch embedded metric format
+def emit_metrics(event, is_hit):
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": metrics_namespace,
+                            "Dimensions": [["StateMachine", "StateName"]],
+                            "Metrics": [
+                                {"Name": "ResponseCacheHits", "Unit": "Count"},
+                                {"Name": "ResponseCacheMisses", "Unit": "Count"},
+                            ],
+                        }
+                    ],
+                },
+                "StateMachine": event.get("state_machine_name"),
+                "StateName": event.get("step"),
+                "ResponseCacheHits": 1 if is_hit else 0,
+                "ResponseCacheMisses": 0 if is_hit else 1,
+            }
+        )
+    )
+
+
+def get(event):
+    response = dynamodb_client.get_item(
+        TableName=table_name,
+        Key={"cache_key": {"S": get_cache_key(event["model_id"], event["body"])}},
+    )
+    item = response.get("Item")
+
+    # DynamoDB deletes expired items some time after they expire, so check the expiration time too
+    is_hit = item is not None and int(item["expires_at"]["N"]) > time.time()
+    emit_metrics(event, is_hit)
+    if not is_hit:
+        return {"cache_hit": False}
+
+    # A cached response doesn't use any tokens
+    return {
+        **json.loads(item["response"]["S"]),
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+        "cache_hit": True,
+    }
+
+
+def put(event):
+    response = {
+        key: event["response"][key]
+        for key in ["message", "stop_reason", "model_id"]
+        if key in event["response"]
+    }
+    dynamodb_client.put_item(
+        TableName=table_name,
+        Item={
+            "cache_key": {"S": get_cache_key(event["model_id"], event["body"])},
+            "response": {"S": json.dumps(response)},
+            "expires_at": {"N": str(int(time.time()) + event["ttl_seconds"])},
+        },
+    )
+    return {}
+
+
+def handler(event, context):
+    operation = event["operation"]
+    if operation == "get":
+        return get(event)
+    elif operation == "put":
+        return put(event)
+    else:
+        raise ValueError(f"Unknown response cache operation: {operation}")
@@ -0,0 +1,234 @@
+from functools import lru_cache
+import hashlib
+import io
+import json
+import os
+import time
+import boto3
+import botocore
+import numpy as np
+
+s3_client = boto3.client("s3")
+bedrock_client = boto3.client("bedrock-runtime")
+bucket_name = os.environ.get("SEMANTIC_CACHE_BUCKET")
+embedding_model_id = os.environ.get(
+    "EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0"
+)
+embedding_dimensions = 512
+
+# Keep each index small enough to search with a single matrix-vector product
+max_index_entries = 1000
+
+# Other concurrent Lambda environments may add entries to the same index in S3,
+# so check whether the index changed at most this often
+index_refresh_interval_seconds = 5
+
+metrics_namespace = "PromptChainDemo"
+
+
+# Titan returns normalized embeddings, so the dot product of two embeddings is their cosine similarity.
+# The same key is embedded when looking up the cache and again when storing the response after a miss.
+# Keys that only differ in case and whitespace get the same embedding.
+def embed(text):
+    return embed_normalized(" ".join(text.lower().split()))
+
+
+@lru_cache(maxsize=256)
+def embed_normalized(text):
+    response = bedrock_client.invoke_model(
+        modelId=embedding_model_id,
+        body=json.dumps(
+            {
+                "inputText": text,
+                "dimensions": embedding_dimensions,
+                "normalize": True,
+            }
+        ),
+    )
+    embedding = np.asarray(
+        json.loads(response["body"].read())["embedding"], dtype=np.float32
+    )
+    embedding.flags.writeable = False
+    return embedding
+
+
+# Each step has its own index, keyed by a hash of everything other than the cache key that
+# determines the model's response: the step, the model ID, and the inference parameters
+def get_index_key(namespace):
+    canonical_namespace = json.dumps(
+        namespace, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    digest = hashlib.sha256(canonical_namespace.encode("utf-8")).hexdigest()
+    return f"semantic-cache/{digest}.npz"
+
+
+# A vector index of cache key embeddings and their cached responses, kept in memory and persisted to S3.
+# The index is written back to S3 as a whole, so when two environments add an entry to the same index
+# at the same time, the last writer wins and the other entry is dropped. That only costs a cache miss.
+class SemanticIndex:
+    def __init__(self, key):
+        self.key = key
+        self.etag = None
+        self.refreshed_at = 0
+        self.clear()
+
+    def clear(self):
+        self.embeddings = np.empty((0, embedding_dimensions), dtype=np.float32)
+        self.expires_at = np.empty(0, dtype=np.float64)
+        self.responses = []
+
+    def refresh(self, force=False):
+        if (
+            not force
+            and time.time() - self.refreshed_at < index_refresh_interval_seconds
+        ):
+            return
+
+        request = {"Bucket": bucket_name, "Key": self.key}
+        if self.etag is not None:
+            request["IfNoneMatch"] = self.etag
+        try:
+            response = s3_client.get_object(**request)
+        except botocore.exceptions.ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "NoSuchKey":
+                self.clear()
+                self.etag = None
+            elif error_code not in ["304", "NotModified"]:
+                raise
+        else:
+            with np.load(io.BytesIO(response["Body"].read())) as data:
+                self.embeddings = data["embeddings"]
+                self.expires_at = data["expires_at"]
+                self.responses = json.loads(data["responses"].tobytes())
+            self.etag = response["ETag"]
+        self.refreshed_at = time.time()
+
+    def save(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            embeddings=self.embeddings,
+            expires_at=self.expires_at,
+            responses=np.frombuffer(
+                json.dumps(self.responses).encode("utf-8"), dtype=np.uint8
+            ),
+        )
+        response = s3_client.put_object(
+            Bucket=bucket_name, Key=self.key, Body=buffer.getvalue()
+        )
+        self.etag = response["ETag"]
+        self.refreshed_at = time.time()
+
+    # Returns the most similar unexpired entry's response and similarity,
+    # or None if no entry is at least as similar as the threshold.
+    # The similarity is None too when there is no unexpired entry.
+    def find(self, embedding, similarity_threshold):
+        live = self.expires_at > time.time()
+        if not live.any():
+            return None, None
+        similarities = self.embeddings @ embedding
+        similarities[~live] = -np.inf
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < similarity_threshold:
+            return None, similarity
+        return self.responses[best], similarity
+
+    def add(self, embedding, response, ttl_seconds):
+        # Start from the latest index in S3, to keep the entries that other environments added
+        self.refresh(force=True)
+
+        now = time.time()
+        live = self.expires_at > now
+        embeddings = np.vstack([self.embeddings[live], embedding[np.newaxis, :]])
+        expires_at = np.append(self.expires_at[live], now + ttl_seconds)
+        responses = [r for r, is_live in zip(self.responses, live) if is_live]
+        responses.append(response)
+
+        # Evict the oldest entries when the index is full
+        self.embeddings = embeddings[-max_index_entries:]
+        self.expires_at = expires_at[-max_index_entries:]
+        self.responses = responses[-max_index_entries:]
+        self.save()
+
+
+indexes = {}
+
+
+def get_index(namespace):
+    key = get_index_key(namespace)
+    if key not in indexes:
+        indexes[key] = SemanticIndex(key)
+    index = indexes[key]
+    index.refresh()
+    return index
+
+
+# Print the cache hit or miss in the CloudWatch embedded metric format.
+# The average of the hit ratio metric is the percentage of lookups that were cache hits.
+# The similarity of the most similar entry is left out when the index has no unexpired entries.
+def emit_metrics(event, is_hit, similarity):
+    metrics = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": metrics_namespace,
+                    "Dimensions": [["StateMachine", "StateName"]],
+                    "Metrics": [
+                        {"Name": "SemanticCacheHits", "Unit": "Count"},
+                        {"Name": "SemanticCacheMisses", "Unit": "Count"},
+                        {"Name": "SemanticCacheHitRatio", "Unit": "Percent"},
+                    ],
+                }
+            ],
+        },
+        "StateMachine": event.get("state_machine_name"),
+        "StateName": event.get("step"),
+        "SemanticCacheHits": 1 if is_hit else 0,
+        "SemanticCacheMisses": 0 if is_hit else 1,
+        "SemanticCacheHitRatio": 100 if is_hit else 0,
+    }
+    if similarity is not None:
+        metrics["Similarity"] = similarity
+    print(json.dumps(metrics))
+
+
+def get(event):
+    index = get_index(event["namespace"])
+    response, similarity = index.find(
+        embed(event["cache_key"]), event["similarity_threshold"]
+    )
+    is_hit = response is not None
+    emit_metrics(event, is_hit, similarity)
+    if not is_hit:
+        return {"cache_hit": False}
+
+    # A cached response doesn't use any tokens
+    return {
+        **response,
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+        "cache_hit": True,
+    }
+
+
+def put(event):
+    response = {
+        key: event["response"][key]
+        for key in ["message", "stop_reason", "model_id"]
+        if key in event["response"]
+    }
+    index = get_index(event["namespace"])
+    index.add(embed(event["cache_key"]), response, event["ttl_seconds"])
+    return {}
+
+
+def handler(event, context):
+    operation = event["operation"]
+    if operation == "get":
+        return get(event)
+    elif operation == "put":
+        return put(event)
+    else:
+        raise ValueError(f"Unknown semantic cache operation: {operation}")
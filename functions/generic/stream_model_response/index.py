@@ -0,0 +1,138 @@
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import EventStreamError
+
+bedrock_client = boto3.client("bedrock-runtime")
+dynamodb_client = boto3.client("dynamodb")
+table_name = os.environ.get("RESPONSE_STREAM_TABLE")
+
+# Buffer the generated text and write it in chunks, instead of writing every token separately
+flush_interval_seconds = 0.25
+flush_size = 400
+# The chunks are only read while the execution is running, so they expire after a day
+expiration_seconds = 24 * 60 * 60
+
+
+# Writes the text of a streamed response to the response stream table, in order.
+# The last chunk is marked as done, so readers know the response is complete.
+# A retried or fallback invocation streams the response again under the same stream key,
+# so it continues after the chunks of the previous attempt, and its first chunk is marked as a reset,
+# so readers discard the partial text of the previous attempt.
+class ChunkWriter:
+    def __init__(self, stream_key):
+        self.stream_key = stream_key
+        self.expires_at = int(time.time()) + expiration_seconds
+        self.chunk_index = self.get_next_chunk_index()
+        self.reset = True
+        self.buffer = []
+        self.buffer_size = 0
+        self.last_flush_time = time.monotonic()
+
+    def get_next_chunk_index(self):
+        response = dynamodb_client.query(
+            TableName=table_name,
+            KeyConditionExpression="execution_name = :execution_name",
+            ExpressionAttributeValues={":execution_name": {"S": self.stream_key}},
+            ProjectionExpression="chunk_index",
+            ScanIndexForward=False,
+            Limit=1,
+            ConsistentRead=True,
+        )
+        if not response["Items"]:
+            return 0
+        return int(response["Items"][0]["chunk_index"]["N"]) + 1
+
+    def add(self, text):
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if (
+            self.buffer_size >= flush_size
+            or time.monotonic() - self.last_flush_time >= flush_interval_seconds
+        ):
+            self.flush()
+
+    def flush(self, done=False):
+        dynamodb_client.put_item(
+            TableName=table_name,
+            Item={
+                "execution_name": {"S": self.stream_key},
+                "chunk_index": {"N": str(self.chunk_index)},
+                "text": {"S": "".join(self.buffer)},
+                "done": {"BOOL": done},
+                "reset": {"BOOL": self.reset},
+                "expires_at": {"N": str(self.expires_at)},
+            },
+        )
+        self.chunk_index += 1
+        self.reset = False
+        self.buffer = []
+        self.buffer_size = 0
+        self.last_flush_time = time.monotonic()
+
+    def close(self):
+        self.flush(done=True)
+
+
+# Errors that are sent in the response stream are raised with the name of the matching Bedrock error,
+# like ThrottlingException or ModelStreamErrorException, so the task's retries and fallback apply to them
+# instead of the partial response being returned as a success.
+def get_stream_error(error_name, message):
+    return type(error_name, (Exception,), {})(message)
+
+
+def read_stream_chunks(stream):
+    try:
+        for stream_event in stream:
+            chunk = json.loads(stream_event["chunk"]["bytes"])
+            if chunk["type"] == "error":
+                raise get_stream_error(
+                    "ModelStreamErrorException",
+                    f"{chunk['error']['type']}: {chunk['error']['message']}",
+                )
+            yield chunk
+    except EventStreamError as error:
+        error_code = error.response["Error"]["Code"]
+        raise get_stream_error(
+            error_code[0].upper() + error_code[1:],
+            error.response["Error"].get("Message", str(error)),
+        ) from error
+
+
+def handler(event, context):
+    response = bedrock_client.invoke_model_with_response_stream(
+        modelId=event["model_id"],
+        body=json.dumps(event["body"]),
+    )
+
+    writer = ChunkWriter(event["stream_key"])
+    role = "assistant"
+    text = []
+    stop_reason = None
+    usage = {}
+    for chunk in read_stream_chunks(response["body"]):
+        if chunk["type"] == "message_start":
+            role = chunk["message"]["role"]
+            usage.update(chunk["message"].get("usage", {}))
+        elif (
+            chunk["type"] == "content_block_delta"
+            and chunk["delta"]["type"] == "text_delta"
+        ):
+            text.append(chunk["delta"]["text"])
+            writer.add(chunk["delta"]["text"])
+        elif chunk["type"] == "message_delta":
+            stop_reason = chunk["delta"].get("stop_reason")
+            usage.update(chunk.get("usage", {}))
+    writer.close()
+
+    # The same shape as the result of the Step Functions Bedrock InvokeModel task,
+    # so that the following steps don't depend on how the model was invoked
+    return {
+        "Body": {
+            "role": role,
+            "content": [{"type": "text", "text": "".join(text)}],
+            "stop_reason": stop_reason,
+            "usage": usage,
+        }
+    }
@@ -0,0 +1,90 @@
+import json
+import time
+
+metrics_namespace = "PromptChainDemo"
+
+# The token counts reported by Claude models in the usage of a response
+token_counts = {
+    "input_tokens": "InputTokens",
+    "output_tokens": "OutputTokens",
+    "cache_read_input_tokens": "CacheReadInputTokens",
+    "cache_creation_input_tokens": "CacheWriteInputTokens",
+}
+
+
+# Usage records from parallel branches and map iterations can be nested in arrays
+def flatten_records(records):
+    for record in records or []:
+        if isinstance(record, list):
+            yield from flatten_records(record)
+        elif record:
+            yield record
+
+
+def get_token_counts(usage):
+    return {key: (usage or {}).get(key) or 0 for key in token_counts.keys()}
+
+
+def add_token_counts(total, counts):
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+
+
+# Print the token counts of a model invocation in the CloudWatch embedded metric format,
+# so that CloudWatch extracts them as metrics from the function's logs
+def emit_metrics(state_machine_name, record, counts):
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": metrics_namespace,
+                            "Dimensions": [["StateMachine", "StateName", "ModelId"]],
+                            "Metrics": [
+                                {"Name": metric_name, "Unit": "Count"}
+                                for metric_name in token_counts.values()
+                            ],
+                        }
+                    ],
+                },
+                "StateMachine": state_machine_name,
+                "StateName": record["step"],
+                "ModelId": record["model_id"],
+                "StopReason": record.get("stop_reason"),
+                **{
+                    metric_name: counts[key]
+                    for key, metric_name in token_counts.items()
+                },
+            }
+        )
+    )
+
+
+def handler(event, context):
+    total = get_token_counts({})
+    steps = {}
+    invocations = 0
+    for record in flatten_records(event["usage_records"]):
+        counts = get_token_counts(record.get("usage"))
+        emit_metrics(event["state_machine_name"], record, counts)
+
+        invocations += 1
+        add_token_counts(total, counts)
+        step_key = (record["step"], record["model_id"])
+        if step_key not in steps:
+            steps[step_key] = {
+                "step": record["step"],
+                "model_id": record["model_id"],
+                "invocations": 0,
+                **get_token_counts({}),
+            }
+        steps[step_key]["invocations"] += 1
+        add_token_counts(steps[step_key], counts)
+
+    return {
+        "invocations": invocations,
+        **total,
+        "steps": list(steps.values()),
+    }
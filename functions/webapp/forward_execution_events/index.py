@@ -0,0 +1,69 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import boto3
+
+sqs_client = boto3.client("sqs")
+queue_url = os.environ.get("EXECUTION_EVENTS_QUEUE_URL")
+
+
+# Convert a Step Functions execution log entry into the same shape as an event returned by
+# the GetExecutionHistory API, keeping only the fields that the webapp uses to display task status
+def to_history_event(log_entry):
+    event = {
+        "id": int(log_entry["id"]),
+        "type": log_entry["type"],
+        "previousEventId": int(log_entry["previous_event_id"]),
+    }
+    details = log_entry.get("details") or {}
+    if log_entry["type"].endswith("StateEntered") and "name" in details:
+        event["stateEnteredEventDetails"] = {"name": details["name"]}
+    elif log_entry["type"] == "TaskSubmitted":
+        event["taskSubmittedEventDetails"] = {
+            "resourceType": details.get("resourceType"),
+            "resource": details.get("resource"),
+        }
+    return event
+
+
+# Each execution's updates are in their own message group of the FIFO queue, so that they are
+# received in order, and an update that the webapp fails to handle only holds up its own execution
+def send_execution_update(execution_arn, message, deduplication_key):
+    sqs_client.send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps(message),
+        MessageGroupId=hashlib.sha256(execution_arn.encode("utf-8")).hexdigest(),
+        MessageDeduplicationId=hashlib.sha256(
+            deduplication_key.encode("utf-8")
+        ).hexdigest(),
+    )
+
+
+# This function is subscribed to the execution log groups of the demo state machines,
+# and is the target of the EventBridge rule for their execution status changes.
+# It forwards both to the webapp's queue, so that the webapp can display task progress
+# without polling the execution history.
+def handler(event, context):
+    if "awslogs" not in event:
+        # An execution status change from EventBridge
+        send_execution_update(event["detail"]["executionArn"], event, event["id"])
+        return
+
+    log_data = json.loads(gzip.decompress(base64.b64decode(event["awslogs"]["data"])))
+
+    events_by_execution_arn = {}
+    for log_event in log_data["logEvents"]:
+        log_entry = json.loads(log_event["message"])
+        execution_arn = log_entry["execution_arn"]
+        if execution_arn not in events_by_execution_arn:
+            events_by_execution_arn[execution_arn] = []
+        events_by_execution_arn[execution_arn].append(to_history_event(log_entry))
+
+    for execution_arn, events in events_by_execution_arn.items():
+        send_execution_update(
+            execution_arn,
+            {"execution_arn": execution_arn, "events": events},
+            f"{execution_arn}:{events[0]['id']}:{events[-1]['id']}",
+        )
@@ -9,11 +9,36 @@ AWS_ACCOUNT_ID=`aws sts get-caller-identity --query Account --output text`
 
 EXECUTION_NAME=local-test-`uuidgen`
 
+STATE_MACHINE_ARN=arn:aws:states:us-west-2:$AWS_ACCOUNT_ID:stateMachine:PromptChainDemo-$DEMO_NAME
+
+# Express state machines (see express_workflows in cdk_stacks.py) can't be described with DescribeExecution,
+# so run them synchronously instead.
+# Synchronous executions can take up to 5 minutes.
+STATE_MACHINE_TYPE=`aws stepfunctions describe-state-machine --region us-west-2 --query type --output text --state-machine-arn $STATE_MACHINE_ARN`
+if [ "$STATE_MACHINE_TYPE" = "EXPRESS" ]; then
+    echo "Running synchronous execution $EXECUTION_NAME for Express state machine PromptChainDemo-$DEMO_NAME"
+    RESULT=`aws stepfunctions start-sync-execution \
+        --region us-west-2 \
+        --cli-read-timeout 300 \
+        --name $EXECUTION_NAME \
+        --state-machine-arn $STATE_MACHINE_ARN \
+        --input file://test-inputs/$DEMO_NAME.json`
+    STATUS=`echo "$RESULT" | jq -r .status`
+    echo -e "\nExecution completed. Status is $STATUS"
+    if [ "$STATUS" = "SUCCEEDED" ]; then
+        echo "Output:"
+        echo "$RESULT" | jq -r .output | jq
+        exit 0
+    fi
+    echo "$RESULT" | jq '{error, cause}'
+    exit 1
+fi
+
 echo "Starting execution $EXECUTION_NAME for state machine PromptChainDemo-$DEMO_NAME"
 aws stepfunctions start-execution \
     --region us-west-2 \
     --name $EXECUTION_NAME \
-    --state-machine-arn arn:aws:states:us-west-2:$AWS_ACCOUNT_ID:stateMachine:PromptChainDemo-$DEMO_NAME \
+    --state-machine-arn $STATE_MACHINE_ARN \
     --input file://test-inputs/$DEMO_NAME.json
 
 echo -e "\nWatch the execution at:"
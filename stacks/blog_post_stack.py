@@ -5,13 +5,30 @@ from aws_cdk import (
 )
 from constructs import Construct
 
-from .util import get_anthropic_claude_invoke_chain, get_bedrock_iam_policy_statement
+from .util import (
+    get_anthropic_claude_invoke_chain,
+    get_bedrock_iam_policy_statement,
+    get_response_stream_table,
+    get_state_machine_logs,
+    get_usage_summary_step,
+)
 
 
 class BlogPostStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        express: bool = False,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Each agent runs in compact mode: its messages are built and its response is extracted
+        # inside the model invocation task, instead of in separate Pass states.
+        # Each agent also records its token usage, which is summarized at the end of the workflow.
+
         # Agent #1: write book summary
         summary_job = get_anthropic_claude_invoke_chain(
             self,
@@ -21,8 +38,13 @@ class BlogPostStack(Stack):
                 sfn.JsonPath.string_at("$$.Execution.Input.novel"),
             ),
             include_previous_conversation_in_prompt=False,
+            compact=True,
+            record_usage=True,
         )
 
+        # Each of the following agents includes the previous conversation in its prompt.
+        # With prompt caching, each agent reads the conversation so far from the cache.
+
         # Agent #2: describe the plot
         plot_job = get_anthropic_claude_invoke_chain(
             self,
@@ -31,6 +53,9 @@ class BlogPostStack(Stack):
                 "Write a paragraph describing the plot of the book {}.",
                 sfn.JsonPath.string_at("$$.Execution.Input.novel"),
             ),
+            enable_prompt_caching=True,
+            compact=True,
+            record_usage=True,
         )
 
         # Agent #3: analyze key themes
@@ -41,6 +66,9 @@ class BlogPostStack(Stack):
                 "Write a paragraph analyzing the key themes of the book {}.",
                 sfn.JsonPath.string_at("$$.Execution.Input.novel"),
             ),
+            enable_prompt_caching=True,
+            compact=True,
+            record_usage=True,
         )
 
         # Agent #4: analyze writing style
@@ -51,6 +79,9 @@ class BlogPostStack(Stack):
                 "Write a paragraph discussing the writing style and tone of the book {}.",
                 sfn.JsonPath.string_at("$$.Execution.Input.novel"),
             ),
+            enable_prompt_caching=True,
+            compact=True,
+            record_usage=True,
         )
 
         # Agent #5: write the blog post
@@ -67,12 +98,24 @@ class BlogPostStack(Stack):
             ),
             max_tokens_to_sample=1000,
             pass_conversation=False,
+            enable_prompt_caching=True,
+            compact=True,
+            record_usage=True,
+            # The blog post is streamed to the webapp as it is written
+            response_stream_table=get_response_stream_table(
+                self, "PromptChainDemo-BlogPost"
+            ),
         )
 
+        summarize_usage_job = get_usage_summary_step(self, "Summarize Token Usage")
+
         select_final_answer = sfn.Pass(
             self,
             "Select Final Answer",
-            output_path="$.model_outputs.response",
+            parameters={
+                "blog_post": sfn.JsonPath.string_at("$.model_outputs.response"),
+                "usage": sfn.JsonPath.object_at("$.usage"),
+            },
         )
 
         # Hook the agents together into simple pipeline
@@ -81,6 +124,7 @@ class BlogPostStack(Stack):
             .next(themes_job)
             .next(writing_style_job)
             .next(blog_post_job)
+            .next(summarize_usage_job)
             .next(select_final_answer)
         )
 
@@ -89,6 +133,19 @@ class BlogPostStack(Stack):
             "BlogPostWorkflow",
             state_machine_name="PromptChainDemo-BlogPost",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            # This workflow completes within the five minute limit for Express workflows,
+            # so it can optionally run as an Express workflow that the webapp starts synchronously
+            state_machine_type=(
+                sfn.StateMachineType.EXPRESS
+                if express
+                else sfn.StateMachineType.STANDARD
+            ),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-BlogPost",
+                # The webapp follows the progress of Express workflows in their execution logs
+                log_execution_events=log_execution_events or express,
+            ),
             timeout=Duration.minutes(5),
         )
 
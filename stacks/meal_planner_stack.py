@@ -9,15 +9,23 @@ from aws_cdk import (
 from constructs import Construct
 
 from .util import (
+    ConversationPolicy,
     get_lambda_bundling_options,
     get_anthropic_claude_invoke_chain,
     get_json_response_parser_step,
     get_bedrock_iam_policy_statement,
+    get_state_machine_logs,
 )
 
 
 class MealPlannerStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         chefs = ["red", "blue"]
@@ -102,16 +110,8 @@ An example of a valid response is below, inside <example></example> XML tags.
 </example>
 Do not include any other content other than the JSON object in your response. Do not include any XML tags in your response. Do not wrap the JSON in markdown code blocks or backticks."""
 
-        meal_scoring_job = get_anthropic_claude_invoke_chain(
-            self,
-            "Score Meals",
-            prompt=sfn.JsonPath.format(
-                meal_scoring_prompt, *meal_scoring_prompt_arguments
-            ),
-            max_tokens_to_sample=500,
-            include_previous_conversation_in_prompt=False,
-        )
-
+        # The scoring and referee steps are forced to respond with JSON that complies with their schemas,
+        # which is then validated by the parser steps
         meal_scores_json_schema = {
             "type": "object",
             "properties": {},
@@ -130,6 +130,17 @@ Do not include any other content other than the JSON object in your response. Do
             }
             meal_scores_json_schema["required"].append(f"{chef}_chef")
 
+        meal_scoring_job = get_anthropic_claude_invoke_chain(
+            self,
+            "Score Meals",
+            prompt=sfn.JsonPath.format(
+                meal_scoring_prompt, *meal_scoring_prompt_arguments
+            ),
+            max_tokens_to_sample=500,
+            include_previous_conversation_in_prompt=False,
+            json_schema=meal_scores_json_schema,
+        )
+
         parse_meal_scores = get_json_response_parser_step(
             self,
             "Parse Meal Scores",
@@ -213,6 +224,11 @@ Do not provide a full recipe, only provide a one or two sentence description of
                 prompt=sfn.JsonPath.format(prompt, *prompt_arguments),
                 max_tokens_to_sample=500,
                 include_previous_conversation_in_prompt=True,
+                # Each debate round's prompt includes the other chefs' latest answers,
+                # so only the chef's own most recent rounds need to be kept in the conversation
+                conversation_policy=ConversationPolicy.first_and_last_turns(
+                    2, max_tokens=4000
+                ),
                 input_json_path=f"$.{meal_key}.model_inputs",
                 output_json_path=f"$.{meal_key}.model_outputs",
             )
@@ -292,26 +308,29 @@ Another example of a valid response is below when the chefs do not agree, inside
 </example>
 Do not include any other content other than the JSON object in your response. Do not include any XML tags in your response. Do not wrap the JSON in markdown code blocks or backticks."""
 
+        referee_json_schema = {
+            "type": "object",
+            "properties": {
+                "reasoning": {"type": "string"},
+                "do_chefs_agree": {"type": "string", "enum": ["yes", "no"]},
+            },
+            "required": ["reasoning", "do_chefs_agree"],
+            "additionalProperties": False,
+        }
+
         meal_debate_referee_job = get_anthropic_claude_invoke_chain(
             self,
             "Referee Meal Debate",
             prompt=sfn.JsonPath.format(referee_prompt, *referee_prompt_arguments),
             max_tokens_to_sample=500,
             include_previous_conversation_in_prompt=False,
+            json_schema=referee_json_schema,
         )
 
         parse_referee_response = get_json_response_parser_step(
             self,
             "Parse Referee Response",
-            json_schema={
-                "type": "object",
-                "properties": {
-                    "reasoning": {"type": "string"},
-                    "do_chefs_agree": {"type": "string", "enum": ["yes", "no"]},
-                },
-                "required": ["reasoning", "do_chefs_agree"],
-                "additionalProperties": False,
-            },
+            json_schema=referee_json_schema,
             output_key="consensus",
             result_path="$.referee_output",
         )
@@ -325,6 +344,7 @@ Do not include any other content other than the JSON object in your response. Do
             ),
             max_tokens_to_sample=500,
             include_previous_conversation_in_prompt=False,
+            json_schema=meal_scores_json_schema,
         )
 
         parse_final_meal_scores = get_json_response_parser_step(
@@ -427,6 +447,11 @@ Create a recipe for this meal, based on your previous meal suggestion and the in
             "MealPlannerWorkflow",
             state_machine_name="PromptChainDemo-MealPlanner",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-MealPlanner",
+                log_execution_events=log_execution_events,
+            ),
             timeout=Duration.minutes(5),
         )
 
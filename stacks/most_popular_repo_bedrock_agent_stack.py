@@ -12,13 +12,20 @@ from aws_cdk import (
 )
 from constructs import Construct
 from .inference_profile import InferenceProfile
+from .util import get_state_machine_logs
 import os
 
 dirname = os.path.dirname(__file__)
 
 
 class MostPopularRepoBedrockAgentStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         ### Bedrock Agent resources ###
@@ -212,5 +219,10 @@ class MostPopularRepoBedrockAgentStack(Stack):
             "MostPopularRepoWorkflow",
             state_machine_name="PromptChainDemo-MostPopularRepoBedrockAgents",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-MostPopularRepoBedrockAgents",
+                log_execution_events=log_execution_events,
+            ),
             timeout=Duration.minutes(5),
         )
@@ -9,11 +9,21 @@ from aws_cdk import (
 )
 from constructs import Construct
 
-from .util import get_bedrock_iam_policy_statement, get_lambda_bundling_options
+from .util import (
+    get_bedrock_iam_policy_statement,
+    get_lambda_bundling_options,
+    get_state_machine_logs,
+)
 
 
 class MostPopularRepoStrandsStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         github_secret = secrets.Secret.from_secret_name_v2(
@@ -69,5 +79,10 @@ class MostPopularRepoStrandsStack(Stack):
             "MostPopularRepoWorkflow",
             state_machine_name="PromptChainDemo-MostPopularRepoStrands",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-MostPopularRepoStrands",
+                log_execution_events=log_execution_events,
+            ),
             timeout=Duration.minutes(5),
         )
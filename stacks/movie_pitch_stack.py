@@ -15,11 +15,19 @@ from .util import (
     get_anthropic_claude_prepare_prompt_step,
     get_anthropic_claude_invoke_model_step,
     get_bedrock_iam_policy_statement,
+    get_response_stream_table,
+    get_state_machine_logs,
 )
 
 
 class MoviePitchStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Step #1: Let the model generate various movie pitch options
@@ -58,11 +66,15 @@ Start with a tagline sentence that describes the movie as a whole, then follow w
                 include_previous_conversation_in_prompt=False,
             )
 
+            # The pitches are generated in parallel, so a burst of throttling can hit all of them at once.
+            # A pitch generation that is still throttled after its retries falls back to
+            # the US inference profile, which has its own quota.
             generate_pitch_invoke_model = get_anthropic_claude_invoke_model_step(
                 self,
                 f"Generate {temperature_name} Movie Pitch",
                 max_tokens_to_sample=1024,
                 temperature=temperature_value,
+                fallback_claude_model_id="us.anthropic.claude-haiku-4-5-20251001-v1:0",
             )
 
             extract_pitch = sfn.Pass(
@@ -70,7 +82,7 @@ Start with a tagline sentence that describes the movie as a whole, then follow w
                 f"Generate {temperature_name} Movie Pitch (Extract Pitch)",
                 parameters={
                     f"pitch_{temperature_name.lower()}": sfn.JsonPath.string_at(
-                        "$.model_outputs.content[0].text"
+                        "$.model_outputs.message.content[0].text"
                     ),
                 },
             )
@@ -136,6 +148,8 @@ Screenwriters previously pitched you on {len(temperature_settings)} movie ideas,
             temperature=0.3,
             include_previous_conversation_in_prompt=False,
             pass_conversation=False,
+            # The choice between the same pitches is near-deterministic at a low temperature
+            response_cache_ttl=Duration.days(1),
         )
 
         # Step #3: Let the human user decide whether to greenlight the movie pitch.
@@ -193,7 +207,11 @@ Screenwriters previously pitched you on {len(temperature_settings)} movie ideas,
             )
         )
 
-        # Step #4: Develop the movie idea into a one-pager
+        # Step #4: Develop the movie idea into a one-pager.
+        # The one-pager is streamed to the webapp as it is generated.
+        response_stream_table = get_response_stream_table(
+            self, "PromptChainDemo-MoviePitch"
+        )
         pitch_one_pager_job = get_anthropic_claude_invoke_chain(
             self,
             "Generate Movie Pitch One-Pager",
@@ -210,6 +228,7 @@ Now create a one-page movie pitch, based on your previous short description for
             max_tokens_to_sample=2048,
             include_previous_conversation_in_prompt=False,
             pass_conversation=False,
+            response_stream_table=response_stream_table,
         )
 
         select_movie_pitch = sfn.Pass(
@@ -255,6 +274,11 @@ Now create a one-page movie pitch, based on your previous short description for
             "MoviePitchWorkflow",
             state_machine_name="PromptChainDemo-MoviePitch",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-MoviePitch",
+                log_execution_events=log_execution_events,
+            ),
             # 1 hour to account for getting user feedback in the UI
             timeout=Duration.hours(1),
         )
@@ -9,17 +9,48 @@ from aws_cdk import (
 from constructs import Construct
 
 from .util import (
+    default_claim_check_size_threshold,
     get_anthropic_claude_invoke_chain,
+    get_claim_check_bucket,
+    get_claim_check_load_step,
+    get_claim_check_store_step,
     get_json_response_parser_step,
     get_bedrock_iam_policy_statement,
+    get_response_stream_table,
+    get_state_machine_logs,
+    get_usage_summary_step,
 )
 
 
 class StoryWriterStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        express: bool = False,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Agent #1: create characters
+        # The model is forced to respond with JSON that complies with the schema,
+        # which is then validated by the parser step
+        characters_json_schema = {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                },
+                "required": ["name", "description"],
+                "additionalProperties": False,
+            },
+            "minItems": 5,
+            "maxItems": 5,
+            "uniqueItems": True,
+        }
         characters_job = get_anthropic_claude_invoke_chain(
             self,
             "Generate Characters",
@@ -48,31 +79,29 @@ Do not include any other content other than the JSON object in your response. Do
             ),
             max_tokens_to_sample=1024,
             include_previous_conversation_in_prompt=False,
+            record_usage=True,
+            json_schema=characters_json_schema,
         )
 
         parse_characters_step = get_json_response_parser_step(
             self,
             "Parse Characters",
-            json_schema={
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string"},
-                        "description": {"type": "string"},
-                    },
-                    "required": ["name", "description"],
-                    "additionalProperties": False,
-                },
-                "minItems": 5,
-                "maxItems": 5,
-                "uniqueItems": True,
-            },
+            json_schema=characters_json_schema,
             output_key="characters",
             result_path="$.parsed_output",
         )
 
+        # The conversation is copied into every Map item and returned in every Map result,
+        # so pass it between the steps as a claim check once it grows large
+        store_conversation_step = get_claim_check_store_step(
+            self, "Store Conversation", "$.model_outputs.conversation"
+        )
+
         # Agent #2: create character story arc
+        load_character_conversation_step = get_claim_check_load_step(
+            self, "Load Conversation for Character", "$.model_outputs.conversation"
+        )
+
         character_story_job = get_anthropic_claude_invoke_chain(
             self,
             "Generate Character Story Arc",
@@ -83,24 +112,66 @@ Do not include any other content other than the JSON object in your response. Do
             ),
             max_tokens_to_sample=1024,
             include_previous_conversation_in_prompt=True,
+            # The character story arcs are generated in parallel from the same conversation prefix
+            enable_prompt_caching=True,
+            record_usage=True,
+        )
+
+        store_character_conversation_step = get_claim_check_store_step(
+            self,
+            "Store Conversation for Character",
+            "$.model_outputs.conversation",
+        )
+
+        select_character_story = sfn.Pass(
+            self,
+            "Select Character Story",
+            parameters={
+                "model_outputs": sfn.JsonPath.object_at("$.model_outputs"),
+                "usage_records": sfn.JsonPath.object_at("$.usage_records"),
+            },
         )
 
         merge_character_stories_lambda = lambda_python.PythonFunction(
             self,
             "MergeCharacterStoriesAgent",
             runtime=lambda_.Runtime.PYTHON_3_13,
-            entry="functions/generic/merge_map_output",
+            # The merge shares the claim check helpers of the claim check function
+            entry="functions/generic/claim_check",
+            handler="merge_map_output",
+            environment={
+                "CLAIM_CHECK_BUCKET": get_claim_check_bucket(self).bucket_name,
+            },
+            timeout=Duration.seconds(30),
             memory_size=256,
         )
+        get_claim_check_bucket(self).grant_read_write(merge_character_stories_lambda)
 
         merge_character_stories_job = tasks.LambdaInvoke(
             self,
             "Merge Character Stories",
             lambda_function=merge_character_stories_lambda,
-            result_selector={"model_outputs": sfn.JsonPath.object_at("$.Payload")},
+            payload=sfn.TaskInput.from_object(
+                {
+                    "map_results": sfn.JsonPath.object_at("$.character_stories"),
+                    "usage_records": sfn.JsonPath.object_at("$.usage_records"),
+                    "size_threshold": default_claim_check_size_threshold,
+                    "key_prefix": sfn.JsonPath.string_at("$$.Execution.Name"),
+                }
+            ),
+            result_selector={
+                "model_outputs": {
+                    "conversation": sfn.JsonPath.object_at("$.Payload.conversation"),
+                },
+                "usage_records": sfn.JsonPath.object_at("$.Payload.usage_records"),
+            },
         )
 
         # Agent #3: write the story
+        load_story_conversation_step = get_claim_check_load_step(
+            self, "Load Conversation for Story", "$.model_outputs.conversation"
+        )
+
         story_job = get_anthropic_claude_invoke_chain(
             self,
             "Generate the Full Story",
@@ -111,19 +182,29 @@ Do not include any other content other than the JSON object in your response. Do
             max_tokens_to_sample=2048,
             include_previous_conversation_in_prompt=True,
             pass_conversation=False,
+            enable_prompt_caching=True,
+            # The story is streamed to the webapp as it is written
+            response_stream_table=get_response_stream_table(
+                self, "PromptChainDemo-StoryWriter"
+            ),
+            record_usage=True,
         )
 
+        summarize_usage_job = get_usage_summary_step(self, "Summarize Token Usage")
+
         select_story = sfn.Pass(
             self,
             "Select Story",
             parameters={
                 "story": sfn.JsonPath.string_at("$.model_outputs.response"),
+                "usage": sfn.JsonPath.object_at("$.usage"),
             },
         )
 
         # Hook the agents together into a workflow that contains a map
         chain = (
             characters_job.next(parse_characters_step)
+            .next(store_conversation_step)
             .next(
                 sfn.Map(
                     self,
@@ -134,10 +215,18 @@ Do not include any other content other than the JSON object in your response. Do
                         "model_outputs.$": "$.model_outputs",
                     },
                     max_concurrency=3,
-                ).iterator(character_story_job)
+                    # Keep the rest of the state, including the token usage records of the previous steps
+                    result_path="$.character_stories",
+                ).iterator(
+                    load_character_conversation_step.next(character_story_job)
+                    .next(store_character_conversation_step)
+                    .next(select_character_story)
+                )
             )
             .next(merge_character_stories_job)
+            .next(load_story_conversation_step)
             .next(story_job)
+            .next(summarize_usage_job)
             .next(select_story)
         )
 
@@ -146,6 +235,19 @@ Do not include any other content other than the JSON object in your response. Do
             "StoryWriterWorkflow",
             state_machine_name="PromptChainDemo-StoryWriter",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            # This workflow completes within the five minute limit for Express workflows,
+            # so it can optionally run as an Express workflow that the webapp starts synchronously
+            state_machine_type=(
+                sfn.StateMachineType.EXPRESS
+                if express
+                else sfn.StateMachineType.STANDARD
+            ),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-StoryWriter",
+                # The webapp follows the progress of Express workflows in their execution logs
+                log_execution_events=log_execution_events or express,
+            ),
             timeout=Duration.minutes(5),
         )
 
@@ -15,11 +15,19 @@ from .util import (
     get_lambda_bundling_options,
     get_anthropic_claude_invoke_chain,
     get_bedrock_iam_policy_statement,
+    get_state_machine_logs,
 )
 
 
 class TripPlannerStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        express: bool = False,
+        log_execution_events: bool = False,
+        **kwargs,
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Agent #1: suggest places to stay
@@ -192,6 +200,19 @@ The itinerary should be formatted in Markdown format.""",
             "TripPlannerWorkflow",
             state_machine_name="PromptChainDemo-TripPlanner",
             definition_body=sfn.DefinitionBody.from_chainable(chain),
+            # This workflow completes within the five minute limit for Express workflows,
+            # so it can optionally run as an Express workflow that the webapp starts synchronously
+            state_machine_type=(
+                sfn.StateMachineType.EXPRESS
+                if express
+                else sfn.StateMachineType.STANDARD
+            ),
+            logs=get_state_machine_logs(
+                self,
+                "PromptChainDemo-TripPlanner",
+                # The webapp follows the progress of Express workflows in their execution logs
+                log_execution_events=log_execution_events or express,
+            ),
             timeout=Duration.minutes(5),
         )
 
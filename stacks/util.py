@@ -1,9 +1,15 @@
 from aws_cdk import (
     Duration,
+    RemovalPolicy,
+    Stack,
+    Token,
     aws_bedrock as bedrock,
+    aws_dynamodb as dynamodb,
     aws_iam as iam,
     aws_lambda as lambda_,
     aws_lambda_python_alpha as lambda_python,
+    aws_logs as logs,
+    aws_s3 as s3,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
 )
@@ -13,6 +19,7 @@ import builtins
 import typing
 import jsii
 import json
+import re
 
 
 @jsii.implements(lambda_python.ICommandHooks)
@@ -37,12 +44,12 @@ def get_lambda_bundling_options():
     )
 
 
-def get_bedrock_iam_policy_statement():
+def get_bedrock_iam_policy_statement(
+    actions: typing.Optional[typing.List[str]] = None,
+):
     return iam.PolicyStatement(
         effect=iam.Effect.ALLOW,
-        actions=[
-            "bedrock:InvokeModel",
-        ],
+        actions=actions or ["bedrock:InvokeModel"],
         resources=[
             "arn:aws:bedrock:*::foundation-model/anthropic.claude-*",
             "arn:aws:bedrock:*::foundation-model/amazon.nova-*",
@@ -51,13 +58,820 @@ def get_bedrock_iam_policy_statement():
     )
 
 
-def add_bedrock_retries(task):
+def get_state_machine_log_group_name(state_machine_name: builtins.str):
+    return f"/aws/vendedlogs/states/{state_machine_name}"
+
+
+# Execution logs are only written when the webapp reads them: when it receives execution events
+# pushed from the logs, or when it follows the progress of an Express workflow in the logs.
+# Otherwise, the state machine isn't logged, as before.
+def get_state_machine_logs(
+    scope: Construct, state_machine_name: builtins.str, log_execution_events: bool
+):
+    if not log_execution_events:
+        return None
+
+    # The execution logs go to a log group with a well-known name, so that the webapp stack
+    # can subscribe to the execution events of each demo state machine
+    log_group = logs.LogGroup(
+        scope,
+        "StateMachineLogs",
+        log_group_name=get_state_machine_log_group_name(state_machine_name),
+        retention=logs.RetentionDays.ONE_WEEK,
+        removal_policy=RemovalPolicy.DESTROY,
+    )
+    return sfn.LogOptions(
+        destination=log_group,
+        level=sfn.LogLevel.ALL,
+        include_execution_data=False,
+    )
+
+
+# Bedrock errors are reported with a "Bedrock." prefix by the Step Functions Bedrock integration,
+# and without the prefix by Lambda functions that call Bedrock
+def get_bedrock_error_names(error_names: typing.List[str]):
+    return [
+        name
+        for error_name in error_names
+        for name in [error_name, f"Bedrock.{error_name}"]
+    ]
+
+
+bedrock_throttling_errors = get_bedrock_error_names(["ThrottlingException"])
+bedrock_transient_errors = get_bedrock_error_names(
+    [
+        "ModelTimeoutException",
+        "ServiceUnavailableException",
+        "ModelNotReadyException",
+        "ModelStreamErrorException",
+    ]
+)
+
+
+# Retry throttled and transient Bedrock errors with exponential backoff and full jitter,
+# so that parallel branches that are throttled at the same time don't retry in lockstep
+def add_bedrock_retries(
+    task,
+    throttling_max_attempts: typing.Optional[int] = 3,
+    transient_max_attempts: typing.Optional[int] = 3,
+):
+    task.add_retry(
+        errors=bedrock_throttling_errors,
+        interval=Duration.seconds(4),
+        backoff_rate=2,
+        max_attempts=throttling_max_attempts,
+        max_delay=Duration.seconds(30),
+        jitter_strategy=sfn.JitterType.FULL,
+    )
     task.add_retry(
-        errors=["ThrottlingException"],
-        interval=Duration.seconds(5),
-        max_delay=Duration.seconds(15),
+        errors=bedrock_transient_errors,
+        interval=Duration.seconds(2),
+        backoff_rate=2,
+        max_attempts=transient_max_attempts,
+        max_delay=Duration.seconds(20),
+        jitter_strategy=sfn.JitterType.FULL,
+    )
+
+
+# Route a model invocation that is still throttled after its retries to a fallback invocation,
+# which uses another inference profile or model with its own quota.
+# Both invocations continue to the same next step.
+def add_bedrock_fallback(
+    invoke_model, fallback_invoke_model, jsonata: typing.Optional[bool] = False
+):
+    if jsonata:
+        # The fallback invocation gets the same input as the throttled invocation
+        invoke_model.add_catch(
+            fallback_invoke_model,
+            errors=bedrock_throttling_errors,
+            outputs="{% $states.input %}",
+        )
+    else:
+        invoke_model.add_catch(
+            fallback_invoke_model,
+            errors=bedrock_throttling_errors,
+            result_path=sfn.JsonPath.DISCARD,
+        )
+    return sfn.Chain.custom(
+        invoke_model, [invoke_model, fallback_invoke_model], invoke_model
+    )
+
+
+# Step Functions limits the state passed between steps to 256 KB.
+# Claim-check steps keep large values like long conversations out of the state: a value larger than
+# the size threshold is stored in S3 and replaced in the state with a reference to the stored value,
+# in the form {"claim_check": {"bucket": ..., "key": ..., "size": ...}}.
+# The value is loaded back into the state only by the steps that need it, like a prompt that includes
+# the previous conversation.
+default_claim_check_size_threshold = 32 * 1024
+
+
+# The claim-check bucket and function are shared by all the claim-check steps in a stack
+def get_claim_check_bucket(scope: Construct):
+    stack = Stack.of(scope)
+    bucket = stack.node.try_find_child("ClaimCheckBucket")
+    if bucket is None:
+        bucket = s3.Bucket(
+            stack,
+            "ClaimCheckBucket",
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    id="clean-up-claim-checks",
+                    expiration=Duration.days(1),
+                    abort_incomplete_multipart_upload_after=Duration.days(1),
+                )
+            ],
+        )
+    return bucket
+
+
+def get_claim_check_function(scope: Construct):
+    stack = Stack.of(scope)
+    claim_check_lambda = stack.node.try_find_child("ClaimCheckFunction")
+    if claim_check_lambda is None:
+        bucket = get_claim_check_bucket(scope)
+        claim_check_lambda = lambda_python.PythonFunction(
+            stack,
+            "ClaimCheckFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/claim_check",
+            environment={
+                "CLAIM_CHECK_BUCKET": bucket.bucket_name,
+            },
+            timeout=Duration.seconds(30),
+            memory_size=256,
+        )
+        bucket.grant_read_write(claim_check_lambda)
+    return claim_check_lambda
+
+
+# Replace the value at the given path with a claim check, if the value is larger than the size threshold
+def get_claim_check_store_step(
+    scope: Construct,
+    id: builtins.str,
+    json_path: builtins.str,
+    size_threshold: typing.Optional[int] = default_claim_check_size_threshold,
+):
+    return tasks.LambdaInvoke(
+        scope,
+        id,
+        lambda_function=get_claim_check_function(scope),
+        payload=sfn.TaskInput.from_object(
+            {
+                "operation": "store",
+                "value": sfn.JsonPath.object_at(json_path),
+                "size_threshold": size_threshold,
+                "key_prefix": sfn.JsonPath.string_at("$$.Execution.Name"),
+            }
+        ),
+        payload_response_only=True,
+        result_path=json_path,
+    )
+
+
+# Replace the claim check at the given path with the stored value.
+# Values that are not claim checks are left as they are.
+def get_claim_check_load_step(
+    scope: Construct,
+    id: builtins.str,
+    json_path: builtins.str,
+):
+    return tasks.LambdaInvoke(
+        scope,
+        id,
+        lambda_function=get_claim_check_function(scope),
+        payload=sfn.TaskInput.from_object(
+            {
+                "operation": "load",
+                "value": sfn.JsonPath.object_at(json_path),
+            }
+        ),
+        payload_response_only=True,
+        result_path=json_path,
+    )
+
+
+# A streaming step invokes the model with InvokeModelWithResponseStream in a Lambda function, which writes
+# the response to a DynamoDB table as it is generated, so that the webapp can show the response
+# before the step completes. The chunks of the response are keyed by the execution name.
+# The table has a well-known name, so that the webapp can find the response stream of each demo state machine.
+def get_response_stream_table_name(state_machine_name: builtins.str):
+    return f"{state_machine_name}-ResponseStream"
+
+
+def get_response_stream_table(scope: Construct, state_machine_name: builtins.str):
+    return dynamodb.Table(
+        scope,
+        "ResponseStreamTable",
+        table_name=get_response_stream_table_name(state_machine_name),
+        partition_key=dynamodb.Attribute(
+            name="execution_name", type=dynamodb.AttributeType.STRING
+        ),
+        sort_key=dynamodb.Attribute(
+            name="chunk_index", type=dynamodb.AttributeType.NUMBER
+        ),
+        billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        time_to_live_attribute="expires_at",
+        removal_policy=RemovalPolicy.DESTROY,
+    )
+
+
+# The streaming function is shared by all the streaming steps in a stack
+def get_response_stream_function(
+    scope: Construct, response_stream_table: dynamodb.ITable
+):
+    stack = Stack.of(scope)
+    stream_lambda = stack.node.try_find_child("ResponseStreamFunction")
+    if stream_lambda is None:
+        stream_lambda = lambda_python.PythonFunction(
+            stack,
+            "ResponseStreamFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/stream_model_response",
+            environment={
+                "RESPONSE_STREAM_TABLE": response_stream_table.table_name,
+            },
+            timeout=Duration.minutes(5),
+            memory_size=256,
+        )
+        # The function reads the last chunk of a previous attempt to continue after it
+        response_stream_table.grant_read_write_data(stream_lambda)
+        stream_lambda.add_to_role_policy(
+            get_bedrock_iam_policy_statement(
+                actions=["bedrock:InvokeModelWithResponseStream"]
+            )
+        )
+    return stream_lambda
+
+
+# The streaming function returns the same result as the Bedrock InvokeModel task,
+# so it can replace the invoke model task in both JSONPath and JSONata chains
+def get_anthropic_claude_streaming_invoke_model_step(
+    scope: Construct,
+    id: builtins.str,
+    model: InferenceProfile,
+    body: typing.Mapping[str, typing.Any],
+    response_stream_table: dynamodb.ITable,
+    jsonata: typing.Optional[bool] = False,
+    **kwargs,
+):
+    stream_lambda = get_response_stream_function(scope, response_stream_table)
+    if jsonata:
+        invoke_model = tasks.LambdaInvoke.jsonata(
+            scope,
+            id,
+            lambda_function=stream_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "model_id": model.model_id,
+                    "body": body,
+                    "stream_key": "{% $states.context.Execution.Name %}",
+                }
+            ),
+            payload_response_only=True,
+            **kwargs,
+        )
+    else:
+        invoke_model = tasks.LambdaInvoke(
+            scope,
+            id,
+            lambda_function=stream_lambda,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "model_id": model.model_id,
+                    "body": body,
+                    "stream_key": sfn.JsonPath.string_at("$$.Execution.Name"),
+                }
+            ),
+            payload_response_only=True,
+            **kwargs,
+        )
+    return invoke_model
+
+
+# An exact-match cache for the responses of (near-)deterministic model invocations.
+# The cache key is a hash of the model ID and the request body, which includes the messages and the inference
+# parameters. A cached response expires after the cache's TTL.
+# The cache table and function are shared by all the cached steps in a stack.
+def get_response_cache_function(scope: Construct):
+    stack = Stack.of(scope)
+    cache_lambda = stack.node.try_find_child("ResponseCacheFunction")
+    if cache_lambda is None:
+        cache_table = dynamodb.Table(
+            stack,
+            "ResponseCacheTable",
+            partition_key=dynamodb.Attribute(
+                name="cache_key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        cache_lambda = lambda_python.PythonFunction(
+            stack,
+            "ResponseCacheFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/response_cache",
+            environment={
+                "RESPONSE_CACHE_TABLE": cache_table.table_name,
+            },
+            memory_size=256,
+        )
+        cache_table.grant_read_write_data(cache_lambda)
+    return cache_lambda
+
+
+# Check a cache before invoking the model, and store the model's response in the cache afterwards.
+# The cache function writes a cached response to the output path in the same shape as the invoke model
+# step's result, along with cache_hit, and with zero token usage. A cache hit skips the model invocation.
+def get_cache_steps(
+    scope: Construct,
+    id: builtins.str,
+    cache_name: builtins.str,
+    cache_lambda: lambda_.IFunction,
+    lookup_payload: typing.Mapping[str, typing.Any],
+    store_payload: typing.Mapping[str, typing.Any],
+    invoke_model: sfn.IChainable,
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    check_cache = tasks.LambdaInvoke(
+        scope,
+        id + f" (Check {cache_name})",
+        lambda_function=cache_lambda,
+        payload=sfn.TaskInput.from_object(
+            {
+                "operation": "get",
+                **lookup_payload,
+                "step": id,
+                "state_machine_name": sfn.JsonPath.string_at("$$.StateMachine.Name"),
+            }
+        ),
+        payload_response_only=True,
+        result_path=output_json_path,
+    )
+    store_in_cache = tasks.LambdaInvoke(
+        scope,
+        id + f" (Update {cache_name})",
+        lambda_function=cache_lambda,
+        payload=sfn.TaskInput.from_object(
+            {
+                "operation": "put",
+                **store_payload,
+                "response": sfn.JsonPath.object_at(output_json_path),
+            }
+        ),
+        payload_response_only=True,
+        result_path=sfn.JsonPath.DISCARD,
+    )
+    use_cached_response = sfn.Pass(scope, id + f" (Use {cache_name} Hit)")
+    invoke_and_store = sfn.Chain.start(invoke_model).next(store_in_cache)
+    check_cache.next(
+        sfn.Choice(scope, id + f" ({cache_name} Hit?)")
+        .when(
+            sfn.Condition.boolean_equals(f"{output_json_path}.cache_hit", True),
+            use_cached_response,
+        )
+        .otherwise(invoke_and_store)
+    )
+    return sfn.Chain.custom(
+        check_cache, [use_cached_response, store_in_cache], store_in_cache
+    )
+
+
+def get_response_cache_steps(
+    scope: Construct,
+    id: builtins.str,
+    model: InferenceProfile,
+    body: typing.Mapping[str, typing.Any],
+    invoke_model: sfn.IChainable,
+    ttl: Duration,
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    request = {"model_id": model.model_id, "body": body}
+    return get_cache_steps(
+        scope,
+        id,
+        "Response Cache",
+        get_response_cache_function(scope),
+        lookup_payload=request,
+        store_payload={**request, "ttl_seconds": ttl.to_seconds()},
+        invoke_model=invoke_model,
+        output_json_path=output_json_path,
+    )
+
+
+# A semantic cache for the responses to prompts that don't include a previous conversation.
+# The cache key is the user-supplied values that the prompt template was filled in with, like the location
+# of a trip. The whole prompt is not embedded, because prompts built from the same template share most
+# of their text, so the prompts for two different cities would be very similar.
+# The key is embedded with a Titan text embeddings model and looked up in a vector index,
+# so that a key that is similar enough to a cached key, like "Paris" and "Paris, France",
+# gets the cached response.
+# Each step has its own index, which is kept in memory by the cache function and persisted to S3.
+# A cached response expires after the cache's TTL.
+# The cache bucket and function are shared by all the semantic cache steps in a stack.
+# There is no default similarity threshold, because a threshold that is too low returns the response
+# for another key, like the hotels in Paris, Texas for Paris, France. Set the threshold above the similarities
+# of different keys that benchmarks/semantic_cache_threshold.py measures.
+semantic_cache_embedding_model_id = "amazon.titan-embed-text-v2:0"
+
+
+def get_semantic_cache_function(scope: Construct):
+    stack = Stack.of(scope)
+    cache_lambda = stack.node.try_find_child("SemanticCacheFunction")
+    if cache_lambda is None:
+        cache_bucket = s3.Bucket(
+            stack,
+            "SemanticCacheBucket",
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+        )
+        cache_lambda = lambda_python.PythonFunction(
+            stack,
+            "SemanticCacheFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/semantic_cache",
+            environment={
+                "SEMANTIC_CACHE_BUCKET": cache_bucket.bucket_name,
+                "EMBEDDING_MODEL_ID": semantic_cache_embedding_model_id,
+            },
+            timeout=Duration.seconds(30),
+            memory_size=1024,
+        )
+        cache_bucket.grant_read_write(cache_lambda)
+        cache_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["bedrock:InvokeModel"],
+                resources=[
+                    f"arn:aws:bedrock:{stack.region}::foundation-model/{semantic_cache_embedding_model_id}"
+                ],
+            )
+        )
+    return cache_lambda
+
+
+def get_semantic_cache_steps(
+    scope: Construct,
+    id: builtins.str,
+    cache_key: builtins.str,
+    model_id: builtins.str,
+    inference_parameters: typing.Mapping[str, typing.Any],
+    invoke_model: sfn.IChainable,
+    ttl: Duration,
+    similarity_threshold: float,
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    # Responses are only reused between prompts for the same step, model, and inference parameters
+    request = {
+        "namespace": {"step": id, "model_id": model_id, **inference_parameters},
+        "cache_key": cache_key,
+    }
+    return get_cache_steps(
+        scope,
+        id,
+        "Semantic Cache",
+        get_semantic_cache_function(scope),
+        lookup_payload={**request, "similarity_threshold": similarity_threshold},
+        store_payload={**request, "ttl_seconds": ttl.to_seconds()},
+        invoke_model=invoke_model,
+        output_json_path=output_json_path,
+    )
+
+
+# Token usage accounting.
+# With record_usage, each model invocation in a chain appends a usage record to $.usage_records, in the form
+# {"step": ..., "model_id": ..., "stop_reason": ..., "usage": {"input_tokens": ..., "output_tokens": ..., ...}}
+# The usage summary step adds up the records into an execution-level summary,
+# and emits the token counts as CloudWatch embedded metrics per step and model.
+def get_usage_records_expression(
+    step: builtins.str,
+    model_id_expression: builtins.str,
+    result_expression: builtins.str,
+):
+    # The first record starts the list, because $append() returns the new records when the list is undefined
+    record = (
+        f'{{"step": {json.dumps(step)}, "model_id": {model_id_expression}, '
+        f'"stop_reason": {result_expression}.stop_reason, "usage": {result_expression}.usage}}'
+    )
+    return f"$append($states.input.usage_records, [{record}])"
+
+
+def get_record_usage_step(
+    scope: Construct,
+    id: builtins.str,
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    usage_records = get_usage_records_expression(
+        id,
+        f"{get_jsonata_state_input_path(output_json_path)}.model_id",
+        get_jsonata_state_input_path(output_json_path),
+    )
+    return sfn.Pass.jsonata(
+        scope,
+        id + " (Record Usage)",
+        outputs=f'{{% $merge([$states.input, {{"usage_records": {usage_records}}}]) %}}',
+    )
+
+
+def get_usage_summary_step(
+    scope: Construct,
+    id: builtins.str,
+    result_path: typing.Optional[str] = "$.usage",
+):
+    stack = Stack.of(scope)
+    summary_lambda = stack.node.try_find_child("UsageSummaryFunction")
+    if summary_lambda is None:
+        summary_lambda = lambda_python.PythonFunction(
+            stack,
+            "UsageSummaryFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/summarize_usage",
+            memory_size=256,
+        )
+    return tasks.LambdaInvoke(
+        scope,
+        id,
+        lambda_function=summary_lambda,
+        payload=sfn.TaskInput.from_object(
+            {
+                "usage_records": sfn.JsonPath.object_at("$.usage_records"),
+                "state_machine_name": sfn.JsonPath.string_at("$$.StateMachine.Name"),
+            }
+        ),
+        payload_response_only=True,
+        result_path=result_path,
+    )
+
+
+# Controls how much of the previous conversation is sent to the model in each step of a chain.
+# A turn is one user message and the model's response to it.
+# - keep_all: send the whole conversation (default)
+# - last_turns: send only the last N turns
+# - first_and_last_turns: send the first turn plus the last N turns
+# - summarize_older_turns: replace the turns before the last N turns with a summary,
+#   written by a (cheaper) model
+# With max_tokens, the oldest turns are also dropped until the conversation fits within a token budget.
+# The number of tokens is estimated from the number of characters in the text of the messages.
+class ConversationPolicy:
+    def __init__(
+        self,
+        strategy: builtins.str = "keep_all",
+        turns: typing.Optional[int] = None,
+        max_tokens: typing.Optional[int] = None,
+        summary_model_id: str = "global.anthropic.claude-haiku-4-5-20251001-v1:0",
+    ):
+        if strategy not in [
+            "keep_all",
+            "last_turns",
+            "first_and_last_turns",
+            "summarize_older_turns",
+        ]:
+            raise ValueError(f"Unknown conversation policy strategy: {strategy}")
+        if strategy != "keep_all" and (turns is None or turns < 1):
+            raise ValueError(
+                f"The {strategy} conversation policy requires turns to be at least 1"
+            )
+        if max_tokens is not None and max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        self.strategy = strategy
+        self.turns = turns
+        self.max_tokens = max_tokens
+        self.summary_model_id = summary_model_id
+
+    @classmethod
+    def keep_all(cls, max_tokens: typing.Optional[int] = None):
+        return cls("keep_all", max_tokens=max_tokens)
+
+    @classmethod
+    def last_turns(cls, turns: int, max_tokens: typing.Optional[int] = None):
+        return cls("last_turns", turns=turns, max_tokens=max_tokens)
+
+    @classmethod
+    def first_and_last_turns(cls, turns: int, max_tokens: typing.Optional[int] = None):
+        return cls("first_and_last_turns", turns=turns, max_tokens=max_tokens)
+
+    @classmethod
+    def summarize_older_turns(
+        cls,
+        turns: int,
+        max_tokens: typing.Optional[int] = None,
+        summary_model_id: str = "global.anthropic.claude-haiku-4-5-20251001-v1:0",
+    ):
+        return cls(
+            "summarize_older_turns",
+            turns=turns,
+            max_tokens=max_tokens,
+            summary_model_id=summary_model_id,
+        )
+
+    def is_windowed(self):
+        return self.strategy != "keep_all" or self.max_tokens is not None
+
+    # The first turn is kept when trimming the conversation,
+    # either because it is pinned or because it holds the summary of older turns
+    def keeps_first_turn(self):
+        return self.strategy in ["first_and_last_turns", "summarize_older_turns"]
+
+    def get_max_messages(self):
+        if self.strategy == "keep_all":
+            return None
+        if self.keeps_first_turn():
+            return 2 * (self.turns + 1)
+        return 2 * self.turns
+
+    # Roughly 4 characters per token for English text
+    def get_max_characters(self):
+        if self.max_tokens is None:
+            return None
+        return self.max_tokens * 4
+
+
+# Steps that trim the previous conversation stored at {output_json_path}.conversation
+# according to the conversation policy, before it is included in the next prompt.
+# The conversation is measured, and then the oldest turn is dropped (or older turns are summarized)
+# until the conversation is within the policy's limits. The loop then continues to next_step.
+def get_conversation_window_steps(
+    scope: Construct,
+    id: builtins.str,
+    conversation_policy: ConversationPolicy,
+    next_step: sfn.IChainable,
+    input_json_path: typing.Optional[str] = "$.model_inputs",
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    conversation_path = f"{output_json_path}.conversation"
+    window_path = f"{output_json_path}.conversation_window"
+
+    # The size of the conversation is measured on the text content of the messages,
+    # which needs JSONata to count characters
+    conversation = get_jsonata_state_input_path(conversation_path)
+    measure_conversation = sfn.Pass.jsonata(
+        scope,
+        id + " (Measure Conversation)",
+        outputs="{% "
+        + get_jsonata_replace_at_path(
+            window_path,
+            f'{{"message_count": $count({conversation}), '
+            f'"character_count": $length($join([{conversation}.content.text]))}}',
+        )
+        + " %}",
     )
 
+    # Drop the oldest turn, keeping the first turn if the policy pins it
+    if conversation_policy.keeps_first_turn():
+        drop_oldest_turn = sfn.Pass(
+            scope,
+            id + " (Drop Oldest Turn)",
+            parameters={
+                "messages": sfn.JsonPath.array(
+                    sfn.JsonPath.string_at(f"{conversation_path}[0:2]"),
+                    sfn.JsonPath.string_at(f"{conversation_path}[4:]"),
+                ),
+            },
+            result_path=window_path,
+        ).next(
+            sfn.Pass(
+                scope,
+                id + " (Merge Remaining Turns)",
+                input_path=f"{window_path}.messages[*][*]",
+                result_path=conversation_path,
+            )
+        )
+        min_messages = 2
+    else:
+        drop_oldest_turn = sfn.Pass(
+            scope,
+            id + " (Drop Oldest Turn)",
+            input_path=f"{conversation_path}[2:]",
+            result_path=conversation_path,
+        )
+        min_messages = 0
+    drop_oldest_turn.next(measure_conversation)
+
+    if conversation_policy.strategy == "summarize_older_turns":
+        max_messages = conversation_policy.get_max_messages()
+        recent_messages_path = f"{conversation_path}[-{2 * conversation_policy.turns}:]"
+        older_messages_path = f"{conversation_path}[:-{2 * conversation_policy.turns}]"
+        summary_path = f"{output_json_path}.conversation_summary"
+
+        prepare_summary_prompt = get_anthropic_claude_prepare_prompt_step(
+            scope,
+            id + " - Summarize Older Turns",
+            prompt=(
+                "Summarize our conversation so far in a few paragraphs. "
+                "Keep every detail that you would need to continue the conversation, "
+                "including any names, facts, decisions and instructions. "
+                "Respond only with the summary."
+            ),
+            include_previous_conversation_in_prompt=True,
+            previous_conversation_json_path=older_messages_path,
+            input_json_path=input_json_path,
+            output_json_path=output_json_path,
+        )
+        summarize = get_anthropic_claude_invoke_model_step(
+            scope,
+            id + " - Summarize Older Turns",
+            claude_model_id=conversation_policy.summary_model_id,
+            max_tokens_to_sample=500,
+            temperature=0,
+            flatten_messages=True,
+            input_json_path=input_json_path,
+            output_json_path=summary_path,
+        )
+        replace_older_turns = sfn.Pass(
+            scope,
+            id + " (Replace Older Turns With Summary)",
+            parameters={
+                "messages": sfn.JsonPath.array(
+                    sfn.JsonPath.string_at(f"{summary_path}.messages"),
+                    sfn.JsonPath.string_at(recent_messages_path),
+                ),
+            },
+            result_path=window_path,
+        )
+        summarize_older_turns = (
+            prepare_summary_prompt.next(summarize)
+            .next(
+                sfn.Pass(
+                    scope,
+                    id + " (Prepare Summary Turn)",
+                    parameters={
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": sfn.JsonPath.format(
+                                            "Here is a summary of our conversation so far:\n{}",
+                                            sfn.JsonPath.string_at(
+                                                f"{summary_path}.message.content[0].text"
+                                            ),
+                                        ),
+                                    }
+                                ],
+                            },
+                            {
+                                "role": "assistant",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": "Thanks, I will continue our conversation from this summary.",
+                                    }
+                                ],
+                            },
+                        ]
+                    },
+                    result_path=summary_path,
+                )
+            )
+            .next(replace_older_turns)
+            .next(
+                sfn.Pass(
+                    scope,
+                    id + " (Merge Summary Turn)",
+                    input_path=f"{window_path}.messages[*][*]",
+                    result_path=conversation_path,
+                )
+            )
+        )
+        summarize_older_turns.next(measure_conversation)
+        trim_to_max_turns = summarize_older_turns
+    else:
+        max_messages = conversation_policy.get_max_messages()
+        trim_to_max_turns = drop_oldest_turn
+
+    trim_conversation = sfn.Choice(scope, id + " (Trim Conversation?)")
+    if max_messages is not None:
+        trim_conversation.when(
+            sfn.Condition.number_greater_than(
+                f"{window_path}.message_count", max_messages
+            ),
+            trim_to_max_turns,
+        )
+    max_characters = conversation_policy.get_max_characters()
+    if max_characters is not None:
+        trim_conversation.when(
+            sfn.Condition.and_(
+                sfn.Condition.number_greater_than(
+                    f"{window_path}.character_count", max_characters
+                ),
+                sfn.Condition.number_greater_than(
+                    f"{window_path}.message_count", min_messages
+                ),
+            ),
+            drop_oldest_turn,
+        )
+    trim_conversation.otherwise(next_step)
+
+    return measure_conversation.next(trim_conversation)
+
 
 def get_anthropic_claude_prepare_prompt_step(
     scope: Construct,
@@ -65,9 +879,14 @@ def get_anthropic_claude_prepare_prompt_step(
     prompt: builtins.str,
     include_previous_conversation_in_prompt: bool,
     initial_assistant_text: typing.Optional[str] = "",
+    conversation_policy: typing.Optional[ConversationPolicy] = None,
+    previous_conversation_json_path: typing.Optional[str] = None,
     input_json_path: typing.Optional[str] = "$.model_inputs",
     output_json_path: typing.Optional[str] = "$.model_outputs",
 ):
+    if previous_conversation_json_path is None:
+        previous_conversation_json_path = f"{output_json_path}.conversation"
+
     messages = [
         {
             "role": "user",
@@ -97,16 +916,104 @@ def get_anthropic_claude_prepare_prompt_step(
             id + " (Include Previous Messages)",
             parameters={
                 "messages": sfn.JsonPath.array(
-                    sfn.JsonPath.string_at(f"{output_json_path}.conversation"),
+                    sfn.JsonPath.string_at(previous_conversation_json_path),
                     sfn.JsonPath.string_at(f"{input_json_path}.messages"),
                 ),
             },
             result_path=input_json_path,
         )
         format_prompt = format_prompt.next(insert_conversation)
+
+        if conversation_policy is not None and conversation_policy.is_windowed():
+            window_conversation = get_conversation_window_steps(
+                scope,
+                id,
+                conversation_policy,
+                next_step=format_prompt,
+                input_json_path=input_json_path,
+                output_json_path=output_json_path,
+            )
+            format_prompt = sfn.Chain.custom(
+                window_conversation.start_state,
+                format_prompt.end_states,
+                insert_conversation,
+            )
     return format_prompt
 
 
+# Structured output: the model is forced to call a tool whose input schema is the JSON schema,
+# so the tool's input is the structured response.
+# Tool input schemas must be objects, so other schemas are wrapped in an object with a single "value" key.
+structured_output_tool_name = "respond_with_json"
+
+
+def get_structured_output_tool(json_schema: typing.Any):
+    if json_schema.get("type") == "object":
+        input_schema = json_schema
+    else:
+        input_schema = {
+            "type": "object",
+            "properties": {"value": json_schema},
+            "required": ["value"],
+        }
+    return {
+        "name": structured_output_tool_name,
+        "description": "Respond with JSON that complies with the input schema.",
+        "input_schema": input_schema,
+    }
+
+
+# Replace the model's tool use message with a text message containing the tool's input as a JSON string.
+# The response is then extracted like any other text response, and the conversation that is passed
+# to the next steps doesn't contain a tool use without a tool result, which Bedrock would reject.
+def get_structured_output_extract_step(
+    scope: Construct,
+    id: builtins.str,
+    json_schema: typing.Any,
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    tool_input_path = f"{output_json_path}.message.content[0].input"
+    if json_schema.get("type") != "object":
+        tool_input_path += ".value"
+    return sfn.Pass(
+        scope,
+        id + " (Extract Structured Output)",
+        parameters={
+            "role": "assistant",
+            "content": [
+                {
+                    "type": "text",
+                    "text": sfn.JsonPath.json_to_string(
+                        sfn.JsonPath.object_at(tool_input_path)
+                    ),
+                }
+            ],
+        },
+        result_path=f"{output_json_path}.message",
+    )
+
+
+# A JSONata expression for the messages at the given path, with a prompt cache breakpoint
+# on the last content block of the last user message, so that the prompt and the previous conversation
+# before it can be read from the cache by the next request with the same prefix.
+# The breakpoint is only added to the request body, so the conversation that is passed on
+# to the next step doesn't carry a breakpoint, and a request stays within the few breakpoints it can have.
+def get_jsonata_cache_breakpoint_messages_expression(messages_json_path: builtins.str):
+    # The .$ step flattens a conversation that is an array of message arrays
+    messages = f"[{get_jsonata_state_input_path(messages_json_path)}.$]"
+    cache_block = '$merge([$block, {"cache_control": {"type": "ephemeral"}}])'
+    cache_message = (
+        '$merge([$message, {"content": [$map($message.content, function($block, $j) '
+        f"{{$j = $count($message.content) - 1 ? {cache_block} : $block}})]}}])"
+    )
+    return (
+        f"($messages := {messages}; "
+        '$last_user_index := $max($messages#$i[role = "user"].$i); '
+        "[$map($messages, function($message, $i) "
+        f"{{$i = $last_user_index ? {cache_message} : $message}})])"
+    )
+
+
 def get_anthropic_claude_invoke_model_step(
     scope: Construct,
     id: builtins.str,
@@ -114,33 +1021,131 @@ def get_anthropic_claude_invoke_model_step(
     max_tokens_to_sample: typing.Optional[int] = 250,
     temperature: typing.Optional[float] = 1,
     flatten_messages: typing.Optional[bool] = False,
+    system_prompt: typing.Optional[str] = None,
+    enable_prompt_caching: typing.Optional[bool] = False,
+    response_stream_table: typing.Optional[dynamodb.ITable] = None,
+    fallback_claude_model_id: typing.Optional[str] = None,
+    response_cache_ttl: typing.Optional[Duration] = None,
+    json_schema: typing.Optional[typing.Any] = None,
     input_json_path: typing.Optional[str] = "$.model_inputs",
     output_json_path: typing.Optional[str] = "$.model_outputs",
 ):
-    invoke_model = tasks.BedrockInvokeModel(
-        scope,
-        id + " (Invoke Model)",
-        model=InferenceProfile(scope, id + "Model", claude_model_id),
-        body=sfn.TaskInput.from_object(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "messages": (
-                    sfn.JsonPath.object_at(f"{input_json_path}.messages[*][*]")
-                    if flatten_messages
-                    else sfn.JsonPath.object_at(f"{input_json_path}.messages")
-                ),
-                "max_tokens": max_tokens_to_sample,
-                "temperature": temperature,
-            }
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "messages": (
+            sfn.JsonPath.object_at(f"{input_json_path}.messages[*][*]")
+            if flatten_messages
+            else sfn.JsonPath.object_at(f"{input_json_path}.messages")
         ),
-        result_selector={
-            "role": sfn.JsonPath.string_at("$.Body.role"),
-            "content": sfn.JsonPath.string_at("$.Body.content"),
-        },
-        result_path=output_json_path,
+        "max_tokens": max_tokens_to_sample,
+        "temperature": temperature,
+    }
+    if system_prompt:
+        system_block = {"type": "text", "text": system_prompt}
+        if enable_prompt_caching:
+            system_block["cache_control"] = {"type": "ephemeral"}
+        body["system"] = [system_block]
+    if json_schema is not None:
+        body["tools"] = [get_structured_output_tool(json_schema)]
+        body["tool_choice"] = {"type": "tool", "name": structured_output_tool_name}
+
+    # JSONPath states can't add the cache breakpoint to a message in the state,
+    # so with prompt caching the model is invoked by a JSONata state with the same output.
+    # The response cache is still keyed on the request body without the breakpoint.
+    if enable_prompt_caching:
+        cached_body = {
+            **body,
+            "messages": "{% "
+            + get_jsonata_cache_breakpoint_messages_expression(
+                f"{input_json_path}.messages"
+            )
+            + " %}",
+        }
+
+    # The usage includes the number of input tokens that were read from and written to the prompt cache
+    # The model ID and stop reason are kept for usage accounting
+    def get_invoke_model_task(task_id, model):
+        if enable_prompt_caching:
+            output_expression = get_jsonata_replace_at_path(
+                output_json_path,
+                '{"message": {"role": $states.result.Body.role, "content": $states.result.Body.content[]}, '
+                '"usage": $states.result.Body.usage, "stop_reason": $states.result.Body.stop_reason, '
+                f'"model_id": {json.dumps(model.model_id)}}}',
+            )
+            if response_stream_table is not None:
+                invoke_model = get_anthropic_claude_streaming_invoke_model_step(
+                    scope,
+                    task_id,
+                    model=model,
+                    body=cached_body,
+                    response_stream_table=response_stream_table,
+                    jsonata=True,
+                    outputs=f"{{% {output_expression} %}}",
+                )
+            else:
+                invoke_model = tasks.BedrockInvokeModel.jsonata(
+                    scope,
+                    task_id,
+                    model=model,
+                    body=sfn.TaskInput.from_object(cached_body),
+                    outputs=f"{{% {output_expression} %}}",
+                )
+            add_bedrock_retries(invoke_model)
+            return invoke_model
+
+        result_selector = {
+            "message": {
+                "role": sfn.JsonPath.string_at("$.Body.role"),
+                "content": sfn.JsonPath.string_at("$.Body.content"),
+            },
+            "usage": sfn.JsonPath.object_at("$.Body.usage"),
+            "stop_reason": sfn.JsonPath.string_at("$.Body.stop_reason"),
+            "model_id": model.model_id,
+        }
+        if response_stream_table is not None:
+            invoke_model = get_anthropic_claude_streaming_invoke_model_step(
+                scope,
+                task_id,
+                model=model,
+                body=body,
+                response_stream_table=response_stream_table,
+                result_selector=result_selector,
+                result_path=output_json_path,
+            )
+        else:
+            invoke_model = tasks.BedrockInvokeModel(
+                scope,
+                task_id,
+                model=model,
+                body=sfn.TaskInput.from_object(body),
+                result_selector=result_selector,
+                result_path=output_json_path,
+            )
+        add_bedrock_retries(invoke_model)
+        return invoke_model
+
+    model = InferenceProfile(scope, id + "Model", claude_model_id)
+    invoke_model = get_invoke_model_task(id + " (Invoke Model)", model)
+    if fallback_claude_model_id is not None:
+        fallback_invoke_model = get_invoke_model_task(
+            id + " (Invoke Fallback Model)",
+            InferenceProfile(scope, id + "FallbackModel", fallback_claude_model_id),
+        )
+        invoke_model = add_bedrock_fallback(
+            invoke_model, fallback_invoke_model, jsonata=enable_prompt_caching
+        )
+
+    if response_cache_ttl is None:
+        return invoke_model
+    return get_response_cache_steps(
+        scope,
+        id,
+        model=model,
+        body=body,
+        invoke_model=invoke_model,
+        ttl=response_cache_ttl,
+        output_json_path=output_json_path,
     )
-    add_bedrock_retries(invoke_model)
-    return invoke_model
 
 
 def get_anthropic_claude_extract_response_step(
@@ -150,10 +1155,13 @@ def get_anthropic_claude_extract_response_step(
     initial_assistant_text: typing.Optional[str] = "",
     flatten_messages: typing.Optional[bool] = False,
     pass_conversation: typing.Optional[bool] = True,
+    pass_usage: typing.Optional[bool] = False,
     input_json_path: typing.Optional[str] = "$.model_inputs",
     output_json_path: typing.Optional[str] = "$.model_outputs",
 ):
-    response_value = sfn.JsonPath.string_at(f"{output_json_path}.content[0].text")
+    response_value = sfn.JsonPath.string_at(
+        f"{output_json_path}.message.content[0].text"
+    )
     if initial_assistant_text:
         response_value = sfn.JsonPath.format(
             "{}{}", initial_assistant_text, response_value
@@ -168,11 +1176,14 @@ def get_anthropic_claude_extract_response_step(
                 if flatten_messages
                 else sfn.JsonPath.string_at(f"{input_json_path}.messages")
             ),
-            sfn.JsonPath.array(sfn.JsonPath.string_at(output_json_path)),
+            sfn.JsonPath.array(sfn.JsonPath.string_at(f"{output_json_path}.message")),
         ),
+        "usage": sfn.JsonPath.object_at(f"{output_json_path}.usage"),
     }
     if not pass_conversation:
         extract_response_parameters.pop("conversation")
+    if not pass_usage:
+        extract_response_parameters.pop("usage")
 
     extract_response = sfn.Pass(
         scope,
@@ -182,16 +1193,21 @@ def get_anthropic_claude_extract_response_step(
     )
 
     if pass_conversation:
+        prepare_outputs_parameters = {
+            "prompt": sfn.JsonPath.string_at(f"{output_json_path}.prompt"),
+            "response": sfn.JsonPath.string_at(f"{output_json_path}.response"),
+            "conversation": sfn.JsonPath.object_at(
+                f"{output_json_path}.conversation[*][*]"
+            ),
+        }
+        if pass_usage:
+            prepare_outputs_parameters["usage"] = sfn.JsonPath.object_at(
+                f"{output_json_path}.usage"
+            )
         prepare_outputs = sfn.Pass(
             scope,
             id + " (Prepare Output)",
-            parameters={
-                "prompt": sfn.JsonPath.string_at(f"{output_json_path}.prompt"),
-                "response": sfn.JsonPath.string_at(f"{output_json_path}.response"),
-                "conversation": sfn.JsonPath.object_at(
-                    f"{output_json_path}.conversation[*][*]"
-                ),
-            },
+            parameters=prepare_outputs_parameters,
             result_path=output_json_path,
         )
         extract_response = extract_response.next(prepare_outputs)
@@ -199,6 +1215,169 @@ def get_anthropic_claude_extract_response_step(
     return extract_response
 
 
+# Convert a JSONPath reference path like $.model_outputs into the matching JSONata expression
+def get_jsonata_state_input_path(json_path: builtins.str):
+    if not re.fullmatch(r"\$(\.[A-Za-z_][A-Za-z0-9_]*)+", json_path):
+        raise ValueError(
+            f"Only simple paths like $.model_outputs can be used in JSONata states, not {json_path}"
+        )
+    return "$states.input" + json_path[1:]
+
+
+# A JSONata expression for the state input, with the value at the given JSONPath replaced,
+# similar to setting ResultPath on a JSONPath state
+def get_jsonata_replace_at_path(
+    json_path: builtins.str, value_expression: builtins.str
+):
+    get_jsonata_state_input_path(json_path)
+    keys = json_path[2:].split(".")
+    expression = value_expression
+    for i in reversed(range(len(keys))):
+        parent = ".".join(["$states.input"] + keys[:i])
+        expression = f"$merge([{parent}, {{{json.dumps(keys[i])}: {expression}}}])"
+    return expression
+
+
+# A compact alternative to the prepare prompt, invoke model, and extract response steps.
+# A single JSONata task builds the messages, invokes the model, and extracts the response,
+# with the same output as the other steps.
+# JSONata states can't evaluate JSONPath intrinsic functions like States.Format, so a prompt
+# built with intrinsic functions is first rendered by a JSONPath Pass state.
+def get_anthropic_claude_compact_invoke_step(
+    scope: Construct,
+    id: builtins.str,
+    prompt: builtins.str,
+    claude_model_id: str = "global.anthropic.claude-haiku-4-5-20251001-v1:0",
+    initial_assistant_text: typing.Optional[str] = "",
+    include_initial_assistant_text_in_response: typing.Optional[bool] = True,
+    max_tokens_to_sample: typing.Optional[int] = 250,
+    temperature: typing.Optional[float] = 1,
+    include_previous_conversation_in_prompt: typing.Optional[bool] = True,
+    pass_conversation: typing.Optional[bool] = True,
+    system_prompt: typing.Optional[str] = None,
+    enable_prompt_caching: typing.Optional[bool] = False,
+    response_stream_table: typing.Optional[dynamodb.ITable] = None,
+    fallback_claude_model_id: typing.Optional[str] = None,
+    record_usage: typing.Optional[bool] = False,
+    input_json_path: typing.Optional[str] = "$.model_inputs",
+    output_json_path: typing.Optional[str] = "$.model_outputs",
+):
+    input_path = get_jsonata_state_input_path(input_json_path)
+    output_path = get_jsonata_state_input_path(output_json_path)
+
+    prompt_parameters = {}
+    prompt_expressions = {}
+    for key, value in [("prompt", prompt), ("system_prompt", system_prompt)]:
+        if value is None:
+            continue
+        if Token.is_unresolved(value):
+            prompt_parameters[key] = value
+            prompt_expressions[key] = f"{input_path}.{key}"
+        else:
+            prompt_expressions[key] = json.dumps(value)
+
+    def get_messages_expression(with_cache_control):
+        prompt_block = f'"type": "text", "text": {prompt_expressions["prompt"]}'
+        if with_cache_control:
+            prompt_block += ', "cache_control": {"type": "ephemeral"}'
+        messages = [f'{{"role": "user", "content": [{{{prompt_block}}}]}}']
+        if initial_assistant_text:
+            messages.append(
+                f'{{"role": "assistant", "content": [{{"type": "text", "text": {json.dumps(initial_assistant_text)}}}]}}'
+            )
+        messages = f"[{', '.join(messages)}]"
+        if include_previous_conversation_in_prompt:
+            # The [] suffix keeps a single message conversation as an array
+            messages = f"$append({output_path}.conversation[], {messages})"
+        return messages
+
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "messages": f"{{% {get_messages_expression(enable_prompt_caching)} %}}",
+        "max_tokens": max_tokens_to_sample,
+        "temperature": temperature,
+    }
+    if system_prompt:
+        system_block = f'"type": "text", "text": {prompt_expressions["system_prompt"]}'
+        if enable_prompt_caching:
+            system_block += ', "cache_control": {"type": "ephemeral"}'
+        body["system"] = f"{{% [{{{system_block}}}] %}}"
+
+    response_expression = "$states.result.Body.content[0].text"
+    if initial_assistant_text and include_initial_assistant_text_in_response:
+        response_expression = (
+            f"{json.dumps(initial_assistant_text)} & {response_expression}"
+        )
+    outputs = [
+        f'"prompt": {prompt_expressions["prompt"]}',
+        f'"response": {response_expression}',
+    ]
+    if pass_conversation:
+        outputs.append(
+            '"conversation": $append('
+            + get_messages_expression(False)
+            + ', [{"role": $states.result.Body.role, "content": $states.result.Body.content[]}])'
+        )
+    if enable_prompt_caching:
+        outputs.append('"usage": $states.result.Body.usage')
+    output_expression = get_jsonata_replace_at_path(
+        output_json_path, f"{{{', '.join(outputs)}}}"
+    )
+
+    def get_invoke_model_task(task_id, model):
+        task_output_expression = output_expression
+        if record_usage:
+            usage_records = get_usage_records_expression(
+                id, json.dumps(model.model_id), "$states.result.Body"
+            )
+            task_output_expression = (
+                f'$merge([{output_expression}, {{"usage_records": {usage_records}}}])'
+            )
+        if response_stream_table is not None:
+            invoke_model = get_anthropic_claude_streaming_invoke_model_step(
+                scope,
+                task_id,
+                model=model,
+                body=body,
+                response_stream_table=response_stream_table,
+                jsonata=True,
+                outputs=f"{{% {task_output_expression} %}}",
+            )
+        else:
+            invoke_model = tasks.BedrockInvokeModel.jsonata(
+                scope,
+                task_id,
+                model=model,
+                body=sfn.TaskInput.from_object(body),
+                outputs=f"{{% {task_output_expression} %}}",
+            )
+        add_bedrock_retries(invoke_model)
+        return invoke_model
+
+    invoke_model = get_invoke_model_task(
+        id + " (Invoke Model)", InferenceProfile(scope, id + "Model", claude_model_id)
+    )
+    if fallback_claude_model_id is not None:
+        fallback_invoke_model = get_invoke_model_task(
+            id + " (Invoke Fallback Model)",
+            InferenceProfile(scope, id + "FallbackModel", fallback_claude_model_id),
+        )
+        invoke_model = add_bedrock_fallback(
+            invoke_model, fallback_invoke_model, jsonata=True
+        )
+
+    if not prompt_parameters:
+        return invoke_model
+
+    format_prompt = sfn.Pass(
+        scope,
+        id + " (Prepare Prompt)",
+        parameters=prompt_parameters,
+        result_path=input_json_path,
+    )
+    return format_prompt.next(invoke_model)
+
+
 def get_anthropic_claude_invoke_chain(
     scope: Construct,
     id: builtins.str,
@@ -210,6 +1389,18 @@ def get_anthropic_claude_invoke_chain(
     temperature: typing.Optional[float] = 1,
     include_previous_conversation_in_prompt: typing.Optional[bool] = True,
     pass_conversation: typing.Optional[bool] = True,
+    conversation_policy: typing.Optional[ConversationPolicy] = None,
+    system_prompt: typing.Optional[str] = None,
+    enable_prompt_caching: typing.Optional[bool] = False,
+    compact: typing.Optional[bool] = False,
+    response_stream_table: typing.Optional[dynamodb.ITable] = None,
+    fallback_claude_model_id: typing.Optional[str] = None,
+    record_usage: typing.Optional[bool] = False,
+    response_cache_ttl: typing.Optional[Duration] = None,
+    semantic_cache_ttl: typing.Optional[Duration] = None,
+    semantic_cache_key: typing.Optional[str] = None,
+    semantic_cache_similarity_threshold: typing.Optional[float] = None,
+    json_schema: typing.Optional[typing.Any] = None,
     input_json_path: typing.Optional[str] = "$.model_inputs",
     output_json_path: typing.Optional[str] = "$.model_outputs",
 ):
@@ -218,12 +1409,82 @@ def get_anthropic_claude_invoke_chain(
             'initial_assistant_text cannot be used with pass_conversation. This combination results in a runtime error from Bedrock: `messages: roles must alternate between "user" and "assistant", but found multiple "assistant" roles in a row`'
         )
 
+    if compact and response_cache_ttl is not None:
+        raise ValueError(
+            "response_cache_ttl cannot be used with compact. The response cache is checked in a separate state before the model invocation."
+        )
+
+    if semantic_cache_ttl is not None and (
+        compact or include_previous_conversation_in_prompt
+    ):
+        raise ValueError(
+            "semantic_cache_ttl cannot be used with compact or include_previous_conversation_in_prompt. The semantic cache is checked in a separate state before the model invocation, and only embeds the prompt."
+        )
+
+    if semantic_cache_ttl is not None and semantic_cache_key is None:
+        raise ValueError(
+            "semantic_cache_ttl requires semantic_cache_key. Only the user-supplied values that the prompt is built from are embedded, because prompts built from the same template share most of their text."
+        )
+
+    if semantic_cache_ttl is not None and semantic_cache_similarity_threshold is None:
+        raise ValueError(
+            "semantic_cache_ttl requires semantic_cache_similarity_threshold. Measure the similarities of equivalent and different keys with benchmarks/semantic_cache_threshold.py to choose it."
+        )
+
+    if json_schema is not None and (
+        compact or initial_assistant_text or response_stream_table is not None
+    ):
+        raise ValueError(
+            "json_schema cannot be used with compact, initial_assistant_text, or response_stream_table. The model is forced to respond with a tool use instead of text, which is extracted in a separate state."
+        )
+
+    if compact:
+        invoke_model = get_anthropic_claude_compact_invoke_step(
+            scope,
+            id,
+            prompt,
+            claude_model_id=claude_model_id,
+            initial_assistant_text=initial_assistant_text,
+            include_initial_assistant_text_in_response=include_initial_assistant_text_in_response,
+            max_tokens_to_sample=max_tokens_to_sample,
+            temperature=temperature,
+            include_previous_conversation_in_prompt=include_previous_conversation_in_prompt,
+            pass_conversation=pass_conversation,
+            system_prompt=system_prompt,
+            enable_prompt_caching=enable_prompt_caching,
+            response_stream_table=response_stream_table,
+            fallback_claude_model_id=fallback_claude_model_id,
+            record_usage=record_usage,
+            input_json_path=input_json_path,
+            output_json_path=output_json_path,
+        )
+        if (
+            include_previous_conversation_in_prompt
+            and conversation_policy is not None
+            and conversation_policy.is_windowed()
+        ):
+            window_conversation = get_conversation_window_steps(
+                scope,
+                id,
+                conversation_policy,
+                next_step=invoke_model,
+                input_json_path=input_json_path,
+                output_json_path=output_json_path,
+            )
+            return sfn.Chain.custom(
+                window_conversation.start_state,
+                invoke_model.end_states,
+                invoke_model,
+            )
+        return invoke_model
+
     format_prompt = get_anthropic_claude_prepare_prompt_step(
         scope,
         id,
         prompt,
         include_previous_conversation_in_prompt=include_previous_conversation_in_prompt,
         initial_assistant_text=initial_assistant_text,
+        conversation_policy=conversation_policy,
         input_json_path=input_json_path,
         output_json_path=output_json_path,
     )
@@ -235,6 +1496,12 @@ def get_anthropic_claude_invoke_chain(
         max_tokens_to_sample=max_tokens_to_sample,
         temperature=temperature,
         flatten_messages=include_previous_conversation_in_prompt,
+        system_prompt=system_prompt,
+        enable_prompt_caching=enable_prompt_caching,
+        response_stream_table=response_stream_table,
+        fallback_claude_model_id=fallback_claude_model_id,
+        response_cache_ttl=response_cache_ttl,
+        json_schema=json_schema,
         input_json_path=input_json_path,
         output_json_path=output_json_path,
     )
@@ -248,19 +1515,181 @@ def get_anthropic_claude_invoke_chain(
         ),
         flatten_messages=include_previous_conversation_in_prompt,
         pass_conversation=pass_conversation,
+        # Surface the cache read and write token counts when prompt caching is enabled
+        pass_usage=enable_prompt_caching,
         input_json_path=input_json_path,
         output_json_path=output_json_path,
     )
 
-    return format_prompt.next(invoke_model).next(extract_response)
+    if semantic_cache_ttl is not None:
+        invoke_model = get_semantic_cache_steps(
+            scope,
+            id,
+            cache_key=semantic_cache_key,
+            model_id=claude_model_id,
+            inference_parameters={
+                "max_tokens": max_tokens_to_sample,
+                "temperature": temperature,
+                "system_prompt": system_prompt,
+                "initial_assistant_text": initial_assistant_text,
+                "json_schema": json_schema,
+            },
+            invoke_model=invoke_model,
+            ttl=semantic_cache_ttl,
+            similarity_threshold=semantic_cache_similarity_threshold,
+            output_json_path=output_json_path,
+        )
+
+    chain = format_prompt.next(invoke_model)
+    if record_usage:
+        chain = chain.next(get_record_usage_step(scope, id, output_json_path))
+    if json_schema is not None:
+        chain = chain.next(
+            get_structured_output_extract_step(
+                scope, id, json_schema, output_json_path=output_json_path
+            )
+        )
+    return chain.next(extract_response)
+
 
+# The JSON schema is passed in each invocation, so all the parse steps in a stack share one parser function
+def get_json_response_parser_function(scope: Construct):
+    stack = Stack.of(scope)
+    parser_lambda = stack.node.try_find_child("JsonResponseParserFunction")
+    if parser_lambda is None:
+        parser_lambda = lambda_python.PythonFunction(
+            stack,
+            "JsonResponseParserFunction",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            entry="functions/generic/parse_json_response",
+            memory_size=256,
+        )
+    return parser_lambda
+
+
+# JSONata conditions for the JSON schema types. JSON schema integers include numbers like 1.0.
+jsonata_json_schema_type_conditions = {
+    "object": "$type({value}) = 'object'",
+    "array": "$type({value}) = 'array'",
+    "string": "$type({value}) = 'string'",
+    "number": "$type({value}) = 'number'",
+    "integer": "($type({value}) = 'number' and {value} = $floor({value}))",
+    "boolean": "$type({value}) = 'boolean'",
+    "null": "$type({value}) = 'null'",
+}
+
+jsonata_json_schema_keywords = {
+    "type",
+    "properties",
+    "required",
+    "additionalProperties",
+    "items",
+    "minItems",
+    "maxItems",
+    "uniqueItems",
+    "enum",
+    "minLength",
+    "maxLength",
+    "minimum",
+    "maximum",
+    "title",
+    "description",
+}
+
+
+# A JSONata condition that is true when the value complies with the JSON schema.
+# Only a subset of JSON schema is covered: a single type, required and allowed keys, enums of simple values,
+# array items and lengths, string lengths, and number ranges.
+# Returns None for a schema that uses anything else, which can only be validated by the parser function.
+def get_jsonata_json_schema_condition(
+    json_schema: typing.Any, value_expression: builtins.str, depth: int = 0
+):
+    if (
+        not isinstance(json_schema, dict)
+        or not set(json_schema.keys()).issubset(jsonata_json_schema_keywords)
+        or json_schema.get("type") not in jsonata_json_schema_type_conditions
+    ):
+        return None
+
+    value = value_expression
+    schema_type = json_schema["type"]
+    conditions = [jsonata_json_schema_type_conditions[schema_type].format(value=value)]
+
+    if schema_type == "object":
+        for key in json_schema.get("required", []):
+            conditions.append(f"$exists($lookup({value}, {json.dumps(key)}))")
+        for key, property_schema in json_schema.get("properties", {}).items():
+            property_value = f"$lookup({value}, {json.dumps(key)})"
+            property_condition = get_jsonata_json_schema_condition(
+                property_schema, property_value, depth + 1
+            )
+            if property_condition is None:
+                return None
+            conditions.append(
+                f"($exists({property_value}) ? {property_condition} : true)"
+            )
+        additional_properties = json_schema.get("additionalProperties", True)
+        if additional_properties is False:
+            allowed_keys = json.dumps(list(json_schema.get("properties", {}).keys()))
+            conditions.append(f"$count($keys({value})[$not($ in {allowed_keys})]) = 0")
+        elif additional_properties is not True:
+            return None
+    elif any(key in json_schema for key in ["properties", "required"]):
+        return None
+
+    if schema_type == "array":
+        if "minItems" in json_schema:
+            conditions.append(f"$count({value}) >= {json_schema['minItems']}")
+        if "maxItems" in json_schema:
+            conditions.append(f"$count({value}) <= {json_schema['maxItems']}")
+        if json_schema.get("uniqueItems"):
+            conditions.append(f"$count($distinct({value})) = $count({value})")
+        if "items" in json_schema:
+            item = f"$item{depth}"
+            item_condition = get_jsonata_json_schema_condition(
+                json_schema["items"], item, depth + 1
+            )
+            if item_condition is None:
+                return None
+            conditions.append(
+                f"$count($filter({value}, function({item}) {{ {item_condition} }})) = $count({value})"
+            )
+    elif any(key in json_schema for key in ["items", "minItems", "maxItems"]):
+        return None
+
+    if "enum" in json_schema:
+        if not all(
+            isinstance(option, (str, int, float, bool)) or option is None
+            for option in json_schema["enum"]
+        ):
+            return None
+        conditions.append(f"{value} in {json.dumps(json_schema['enum'])}")
+
+    if "minLength" in json_schema:
+        conditions.append(f"$length({value}) >= {json_schema['minLength']}")
+    if "maxLength" in json_schema:
+        conditions.append(f"$length({value}) <= {json_schema['maxLength']}")
+    if "minimum" in json_schema:
+        conditions.append(f"{value} >= {json_schema['minimum']}")
+    if "maximum" in json_schema:
+        conditions.append(f"{value} <= {json_schema['maximum']}")
 
+    return "(" + " and ".join(conditions) + ")"
+
+
+# Parse the model's JSON response and validate it against the JSON schema.
+# When the schema is covered by get_jsonata_json_schema_condition, the response is first parsed
+# and validated by JSONata states inside the state machine, without invoking the parser function.
+# The parser function is only invoked when that fails, either because the response is invalid
+# or because the states couldn't decide, and it returns the error that is used to fix the response.
 def get_json_response_parser_step(
     scope: Construct,
     id: builtins.str,
     json_schema: typing.Any,
     output_key: builtins.str,
     result_path: builtins.str,
+    validate_in_state_machine: typing.Optional[bool] = True,
+    response_cache_ttl: typing.Optional[Duration] = None,
 ):
     initialize_parse_attempt_counter = sfn.Pass(
         scope,
@@ -269,22 +1698,16 @@ def get_json_response_parser_step(
         result_path="$.error_state",
     )
 
-    parser_lambda = lambda_python.PythonFunction(
-        scope,
-        "".join(id.split()) + "Function",
-        runtime=lambda_.Runtime.PYTHON_3_13,
-        entry="functions/generic/parse_json_response",
-        memory_size=256,
-    )
-
     parser_job = tasks.LambdaInvoke(
         scope,
         id,
-        lambda_function=parser_lambda,
+        lambda_function=get_json_response_parser_function(scope),
         payload=sfn.TaskInput.from_object(
             {
                 "response_string": sfn.JsonPath.string_at("$.model_outputs.response"),
                 "json_schema": json_schema,
+                "step": id,
+                "state_machine_name": sfn.JsonPath.string_at("$$.StateMachine.Name"),
             }
         ),
         result_selector={
@@ -333,13 +1756,58 @@ Remember - only return a valid JSON object.""",
         temperature=0,
         include_previous_conversation_in_prompt=True,
         pass_conversation=True,
+        # The same invalid response and error are fixed the same way at temperature 0,
+        # so the fixed response can be cached
+        response_cache_ttl=response_cache_ttl,
     )
 
+    parse_job = parser_job
+    schema_condition = get_jsonata_json_schema_condition(json_schema, "$value")
+    if validate_in_state_machine and schema_condition is not None:
+        # Parsing an invalid JSON string fails the branch, so the states are wrapped in a
+        # Parallel state that catches the failure and falls back to the parser function
+        response_string = "$states.input.model_outputs.response"
+        validate_json = sfn.Parallel.jsonata(
+            scope,
+            id + " - Validate JSON In State Machine",
+            outputs="{% "
+            + get_jsonata_replace_at_path(
+                result_path, f"{{{json.dumps(output_key)}: $states.result[0].value}}"
+            )
+            + " %}",
+        ).branch(
+            sfn.Choice.jsonata(scope, id + " - Valid JSON?")
+            .when(
+                sfn.Condition.jsonata(
+                    f"{{% ($value := $parse({response_string}); {schema_condition}) %}}"
+                ),
+                sfn.Pass.jsonata(
+                    scope,
+                    id + " - Parsed JSON",
+                    # Wrapped in an object, so that a parsed array isn't flattened into the branch results
+                    outputs=f"{{% {{'value': $parse({response_string})}} %}}",
+                ),
+            )
+            .otherwise(
+                sfn.Fail.jsonata(
+                    scope,
+                    id + " - JSON Not Validated",
+                    error="JsonSchemaValidationError",
+                )
+            )
+        )
+        validate_json.add_catch(
+            handler=parser_job,
+            errors=[sfn.Errors.ALL],
+            outputs="{% $states.input %}",
+        )
+        parse_job = validate_json
+
     attempt_to_fix_json = parse_error_message.next(
         sfn.Choice(scope, id + " - Too many attempts to fix?")
         .when(
             sfn.Condition.number_less_than("$.error_state.parse_error_count", 3),
-            fix_json.next(parser_job),
+            fix_json.next(parse_job),
         )
         .otherwise(sfn.Fail(scope, id + " - Fail"))
     )
@@ -350,4 +1818,7 @@ Remember - only return a valid JSON object.""",
         result_path="$.caught_error",
     )
 
-    return initialize_parse_attempt_counter.next(parser_job)
+    initialize_parse_attempt_counter.next(parse_job)
+    # The parsed response comes out of either the validation states or the parser function
+    end_states = [parser_job] if parse_job is parser_job else [parse_job, parser_job]
+    return sfn.Chain.custom(initialize_parse_attempt_counter, end_states, parse_job)
@@ -4,22 +4,42 @@ from aws_cdk import (
     RemovalPolicy,
     aws_certificatemanager as acm,
     aws_cognito as cognito,
+    aws_dynamodb as dynamodb,
     aws_ec2 as ec2,
     aws_ecr_assets as ecr_assets,
     aws_ecs as ecs,
     aws_ecs_patterns as ecs_patterns,
     aws_elasticloadbalancingv2 as elb,
     aws_elasticloadbalancingv2_actions as elb_actions,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_lambda as lambda_,
+    aws_lambda_python_alpha as lambda_python,
+    aws_logs as logs,
+    aws_logs_destinations as logs_destinations,
     aws_route53 as route53,
     aws_secretsmanager as secretsmanager,
+    aws_sqs as sqs,
     aws_stepfunctions as sfn,
 )
 from constructs import Construct
 
+from .util import (
+    get_response_stream_table_name,
+    get_state_machine_log_group_name,
+)
+import typing
+
 
 class WebappStack(Stack):
     def __init__(
-        self, scope: Construct, construct_id: str, parent_domain: str, **kwargs
+        self,
+        scope: Construct,
+        construct_id: str,
+        parent_domain: str,
+        push_execution_status: bool = False,
+        express_workflows: typing.Sequence[str] = (),
+        **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
@@ -47,10 +67,19 @@ class WebappStack(Stack):
             ".", platform=ecr_assets.Platform.LINUX_AMD64
         )
 
+        # In push mode, the webapp's tasks consume the execution updates from a single queue, so each update
+        # is only received by one task. Run exactly one task, and stop the old task before starting the
+        # new task during deployments, so that no updates are split between two tasks.
+        single_task_options = (
+            {"desired_count": 1, "min_healthy_percent": 0, "max_healthy_percent": 100}
+            if push_execution_status
+            else {}
+        )
         fargate_service = ecs_patterns.ApplicationLoadBalancedFargateService(
             self,
             "StreamlitService",
             cluster=cluster,
+            **single_task_options,
             task_image_options=ecs_patterns.ApplicationLoadBalancedTaskImageOptions(
                 image=image, container_port=8501  # 8501 is the default Streamlit port
             ),
@@ -72,6 +101,7 @@ class WebappStack(Stack):
         )
 
         # Grant access to start and query Step Functions exections
+        workflows = []
         for name_suffix in [
             "BlogPost",
             "TripPlanner",
@@ -87,6 +117,113 @@ class WebappStack(Stack):
             workflow.grant_read(fargate_service.task_definition.task_role)
             workflow.grant_start_execution(fargate_service.task_definition.task_role)
             workflow.grant_task_response(fargate_service.task_definition.task_role)
+            workflows.append((name_suffix, workflow))
+
+        # Grant access to read the streamed model responses of the demos that stream their final response
+        for name_suffix in ["BlogPost", "StoryWriter", "MoviePitch"]:
+            dynamodb.Table.from_table_name(
+                self,
+                f"{name_suffix}ResponseStreamTable",
+                get_response_stream_table_name(f"PromptChainDemo-{name_suffix}"),
+            ).grant_read_data(fargate_service.task_definition.task_role)
+
+        # Express workflows are started synchronously, and their progress is read from their execution logs
+        for name_suffix in express_workflows:
+            workflow = sfn.StateMachine.from_state_machine_name(
+                self, f"{name_suffix}ExpressWorkflow", f"PromptChainDemo-{name_suffix}"
+            )
+            workflow.grant_start_sync_execution(
+                fargate_service.task_definition.task_role
+            )
+            logs.LogGroup.from_log_group_name(
+                self,
+                f"{name_suffix}ExpressWorkflowLogs",
+                get_state_machine_log_group_name(f"PromptChainDemo-{name_suffix}"),
+            ).grant(fargate_service.task_definition.task_role, "logs:FilterLogEvents")
+        if express_workflows:
+            fargate_service.task_definition.default_container.add_environment(
+                "EXPRESS_STATE_MACHINES",
+                ",".join(f"PromptChainDemo-{name}" for name in express_workflows),
+            )
+
+        # Push execution status changes and execution history events to the webapp through a queue,
+        # instead of having the webapp poll Step Functions for them
+        if push_execution_status:
+            # Updates that the webapp fails to handle a few times are moved aside, so they don't hold up
+            # the other updates of their execution
+            execution_events_dead_letter_queue = sqs.Queue(
+                self,
+                "ExecutionEventsDeadLetterQueue",
+                fifo=True,
+                content_based_deduplication=True,
+                retention_period=Duration.days(14),
+            )
+            execution_events_queue = sqs.Queue(
+                self,
+                "ExecutionEventsQueue",
+                fifo=True,
+                content_based_deduplication=True,
+                retention_period=Duration.hours(1),
+                dead_letter_queue=sqs.DeadLetterQueue(
+                    max_receive_count=3,
+                    queue=execution_events_dead_letter_queue,
+                ),
+            )
+            execution_events_queue.grant_consume_messages(
+                fargate_service.task_definition.task_role
+            )
+            fargate_service.task_definition.default_container.add_environment(
+                "EXECUTION_EVENTS_QUEUE_URL", execution_events_queue.queue_url
+            )
+
+            # Execution history events come from the state machines' execution logs,
+            # and execution status changes come from EventBridge. Both are forwarded to the queue
+            # by a function that puts each execution's updates in their own message group.
+            forward_execution_events_lambda = lambda_python.PythonFunction(
+                self,
+                "ForwardExecutionEvents",
+                runtime=lambda_.Runtime.PYTHON_3_13,
+                entry="functions/webapp/forward_execution_events",
+                environment={
+                    "EXECUTION_EVENTS_QUEUE_URL": execution_events_queue.queue_url,
+                },
+                timeout=Duration.seconds(30),
+                memory_size=256,
+            )
+            execution_events_queue.grant_send_messages(forward_execution_events_lambda)
+
+            events.Rule(
+                self,
+                "ExecutionStatusChangeRule",
+                event_pattern=events.EventPattern(
+                    source=["aws.states"],
+                    detail_type=["Step Functions Execution Status Change"],
+                    detail={
+                        "stateMachineArn": [
+                            workflow.state_machine_arn for _, workflow in workflows
+                        ]
+                    },
+                ),
+                targets=[
+                    events_targets.LambdaFunction(forward_execution_events_lambda)
+                ],
+            )
+
+            for name_suffix, _ in workflows:
+                log_group = logs.LogGroup.from_log_group_name(
+                    self,
+                    f"{name_suffix}WorkflowLogs",
+                    get_state_machine_log_group_name(f"PromptChainDemo-{name_suffix}"),
+                )
+                logs.SubscriptionFilter(
+                    self,
+                    f"{name_suffix}WorkflowLogsSubscription",
+                    log_group=log_group,
+                    destination=logs_destinations.LambdaDestination(
+                        forward_execution_events_lambda
+                    ),
+                    filter_pattern=logs.FilterPattern.all_events(),
+                )
 
         # Add Cognito for authentication
         cognito_domain_prefix = "bedrock-serverless-prompt-chaining-demo"
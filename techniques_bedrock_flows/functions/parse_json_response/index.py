@@ -1,8 +1,13 @@
 import json
-from jsonschema import validate
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 import os
 
+# The schema doesn't change, so check it and create its validator once per Lambda environment
 json_schema = json.loads(os.environ["SCHEMA"])
+validator_class = validator_for(json_schema)
+validator_class.check_schema(json_schema)
+validator = validator_class(json_schema)
 
 
 # Parse a JSON escaped string into an object and validate it against the JSON schema.
@@ -11,6 +16,9 @@ def handler(event, context):
     json_string = event["node"]["inputs"][0]["value"]
     response_object = json.loads(json_string)
 
-    validate(instance=response_object, schema=json_schema)
+    # Raise the same error as jsonschema.validate
+    error = best_match(validator.iter_errors(response_object))
+    if error is not None:
+        raise error
 
     return response_object
@@ -1,5 +1,19 @@
+from functools import lru_cache
 import json
-from jsonschema import validate
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+
+# Creating a validator checks the schema and picks the validator class for the schema's draft,
+# so keep the validators for recently seen schemas in warm Lambda environments.
+# The schema is passed in serialized as JSON, which is hashable. Its keys aren't sorted, because
+# their order decides which error is reported when a response has several errors.
+@lru_cache(maxsize=64)
+def get_validator(serialized_json_schema):
+    json_schema = json.loads(serialized_json_schema)
+    validator_class = validator_for(json_schema)
+    validator_class.check_schema(json_schema)
+    return validator_class(json_schema)
 
 
 # Parse the JSON response string into an object and validate it against the JSON schema.
@@ -9,6 +23,10 @@ def handler(event, context):
     response_object = json.loads(response_string)
 
     json_schema = event["json_schema"]
-    validate(instance=response_object, schema=json_schema)
+    validator = get_validator(json.dumps(json_schema))
+    # Raise the same error as jsonschema.validate
+    error = best_match(validator.iter_errors(response_object))
+    if error is not None:
+        raise error
 
     return response_object
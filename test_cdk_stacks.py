@@ -15,8 +15,29 @@ from stacks.most_popular_repo_strands_stack import (
 )
 from stacks.alarms_stack import AlarmsStack
 
+# Note: the webapp stack and trip planner stack do account lookups. Without credentials, the lookups
+# return placeholder values, so these stacks are only synthesized with a placeholder environment.
+placeholder_env = cdk.Environment(account="111111111111", region="us-east-1")
 
-# Note: the webapp stack and trip planner stack are not tested, because they do account lookups
+
+def test_webapp_stack_with_pushed_execution_status_synthesizes_properly():
+    app = cdk.App()
+
+    test_stack = WebappStack(
+        app,
+        "TestStack",
+        env=placeholder_env,
+        parent_domain="example.com",
+        push_execution_status=True,
+    )
+
+    # Ensure the template synthesizes successfully,
+    # and that updates the webapp fails to handle are moved to a dead-letter queue
+    template = Template.from_stack(test_stack)
+    template.has_resource_properties(
+        "AWS::SQS::Queue",
+        {"FifoQueue": True, "RedrivePolicy": {"maxReceiveCount": 3}},
+    )
 
 
 def test_blogpost_stack_synthesizes_properly():
@@ -43,6 +64,88 @@ def test_storywriter_stack_synthesizes_properly():
     Template.from_stack(test_stack)
 
 
+def test_express_blogpost_stack_synthesizes_properly():
+    app = cdk.App()
+
+    test_stack = BlogPostStack(
+        app,
+        "TestStack",
+        express=True,
+    )
+
+    # Ensure the template synthesizes successfully,
+    # and that the Express workflow writes the execution logs that the webapp follows
+    template = Template.from_stack(test_stack)
+    template.has_resource_properties(
+        "AWS::StepFunctions::StateMachine",
+        {
+            "StateMachineType": "EXPRESS",
+            "LoggingConfiguration": {"Level": "ALL", "IncludeExecutionData": False},
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Logs::LogGroup",
+        {"LogGroupName": "/aws/vendedlogs/states/PromptChainDemo-BlogPost"},
+    )
+
+
+def test_express_storywriter_stack_synthesizes_properly():
+    app = cdk.App()
+
+    test_stack = StoryWriterStack(
+        app,
+        "TestStack",
+        express=True,
+    )
+
+    # Ensure the template synthesizes successfully
+    template = Template.from_stack(test_stack)
+    template.has_resource_properties(
+        "AWS::StepFunctions::StateMachine",
+        {"StateMachineType": "EXPRESS", "LoggingConfiguration": {"Level": "ALL"}},
+    )
+
+
+def test_express_tripplanner_stack_synthesizes_properly():
+    app = cdk.App()
+
+    test_stack = TripPlannerStack(
+        app,
+        "TestStack",
+        env=placeholder_env,
+        express=True,
+    )
+
+    # Ensure the template synthesizes successfully
+    template = Template.from_stack(test_stack)
+    template.has_resource_properties(
+        "AWS::StepFunctions::StateMachine",
+        {"StateMachineType": "EXPRESS", "LoggingConfiguration": {"Level": "ALL"}},
+    )
+
+
+def test_moviepitch_stack_with_execution_event_logs_synthesizes_properly():
+    app = cdk.App()
+
+    test_stack = MoviePitchStack(
+        app,
+        "TestStack",
+        log_execution_events=True,
+    )
+
+    # Ensure the template synthesizes successfully,
+    # and that the workflow writes the execution logs that are pushed to the webapp
+    template = Template.from_stack(test_stack)
+    template.has_resource_properties(
+        "AWS::StepFunctions::StateMachine",
+        {"LoggingConfiguration": {"Level": "ALL", "IncludeExecutionData": False}},
+    )
+    template.has_resource_properties(
+        "AWS::Logs::LogGroup",
+        {"LogGroupName": "/aws/vendedlogs/states/PromptChainDemo-MoviePitch"},
+    )
+
+
 def test_moviepitch_stack_synthesizes_properly():
     app = cdk.App()
 
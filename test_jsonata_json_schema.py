@@ -0,0 +1,126 @@
+import copy
+import json
+
+import aws_cdk as cdk
+import jsonata
+import jsonschema
+import pytest
+from aws_cdk.assertions import Template
+
+from stacks.meal_planner_stack import MealPlannerStack
+from stacks.story_writer_stack import StoryWriterStack
+from stacks.util import get_jsonata_json_schema_condition
+
+
+# The JSON schemas that the stack's parser steps pass to the parser function
+def get_parser_json_schemas(stack):
+    schemas = {}
+
+    def find_schemas(value):
+        if isinstance(value, dict):
+            if "json_schema" in value and isinstance(value["json_schema"], dict):
+                schemas[json.dumps(value["json_schema"])] = value["json_schema"]
+            for item in value.values():
+                find_schemas(item)
+        elif isinstance(value, list):
+            for item in value:
+                find_schemas(item)
+
+    template = Template.from_stack(stack).to_json()
+    for resource in template["Resources"].values():
+        if resource["Type"] != "AWS::StepFunctions::StateMachine":
+            continue
+        definition = resource["Properties"]["DefinitionString"]
+        if isinstance(definition, dict):
+            definition = "".join(
+                part if isinstance(part, str) else "reference"
+                for part in definition["Fn::Join"][1]
+            )
+        find_schemas(json.loads(definition))
+    return list(schemas.values())
+
+
+def get_demo_json_schemas():
+    schemas = []
+    for stack_class in [MealPlannerStack, StoryWriterStack]:
+        app = cdk.App()
+        schemas += get_parser_json_schemas(stack_class(app, "TestStack"))
+    return schemas
+
+
+# A document that complies with the schema. The seed makes array items unique.
+def get_valid_document(json_schema, seed=0):
+    if "enum" in json_schema:
+        return json_schema["enum"][seed % len(json_schema["enum"])]
+    schema_type = json_schema["type"]
+    if schema_type == "object":
+        return {
+            key: get_valid_document(property_schema, seed)
+            for key, property_schema in json_schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [
+            get_valid_document(json_schema.get("items", {"type": "string"}), seed + i)
+            for i in range(json_schema.get("minItems", 1))
+        ]
+    return {
+        "string": f"value {seed}",
+        "number": seed + 0.5,
+        "integer": seed,
+        "boolean": True,
+        "null": None,
+    }[schema_type]
+
+
+# Variants of a valid document with a single change each, most of which break the schema
+def get_document_variants(json_schema, document):
+    for other_value in ["text", 1, 1.5, True, None, [], {}]:
+        if type(other_value) is not type(document):
+            yield other_value
+
+    if "enum" in json_schema:
+        yield "not one of the options"
+
+    schema_type = json_schema["type"]
+    if schema_type == "object":
+        for key in document:
+            variant = copy.deepcopy(document)
+            del variant[key]
+            yield variant
+        yield {**document, "unexpected_key": "value"}
+        for key, property_schema in json_schema.get("properties", {}).items():
+            for property_variant in get_document_variants(
+                property_schema, document[key]
+            ):
+                yield {**document, key: property_variant}
+    elif schema_type == "array":
+        yield document[:-1]
+        yield document + [get_valid_document(json_schema["items"], len(document))]
+        yield document[:-1] + [document[0]]
+        for item_variant in get_document_variants(json_schema["items"], document[0]):
+            yield [item_variant] + document[1:]
+
+
+def is_valid_by_jsonata(condition, document):
+    return jsonata.Jsonata(condition).evaluate(None, {"value": document}) is True
+
+
+def is_valid_by_jsonschema(json_schema, document):
+    return jsonschema.Draft202012Validator(json_schema).is_valid(document)
+
+
+@pytest.mark.parametrize("json_schema", get_demo_json_schemas(), ids=json.dumps)
+def test_jsonata_condition_matches_jsonschema(json_schema):
+    condition = get_jsonata_json_schema_condition(json_schema, "$value")
+    assert condition is not None
+
+    valid_document = get_valid_document(json_schema)
+    assert is_valid_by_jsonschema(json_schema, valid_document)
+    assert is_valid_by_jsonata(condition, valid_document)
+
+    invalid_documents = 0
+    for document in get_document_variants(json_schema, valid_document):
+        is_valid = is_valid_by_jsonschema(json_schema, document)
+        assert is_valid_by_jsonata(condition, document) == is_valid, document
+        invalid_documents += 0 if is_valid else 1
+    assert invalid_documents > 0
@@ -0,0 +1,96 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+# The Lambda functions are all in modules named index, so load the parser function by its path
+spec = importlib.util.spec_from_file_location(
+    "parse_json_response",
+    os.path.join(
+        os.path.dirname(__file__), "functions/generic/parse_json_response/index.py"
+    ),
+)
+parser = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(parser)
+
+
+def test_strip_code_fences_returns_the_fenced_json():
+    assert parser.strip_code_fences('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert parser.strip_code_fences("Here you go:\n```\n[1, 2]\n```\nDone.") == "[1, 2]"
+
+
+def test_strip_code_fences_leaves_text_without_fences():
+    assert parser.strip_code_fences('{"a": 1}') == '{"a": 1}'
+
+
+def test_strip_code_fences_keeps_nested_fences():
+    text = '```json\n{"code": "```python\\nprint(1)\\n```"}\n```'
+    assert json.loads(parser.strip_code_fences(text)) == {
+        "code": "```python\nprint(1)\n```"
+    }
+
+
+def test_unescape_braces_unescapes_backslashed_braces():
+    assert parser.unescape_braces('\\{"a": 1\\}') == '{"a": 1}'
+
+
+def test_unescape_braces_collapses_doubled_braces():
+    assert parser.unescape_braces('{{"a": 1}}') == '{"a": 1}'
+
+
+def test_unescape_braces_collapses_nested_doubled_braces():
+    assert parser.unescape_braces('{"a": {{"b": 1}}}') == '{"a": {"b": 1}}'
+    assert parser.unescape_braces('{{"a": [{{"b": 1}}, 2]}}') == '{"a": [{"b": 1}, 2]}'
+
+
+def test_unescape_braces_keeps_braces_inside_strings():
+    text = '{{"a": "{{b}} \\\\{c\\\\} \\"{{d}}\\""}}'
+    assert json.loads(parser.unescape_braces(text)) == {"a": '{{b}} \\{c\\} "{{d}}"'}
+
+
+def test_unescape_braces_keeps_valid_nested_closing_braces():
+    assert parser.unescape_braces('{"a": {"b": 1}}') == '{"a": {"b": 1}}'
+
+
+def test_extract_json_value_removes_surrounding_text():
+    assert (
+        parser.extract_json_value('Sure! {"a": [1]} Hope this helps.') == '{"a": [1]}'
+    )
+    assert parser.extract_json_value("The list: [1, [2]] done") == "[1, [2]]"
+
+
+def test_extract_json_value_ignores_brackets_inside_strings():
+    text = 'Result: {"a": "} ] {", "b": "\\"}"} trailing }'
+    assert parser.extract_json_value(text) == '{"a": "} ] {", "b": "\\"}"}'
+
+
+def test_extract_json_value_leaves_text_without_json():
+    assert parser.extract_json_value("no json here") == "no json here"
+
+
+def test_remove_trailing_commas_before_closing_brackets():
+    assert parser.remove_trailing_commas('{"a": [1, 2, ], }') == '{"a": [1, 2 ] }'
+
+
+def test_remove_trailing_commas_keeps_commas_inside_strings():
+    text = '{"a": "x, }", "b": "y,]",}'
+    assert parser.remove_trailing_commas(text) == '{"a": "x, }", "b": "y,]"}'
+
+
+def test_parse_json_response_applies_the_repairs_in_order():
+    response = 'Here is the JSON:\n```json\n{{"a": [1, 2,], "b": "{{c}},"}}\n```'
+    assert parser.parse_json_response(response) == (
+        {"a": [1, 2], "b": "{{c}},"},
+        ["strip_code_fences", "unescape_braces", "remove_trailing_commas"],
+    )
+
+
+def test_parse_json_response_needs_no_repairs_for_valid_json():
+    assert parser.parse_json_response('{"a": 1}') == ({"a": 1}, [])
+
+
+def test_parse_json_response_raises_the_original_error():
+    with pytest.raises(json.JSONDecodeError) as error:
+        parser.parse_json_response('{"a": ')
+    assert error.value.doc == '{"a": '
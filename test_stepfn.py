@@ -0,0 +1,430 @@
+import json
+import os
+import sys
+
+# The webapp module creates its AWS clients on import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.append(os.path.join(os.path.dirname(__file__), "webapp"))
+
+import stepfn
+
+
+def history_event(id, type, previous_event_id, **details):
+    event = {"id": id, "type": type, "previousEventId": previous_event_id}
+    event.update(details)
+    return event
+
+
+def state_entered(id, previous_event_id, name):
+    return history_event(
+        id,
+        "TaskStateEntered",
+        previous_event_id,
+        stateEnteredEventDetails={"name": name},
+    )
+
+
+# An execution where the first task succeeds after a retry, the second task fails,
+# and the third task waits for a task token
+EXECUTION_HISTORY = [
+    history_event(1, "ExecutionStarted", 0),
+    state_entered(2, 1, "Generate Ideas"),
+    history_event(3, "TaskScheduled", 2),
+    history_event(4, "TaskStarted", 3),
+    history_event(5, "TaskFailed", 4),
+    history_event(6, "TaskScheduled", 5),
+    history_event(7, "TaskStarted", 6),
+    history_event(8, "TaskSucceeded", 7),
+    history_event(9, "TaskStateExited", 8),
+    state_entered(10, 9, "Score Ideas"),
+    history_event(11, "TaskScheduled", 10),
+    history_event(12, "TaskStarted", 11),
+    history_event(13, "TaskFailed", 12),
+    state_entered(14, 13, "Seek User Input"),
+    history_event(15, "TaskScheduled", 14),
+    history_event(16, "TaskStarted", 15),
+    history_event(
+        17,
+        "TaskSubmitted",
+        16,
+        taskSubmittedEventDetails={"resource": "invoke.waitForTaskToken"},
+    ),
+]
+
+
+# Serves the execution history in pages, forwards or backwards, like the history API
+class FakeHistoryClient:
+    def __init__(self, events, page_size):
+        self.events = events
+        self.page_size = page_size
+        self.requests = []
+        self.pages_read = 0
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "get_execution_history"
+        return self
+
+    def paginate(self, **request):
+        self.requests.append(request)
+        events = list(self.events)
+        if request.get("reverseOrder"):
+            events.reverse()
+        for start in range(0, len(events), self.page_size):
+            self.pages_read += 1
+            yield {"events": events[start : start + self.page_size]}
+
+
+def get_task_status(history):
+    return {
+        task["task_name"]: task["task_status"] for task in history.task_status.values()
+    }
+
+
+def test_first_poll_reads_the_whole_history_forwards():
+    client = FakeHistoryClient(EXECUTION_HISTORY, page_size=4)
+    history = stepfn.ExecutionHistory("arn", client)
+
+    new_events = history.fetch_new_events()
+
+    assert [event.id for event in new_events] == list(range(1, 18))
+    assert not client.requests[0].get("reverseOrder")
+    assert history.last_event_id == 17
+
+
+def test_later_polls_page_backwards_across_page_boundaries():
+    client = FakeHistoryClient(EXECUTION_HISTORY[:9], page_size=3)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+
+    client.events = EXECUTION_HISTORY
+    client.pages_read = 0
+    new_events = history.fetch_new_events()
+
+    # Pages of 3 events backwards from event 17: 17-15, 14-12 and 11-9, where event 9 was already seen
+    assert client.requests[-1]["reverseOrder"] is True
+    assert client.pages_read == 3
+    assert [event.id for event in new_events] == list(range(10, 18))
+    assert history.last_event_id == 17
+
+
+def test_later_polls_stop_at_a_page_boundary():
+    client = FakeHistoryClient(EXECUTION_HISTORY[:11], page_size=3)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+
+    # The 6 new events fill exactly two pages, so the third page has only seen events
+    client.events = EXECUTION_HISTORY
+    client.pages_read = 0
+    new_events = history.fetch_new_events()
+
+    assert client.pages_read == 3
+    assert [event.id for event in new_events] == list(range(12, 18))
+
+
+def test_polls_without_new_events_read_a_single_page():
+    client = FakeHistoryClient(EXECUTION_HISTORY, page_size=3)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+
+    client.pages_read = 0
+    assert history.fetch_new_events() == []
+    assert client.pages_read == 1
+
+
+def test_task_status_after_retries_and_failures():
+    client = FakeHistoryClient(EXECUTION_HISTORY, page_size=100)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+
+    assert get_task_status(history) == {
+        "Generate Ideas": ":white_check_mark:",
+        "Score Ideas": ":bangbang:",
+        "Seek User Input": ":arrows_counterclockwise:",
+    }
+
+
+def test_task_status_is_updated_incrementally():
+    client = FakeHistoryClient(EXECUTION_HISTORY[:5], page_size=2)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+    # The first attempt of the task failed, but the task is retried
+    assert get_task_status(history) == {"Generate Ideas": ":bangbang:"}
+
+    client.events = EXECUTION_HISTORY[:9]
+    history.fetch_new_events()
+    assert get_task_status(history) == {"Generate Ideas": ":white_check_mark:"}
+
+
+def test_event_task_index_assigns_events_to_their_task():
+    event_index = stepfn.EventTaskIndex()
+    events = [stepfn.EventRecord.from_history_event(e) for e in EXECUTION_HISTORY]
+    for event in events:
+        event_index.add_event(event)
+
+    assert event_index.find_task(events[7]) == {
+        "task_id": 2,
+        "task_name": "Generate Ideas",
+    }
+    assert event_index.find_task(events[12]) == {
+        "task_id": 10,
+        "task_name": "Score Ideas",
+    }
+    # The execution started event doesn't belong to any task
+    try:
+        event_index.find_task(events[0])
+        assert False, "Expected no task for the execution started event"
+    except Exception as e:
+        assert "Could not find the task" in str(e)
+
+
+def test_finds_the_task_token_event():
+    client = FakeHistoryClient(EXECUTION_HISTORY, page_size=5)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+    assert history.get_task_token_event_id() == 17
+
+    # The execution moves on once the task token is returned
+    client.events = EXECUTION_HISTORY + [history_event(18, "TaskSucceeded", 17)]
+    history.fetch_new_events()
+    assert history.get_task_token_event_id() is None
+
+
+def test_no_task_token_event_while_the_execution_runs_other_tasks():
+    client = FakeHistoryClient(EXECUTION_HISTORY[:16], page_size=5)
+    history = stepfn.ExecutionHistory("arn", client)
+    history.fetch_new_events()
+    assert history.get_task_token_event_id() is None
+
+
+class FakeTaskTokenClient:
+    def __init__(self, most_recent_event):
+        self.most_recent_event = most_recent_event
+
+    def get_execution_history(self, **request):
+        assert request["reverseOrder"] is True and request["maxResults"] == 1
+        return {"events": [self.most_recent_event]}
+
+
+def test_get_task_token_payload():
+    event = history_event(
+        17,
+        "TaskSubmitted",
+        16,
+        taskSubmittedEventDetails={
+            "resource": "invoke.waitForTaskToken",
+            "output": json.dumps({"Payload": {"question": "Which idea?"}}),
+        },
+    )
+    client = FakeTaskTokenClient(event)
+
+    assert stepfn.get_task_token_payload("arn", 17, client) == {
+        "question": "Which idea?"
+    }
+    # The execution moved on since the task token event was seen
+    assert stepfn.get_task_token_payload("arn", 15, client) is None
+
+
+# A clock that only moves when the test advances it
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_allows_a_burst_up_to_its_capacity():
+    bucket = stepfn.TokenBucket(rate=2, capacity=3, clock=FakeClock())
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # Further calls go into debt, and each waits for its own token
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+
+def test_token_bucket_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = stepfn.TokenBucket(rate=2, capacity=3, clock=clock)
+    for _ in range(3):
+        bucket.reserve()
+
+    clock.advance(1)
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    assert bucket.reserve() == 0.5
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    clock = FakeClock()
+    bucket = stepfn.TokenBucket(rate=2, capacity=3, clock=clock)
+    bucket.reserve()
+
+    clock.advance(100)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == 0.5
+
+
+def test_token_bucket_pays_off_its_debt_before_refilling():
+    clock = FakeClock()
+    bucket = stepfn.TokenBucket(rate=2, capacity=3, clock=clock)
+    for _ in range(5):
+        bucket.reserve()
+
+    # One second refills 2 tokens, which only pays off the 2 tokens of debt
+    clock.advance(1)
+    assert bucket.reserve() == 0.5
+
+
+def test_token_bucket_utilization():
+    clock = FakeClock()
+    bucket = stepfn.TokenBucket(rate=2, capacity=4, clock=clock)
+    assert bucket.get_utilization() == 0
+
+    for _ in range(6):
+        bucket.reserve()
+    assert bucket.get_utilization() == 1
+
+    clock.advance(2)
+    assert bucket.get_utilization() == 0.5
+
+
+def test_rate_governor_uses_a_bucket_per_api():
+    governor = stepfn.StepFunctionsRateGovernor(
+        rate_limits={"GetExecutionHistory": (1, 2)},
+        default_rate_limit=(10, 1),
+        clock=FakeClock(),
+    )
+
+    assert [governor.reserve("GetExecutionHistory") for _ in range(3)] == [0, 0, 1]
+    assert [governor.reserve("DescribeExecution") for _ in range(2)] == [0, 0.1]
+
+    metrics = governor.get_metrics()
+    assert metrics["calls"] == 5
+    assert metrics["queued_calls"] == 2
+    assert metrics["max_queued_calls"] == 2
+    assert metrics["total_wait_time"] == 1.1
+
+    governor.finish_waiting()
+    assert governor.get_metrics()["queued_calls"] == 1
+
+
+def test_rate_governor_backs_off_as_its_buckets_are_used_up():
+    clock = FakeClock()
+    governor = stepfn.StepFunctionsRateGovernor(
+        rate_limits={"GetExecutionHistory": (1, 4)},
+        max_backoff_factor=8,
+        clock=clock,
+    )
+    assert governor.get_backoff_factor() == 1
+
+    for _ in range(2):
+        governor.reserve("GetExecutionHistory")
+    assert governor.get_backoff_factor() == 4.5
+
+    for _ in range(3):
+        governor.reserve("GetExecutionHistory")
+    assert governor.get_backoff_factor() == 8
+
+    clock.advance(5)
+    assert governor.get_backoff_factor() == 1
+
+
+def throttled_response(error_code):
+    return ({"status_code": 400}, {"Error": {"Code": error_code}})
+
+
+def test_rate_governor_backs_off_fully_after_a_throttle():
+    clock = FakeClock()
+    governor = stepfn.StepFunctionsRateGovernor(
+        max_backoff_factor=8, throttle_cooldown=60, clock=clock
+    )
+
+    governor.count_throttles(response=throttled_response("ThrottlingException"))
+    assert governor.get_metrics()["throttles"] == 1
+    assert governor.get_backoff_factor() == 8
+
+    clock.advance(59)
+    assert governor.get_backoff_factor() == 8
+
+    # Another throttle restarts the cooldown
+    governor.count_throttles(response=throttled_response("TooManyRequestsException"))
+    clock.advance(59)
+    assert governor.get_backoff_factor() == 8
+
+    clock.advance(1)
+    assert governor.get_backoff_factor() == 1
+    assert governor.get_metrics()["throttles"] == 2
+
+
+def test_rate_governor_ignores_other_retries():
+    governor = stepfn.StepFunctionsRateGovernor(clock=FakeClock())
+
+    governor.count_throttles(response=throttled_response("ServiceUnavailable"))
+    governor.count_throttles(response=None)
+
+    assert governor.get_metrics()["throttles"] == 0
+    assert governor.get_backoff_factor() == 1
+
+
+class FakeSqsClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.deleted_receipt_handles = []
+
+    def receive_message(self, **request):
+        assert request["MessageSystemAttributeNames"] == ["MessageGroupId"]
+        return {"Messages": self.messages}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted_receipt_handles.append(ReceiptHandle)
+
+
+class FakePoller:
+    def __init__(self, failing_execution_arn):
+        self.failing_execution_arn = failing_execution_arn
+        self.updates = []
+
+    def push_update(self, execution_arn, execution=None, events=None):
+        if execution_arn == self.failing_execution_arn:
+            raise Exception("Failed to push the update")
+        self.updates.append((execution_arn, execution, events))
+
+
+def sqs_message(receipt_handle, execution_arn, body):
+    return {
+        "MessageId": f"message-{receipt_handle}",
+        "ReceiptHandle": receipt_handle,
+        "Body": json.dumps(body),
+        "Attributes": {"MessageGroupId": f"group-{execution_arn}"},
+    }
+
+
+def test_event_consumer_leaves_failed_messages_and_the_rest_of_their_group():
+    status_change = {
+        "detail-type": "Step Functions Execution Status Change",
+        "detail": {"executionArn": "arn-1", "status": "SUCCEEDED"},
+    }
+    sqs_client = FakeSqsClient(
+        [
+            sqs_message("1", "arn-1", {"execution_arn": "arn-1", "events": [1]}),
+            sqs_message("2", "arn-2", {"execution_arn": "arn-2", "events": [1]}),
+            sqs_message("3", "arn-1", status_change),
+            sqs_message("4", "arn-2", {"execution_arn": "arn-2", "events": [2]}),
+            sqs_message("5", "arn-3", "not an execution update"),
+            sqs_message("6", "arn-4", {"execution_arn": "arn-4", "events": [1]}),
+        ]
+    )
+    poller = FakePoller(failing_execution_arn="arn-2")
+    consumer = stepfn.ExecutionEventConsumer("queue-url", poller, sqs_client)
+
+    consumer.receive_messages()
+
+    assert poller.updates == [
+        ("arn-1", None, [1]),
+        ("arn-1", status_change["detail"], None),
+        ("arn-4", None, [1]),
+    ]
+    # The failed messages are received again, or moved to the dead-letter queue
+    assert sqs_client.deleted_receipt_handles == ["1", "3", "6"]
@@ -9,6 +9,7 @@ st.set_page_config(layout="wide")
 st.title("Blog post generator demo")
 
 execution_status_container = None
+response_stream_container = None
 
 # Populate a unique user ID to use for naming the Step Functions execution
 if "user_id" not in st.session_state:
@@ -31,8 +32,24 @@ def display_no_state_machine_status():
             st.write("Not started yet.")
 
 
+def display_response_stream(response_text):
+    if response_stream_container:
+        response_stream_container.markdown(response_text)
+
+
 def execute_state_machine(novel):
     input = {"novel": novel}
+    if stepfn.is_express_state_machine("PromptChainDemo-BlogPost"):
+        response = stepfn.start_sync_execution(
+            "PromptChainDemo-BlogPost",
+            st.session_state.user_id,
+            json.dumps(input),
+            display_state_machine_status,
+            response_stream_callback_fn=display_response_stream,
+        )
+        st.session_state.blog_post_execution_arn = response["executionArn"]
+        return response
+
     execution_arn = stepfn.start_execution(
         "PromptChainDemo-BlogPost",
         st.session_state.user_id,
@@ -40,7 +57,9 @@ def execute_state_machine(novel):
     )
     st.session_state.blog_post_execution_arn = execution_arn
     return stepfn.poll_for_execution_completion(
-        execution_arn, display_state_machine_status
+        execution_arn,
+        display_state_machine_status,
+        response_stream_callback_fn=display_response_stream,
     )
 
 
@@ -72,6 +91,8 @@ with demo_col:
         )
         started = st.form_submit_button("Start")
         if started:
+            # The final response is shown here as it is generated
+            response_stream_container = st.empty()
             with st.spinner("Wait for it..."):
                 if "blog_post_execution_arn" in st.session_state:
                     del st.session_state["blog_post_execution_arn"]
@@ -81,8 +102,9 @@ with demo_col:
                 st.session_state.blog_post_execution_status = response["status"]
                 if response["status"] == "SUCCEEDED":
                     output = json.loads(response["output"])
-                    st.session_state.blog_post_content = output
+                    st.session_state.blog_post_content = output["blog_post"]
 
+            response_stream_container.empty()
             if st.session_state.blog_post_execution_status == "SUCCEEDED":
                 st.success("Done!")
                 st.write(st.session_state.blog_post_content)
@@ -34,6 +34,16 @@ def display_no_state_machine_status():
 
 def execute_state_machine(location):
     input = {"location": location}
+    if stepfn.is_express_state_machine("PromptChainDemo-TripPlanner"):
+        response = stepfn.start_sync_execution(
+            "PromptChainDemo-TripPlanner",
+            st.session_state.user_id,
+            json.dumps(input),
+            display_state_machine_status,
+        )
+        st.session_state.trip_planner_execution_arn = response["executionArn"]
+        return response
+
     execution_arn = stepfn.start_execution(
         "PromptChainDemo-TripPlanner",
         st.session_state.user_id,
@@ -10,6 +10,7 @@ st.set_page_config(layout="wide")
 st.title("Movie pitch demo")
 
 execution_status_container = None
+response_stream_container = None
 
 # Populate a unique user ID to use for naming the Step Functions execution
 if "user_id" not in st.session_state:
@@ -35,6 +36,11 @@ def display_no_state_machine_status():
             st.write("Not started yet.")
 
 
+def display_response_stream(response_text):
+    if response_stream_container:
+        response_stream_container.markdown(response_text)
+
+
 def execute_state_machine(movie_description):
     input = {"movie_description": movie_description}
     execution_arn = stepfn.start_execution(
@@ -54,7 +60,9 @@ def continue_state_machine(task_result):
     )
     time.sleep(2)
     return stepfn.poll_for_execution_task_token_or_completion(
-        st.session_state.movie_pitch_execution_arn, display_state_machine_status
+        st.session_state.movie_pitch_execution_arn,
+        display_state_machine_status,
+        response_stream_callback_fn=display_response_stream,
     )
 
 
@@ -139,6 +147,8 @@ with demo_col:
                 yes = st.form_submit_button("Yes, greenlight the movie!")
                 no = st.form_submit_button("No, try again.")
                 if yes or no:
+                    # The one-pager is shown here as it is generated
+                    response_stream_container = st.empty()
                     with st.spinner("Wait for it..."):
                         result = {
                             "movie_description": st.session_state.movie_pitch_description,
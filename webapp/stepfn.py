@@ -1,38 +1,286 @@
+import array
 import boto3
+import botocore.config
+import collections
+import concurrent.futures
+import itertools
 import json
+import logging
+import os
+import queue
+import random
+import threading
 import time
 import uuid
 
 
+logger = logging.getLogger(__name__)
+
 sfn_client = boto3.client("stepfunctions")
 sts_client = boto3.client("sts")
+logs_client = boto3.client("logs")
+dynamodb_client = boto3.client("dynamodb")
 default_region = boto3.session.Session().region_name
 
+# StartSyncExecution returns when the Express execution completes, which can take up to 5 minutes.
+# The call is not retried, because a retry would start another execution.
+sync_sfn_client = boto3.client(
+    "stepfunctions",
+    config=botocore.config.Config(
+        read_timeout=330, retries={"mode": "standard", "total_max_attempts": 1}
+    ),
+)
+
+
+# A token bucket that refills at a steady rate up to its capacity.
+# Calls can take a token even when the bucket is empty: the bucket goes into debt,
+# and the caller is told how long to wait until its token would have been available.
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.last_refill_time = clock()
+
+    def reserve(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill_time) * self.rate
+        )
+        self.last_refill_time = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    # How much of the bucket has been used up, from 0 (full) to 1 (empty or in debt)
+    def get_utilization(self):
+        tokens = min(
+            self.capacity,
+            self.tokens + (self.clock() - self.last_refill_time) * self.rate,
+        )
+        return min(1, max(0, 1 - tokens / self.capacity))
+
+
+# Step Functions throttles API calls per account and per API with token buckets,
+# and GetExecutionHistory and DescribeExecution have some of the lowest refill rates.
+# The webapp shares these quotas with everything else running in the account,
+# so every Step Functions call made by the webapp first takes a token from a client-side bucket
+# for its API, staying well under the account quotas.
+# The governor also tracks how saturated its buckets are and how often Step Functions
+# still throttles the webapp, so that the execution poller can slow down before the
+# whole account gets throttled.
+class StepFunctionsRateGovernor:
+    # API name -> (calls per second, burst capacity)
+    default_rate_limits = {
+        "GetExecutionHistory": (4, 20),
+        "DescribeExecution": (10, 40),
+    }
+
+    def __init__(
+        self,
+        rate_limits=default_rate_limits,
+        default_rate_limit=(5, 20),
+        max_backoff_factor=8,
+        throttle_cooldown=60,
+        clock=time.monotonic,
+    ):
+        self.rate_limits = rate_limits
+        self.default_rate_limit = default_rate_limit
+        self.max_backoff_factor = max_backoff_factor
+        self.throttle_cooldown = throttle_cooldown
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.queued_calls = 0
+        self.max_queued_calls = 0
+        self.throttles = 0
+        self.last_throttle_time = None
+        self.total_wait_time = 0
+
+    # Route all of a client's calls through the governor, including retries and paginated calls
+    def register(self, client):
+        events = client.meta.events
+        service_id = client.meta.service_model.service_id.hyphenize()
+        events.register(f"before-send.{service_id}", self.before_send)
+        events.register(f"needs-retry.{service_id}", self.count_throttles)
+
+    def before_send(self, event_name, **kwargs):
+        wait_time = self.reserve(event_name.split(".")[-1])
+        if wait_time > 0:
+            time.sleep(wait_time)
+            self.finish_waiting()
+
+    # Take a token for the API and return how long the caller needs to wait before calling it
+    def reserve(self, api_name):
+        with self.lock:
+            if api_name not in self.buckets:
+                rate, capacity = self.rate_limits.get(api_name, self.default_rate_limit)
+                self.buckets[api_name] = TokenBucket(rate, capacity, self.clock)
+            wait_time = self.buckets[api_name].reserve()
+            self.calls += 1
+            if wait_time > 0:
+                self.queued_calls += 1
+                self.max_queued_calls = max(self.max_queued_calls, self.queued_calls)
+                self.total_wait_time += wait_time
+            return wait_time
+
+    def finish_waiting(self):
+        with self.lock:
+            self.queued_calls -= 1
+
+    def count_throttles(self, response, **kwargs):
+        # The response is None when the request failed without a response from Step Functions
+        if response is None:
+            return
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in ["ThrottlingException", "TooManyRequestsException"]:
+            with self.lock:
+                self.throttles += 1
+                self.last_throttle_time = self.clock()
+
+    # How much slower than usual to poll executions: grows as the buckets are used up,
+    # and goes to the maximum for a while after Step Functions throttles the webapp
+    def get_backoff_factor(self):
+        with self.lock:
+            if (
+                self.last_throttle_time is not None
+                and self.clock() - self.last_throttle_time < self.throttle_cooldown
+            ):
+                return self.max_backoff_factor
+            utilization = max(
+                [bucket.get_utilization() for bucket in self.buckets.values()],
+                default=0,
+            )
+        return 1 + utilization * (self.max_backoff_factor - 1)
+
+    def get_metrics(self):
+        backoff_factor = self.get_backoff_factor()
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "queued_calls": self.queued_calls,
+                "max_queued_calls": self.max_queued_calls,
+                "throttles": self.throttles,
+                "total_wait_time": self.total_wait_time,
+                "average_wait_time": (
+                    self.total_wait_time / self.calls if self.calls else 0
+                ),
+                "backoff_factor": backoff_factor,
+            }
+
+
+rate_governor = StepFunctionsRateGovernor()
+rate_governor.register(sfn_client)
+rate_governor.register(sync_sfn_client)
+
+
+# The fields of an execution history event that the webapp reads.
+# Everything else in a history event, like its timestamp and its input and output details,
+# is dropped as soon as the event is received.
+class EventRecord:
+    __slots__ = (
+        "id",
+        "type",
+        "previous_event_id",
+        "state_name",
+        "waits_for_task_token",
+    )
+
+    def __init__(
+        self, id, type, previous_event_id, state_name=None, waits_for_task_token=False
+    ):
+        self.id = id
+        self.type = type
+        self.previous_event_id = previous_event_id
+        self.state_name = state_name
+        self.waits_for_task_token = waits_for_task_token
+
+    @classmethod
+    def from_history_event(cls, event):
+        return cls(
+            event["id"],
+            event["type"],
+            event["previousEventId"],
+            event.get("stateEnteredEventDetails", {}).get("name"),
+            event["type"] == "TaskSubmitted"
+            and event.get("taskSubmittedEventDetails", {}).get("resource")
+            == "invoke.waitForTaskToken",
+        )
+
+    # Convert an entry from a state machine's execution logs, which has the same information
+    # as the matching history event, but in a different format
+    @classmethod
+    def from_log_entry(cls, log_entry):
+        details = log_entry.get("details") or {}
+        return cls(
+            int(log_entry["id"]),
+            log_entry["type"],
+            int(log_entry["previous_event_id"]),
+            (
+                details.get("name")
+                if log_entry["type"].endswith("StateEntered")
+                else None
+            ),
+            log_entry["type"] == "TaskSubmitted"
+            and details.get("resource") == "invoke.waitForTaskToken",
+        )
+
 
 # Methods for displaying the state machine's execution history
-def find_task_id(event, events_by_id):
+def get_task_started_by_event(event):
     # The "Task" is the event where we first see the "Entered" state and which has a name
-    if event["type"] == "WaitStateEntered":
+    if event.type == "WaitStateEntered":
         return {
-            "task_id": event["id"],
+            "task_id": event.id,
             "task_name": "Wait a few seconds to avoid Bedrock throttling",
         }
-    elif (
-        "stateEnteredEventDetails" in event
-        and "name" in event["stateEnteredEventDetails"]
-    ):
+    elif event.state_name is not None:
         return {
-            "task_id": event["id"],
-            "task_name": event["stateEnteredEventDetails"]["name"],
+            "task_id": event.id,
+            "task_name": event.state_name,
         }
-    else:
-        # Go back through the event history until we find the original TaskStateEntered/WaitStateEntered event for this task
-        previous_event_id = event["previousEventId"]
-        if previous_event_id not in events_by_id:
-            raise Exception(
-                f"Could not find previous event {previous_event_id} for event {event['id']}"
-            )
-        return find_task_id(events_by_id[previous_event_id], events_by_id)
+    return None
+
+
+# Assigns each event in an execution history to the task that owns it.
+# An event either starts a task itself, or belongs to the same task as its previous event.
+# Events are added in order of their IDs, so the owner of an event's previous event is always
+# already known, and each event's owner is resolved once when the event is added.
+# The index only keeps the owning task ID of each event in an array, plus the name of each task,
+# so its memory use per event stays small no matter how long the execution runs.
+class EventTaskIndex:
+    def __init__(self):
+        # Event ID - 1 -> ID of the event that started the owning task, or 0 for no task
+        self.task_ids = array.array("q")
+        self.task_names = {}
+
+    def add_event(self, event):
+        if event.id <= len(self.task_ids):
+            # Already added
+            return
+        # Event IDs are sequential, but leave room for any events that were skipped
+        while len(self.task_ids) < event.id - 1:
+            self.task_ids.append(0)
+
+        task = get_task_started_by_event(event)
+        if task:
+            self.task_names[task["task_id"]] = task["task_name"]
+            self.task_ids.append(task["task_id"])
+        elif 0 < event.previous_event_id <= len(self.task_ids):
+            self.task_ids.append(self.task_ids[event.previous_event_id - 1])
+        else:
+            self.task_ids.append(0)
+
+    def find_task(self, event):
+        task_id = 0
+        if 0 < event.id <= len(self.task_ids):
+            task_id = self.task_ids[event.id - 1]
+        if task_id == 0:
+            raise Exception(f"Could not find the task for event {event.id}")
+        return {"task_id": task_id, "task_name": self.task_names[task_id]}
 
 
 known_event_types = [
@@ -77,30 +325,24 @@ def get_workflow_status_icon(status):
     raise Exception(f"Unknown event type {status}")
 
 
-def get_workflow_status_markdown(execution, execution_events):
-    markdown = f"##### Status: {get_workflow_status_icon(execution['status'])} {execution['status'].title()}"
-    markdown += f"\n\n##### Tasks"
-
-    # Keep a dictionary of events: event ID -> event details
-    events_by_id = {}
-    for event in execution_events:
-        events_by_id[event["id"]] = event
-
-    # Keep a dictionary of tasks: task ID -> state (running, failed, succeeded) and name
-    task_status = {}
-
+def update_task_status(task_status, events, event_index):
     # Determine the state of each unique task and its unique task name
-    for event in execution_events:
-        if event["type"] not in known_event_types:
+    for event in events:
+        if event.type not in known_event_types:
             continue
-        task = find_task_id(event, events_by_id)
-        status = get_task_status(event["type"])
+        task = event_index.find_task(event)
+        status = get_task_status(event.type)
         task_status[task["task_id"]] = {
             "task_id": task["task_id"],
             "task_name": task["task_name"],
             "task_status": status,
         }
 
+
+def render_workflow_status_markdown(execution, task_status):
+    markdown = f"##### Status: {get_workflow_status_icon(execution['status'])} {execution['status'].title()}"
+    markdown += f"\n\n##### Tasks"
+
     # Display the task status
     task_ids = list(task_status.keys())
     task_ids.sort()
@@ -111,9 +353,160 @@ def get_workflow_status_markdown(execution, execution_events):
     return markdown
 
 
-# Construct the state machine ARN by querying the region and account ID
-def get_state_machine_arn(name, region=default_region, sts_client=sts_client):
-    return f"arn:aws:states:{region}:{sts_client.get_caller_identity()['Account']}:stateMachine:{name}"
+# Tracks the execution history of a single execution across polls.
+# After the first poll, only the events newer than the last seen event are fetched,
+# and the task status is updated incrementally from those new events.
+class ExecutionHistory:
+    def __init__(self, execution_arn, client=sfn_client):
+        self.execution_arn = execution_arn
+        self.client = client
+        self.last_event_id = 0
+        self.task_token_event_id = None
+        self.event_index = EventTaskIndex()
+        self.task_status = {}
+
+    def fetch_new_events(self):
+        paginator = self.client.get_paginator("get_execution_history")
+        new_events = []
+
+        if self.last_event_id == 0:
+            # First poll: read the whole history in as few pages as possible
+            for page in paginator.paginate(
+                executionArn=self.execution_arn,
+                includeExecutionData=False,
+                PaginationConfig={"PageSize": 1000},
+            ):
+                new_events += [
+                    EventRecord.from_history_event(event) for event in page["events"]
+                ]
+        else:
+            # The history API cannot start after a given event ID, so page backwards from
+            # the most recent event until reaching an event that has already been seen
+            for page in paginator.paginate(
+                executionArn=self.execution_arn,
+                includeExecutionData=False,
+                reverseOrder=True,
+            ):
+                unseen_events = [
+                    EventRecord.from_history_event(event)
+                    for event in page["events"]
+                    if event["id"] > self.last_event_id
+                ]
+                new_events += unseen_events
+                if len(unseen_events) < len(page["events"]):
+                    break
+
+        new_events.sort(key=lambda event: event.id)
+        self.add_events(new_events)
+        return new_events
+
+    def add_events(self, events):
+        for event in events:
+            self.event_index.add_event(event)
+            if event.id > self.last_event_id:
+                self.last_event_id = event.id
+                self.task_token_event_id = (
+                    event.id if event.waits_for_task_token else None
+                )
+        update_task_status(self.task_status, events, self.event_index)
+
+    def get_status_markdown(self, execution):
+        return render_workflow_status_markdown(execution, self.task_status)
+
+    # Add event records that were pushed to the webapp instead of fetched from the history API.
+    # Pushed events are only added if they continue the history without a gap. Otherwise, None is
+    # returned and the caller should fetch the missing events from the history API instead.
+    def add_pushed_events(self, events):
+        unseen_events_by_id = {
+            event.id: event for event in events if event.id > self.last_event_id
+        }
+        new_events = []
+        for event_id in sorted(unseen_events_by_id.keys()):
+            if event_id != self.last_event_id + len(new_events) + 1:
+                return None
+            new_events.append(unseen_events_by_id[event_id])
+        self.add_events(new_events)
+        return new_events
+
+    # When the execution is waiting on a task token, the most recent event is the submitted task.
+    # Returns the ID of that event, or None if the execution is not waiting on a task token.
+    def get_task_token_event_id(self):
+        return self.task_token_event_id
+
+
+# Resolves state machine and execution ARNs, caching the results for the lifetime of the process.
+# By default, the state machine ARN is constructed from the region and the account ID,
+# which is queried from STS only once. Alternatively, state machine ARNs can be looked up
+# by name with ListStateMachines.
+class ArnResolver:
+    def __init__(
+        self,
+        region=default_region,
+        sts_client=sts_client,
+        sfn_client=sfn_client,
+        lookup_by_name=False,
+    ):
+        self.region = region
+        self.sts_client = sts_client
+        self.sfn_client = sfn_client
+        self.lookup_by_name = lookup_by_name
+        self.account_id = None
+        self.state_machine_arns = {}
+        self.lock = threading.Lock()
+
+    def get_account_id(self):
+        with self.lock:
+            if self.account_id is None:
+                self.account_id = self.sts_client.get_caller_identity()["Account"]
+            return self.account_id
+
+    def get_state_machine_arn(self, name):
+        if name in self.state_machine_arns:
+            return self.state_machine_arns[name]
+
+        if self.lookup_by_name:
+            self.list_state_machine_arns()
+            if name not in self.state_machine_arns:
+                raise Exception(f"Could not find state machine {name}")
+        else:
+            self.state_machine_arns[name] = (
+                f"arn:aws:states:{self.region}:{self.get_account_id()}:stateMachine:{name}"
+            )
+        return self.state_machine_arns[name]
+
+    def list_state_machine_arns(self):
+        paginator = self.sfn_client.get_paginator("list_state_machines")
+        for page in paginator.paginate():
+            for state_machine in page["stateMachines"]:
+                self.state_machine_arns[state_machine["name"]] = state_machine[
+                    "stateMachineArn"
+                ]
+
+    def get_execution_arn(self, state_machine_name, execution_name):
+        state_machine_arn = self.get_state_machine_arn(state_machine_name)
+        execution_arn_prefix = state_machine_arn.replace(
+            ":stateMachine:", ":execution:", 1
+        )
+        return f"{execution_arn_prefix}:{execution_name}"
+
+
+arn_resolver = ArnResolver()
+
+
+# An explicit region or STS client gets its own resolver, so the ARN is built for that region and account
+def get_resolver(region=None, sts_client=None, resolver=arn_resolver):
+    if region is None and sts_client is None:
+        return resolver
+    resolver_args = {}
+    if region is not None:
+        resolver_args["region"] = region
+    if sts_client is not None:
+        resolver_args["sts_client"] = sts_client
+    return ArnResolver(**resolver_args)
+
+
+def get_state_machine_arn(name, region=None, sts_client=None, resolver=arn_resolver):
+    return get_resolver(region, sts_client, resolver).get_state_machine_arn(name)
 
 
 # Construct a unique execution name from the Streamlit session ID
@@ -122,9 +515,15 @@ def get_execution_name(session_id):
 
 
 def get_execution_arn(
-    state_machine_name, execution_name, region=default_region, sts_client=sts_client
+    state_machine_name,
+    execution_name,
+    region=None,
+    sts_client=None,
+    resolver=arn_resolver,
 ):
-    return f"arn:aws:states:{region}:{sts_client.get_caller_identity()['Account']}:execution:{state_machine_name}:{execution_name}"
+    return get_resolver(region, sts_client, resolver).get_execution_arn(
+        state_machine_name, execution_name
+    )
 
 
 def start_execution(
@@ -132,11 +531,14 @@ def start_execution(
     session_id,
     input,
     client=sfn_client,
-    region=default_region,
-    sts_client=sts_client,
+    region=None,
+    sts_client=None,
+    resolver=arn_resolver,
 ):
     response = client.start_execution(
-        stateMachineArn=get_state_machine_arn(state_machine_name, region, sts_client),
+        stateMachineArn=get_state_machine_arn(
+            state_machine_name, region, sts_client, resolver
+        ),
         name=get_execution_name(session_id),
         input=input,
     )
@@ -150,80 +552,673 @@ def continue_execution(task_token, task_output, client=sfn_client):
     )
 
 
-def describe_execution(execution_arn, client=sfn_client):
+# Caches the rendered status and the description of executions that have completed.
+# An execution can't change after it reaches a terminal state, so the cached entries never go stale,
+# and Streamlit reruns of a page for a completed execution don't need to call Step Functions at all.
+# The least recently used executions are evicted once the cache is full.
+class CompletedExecutionCache:
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, execution_arn):
+        with self.lock:
+            if execution_arn not in self.entries:
+                return None
+            self.entries.move_to_end(execution_arn)
+            return self.entries[execution_arn]
+
+    def put(self, execution_arn, execution, status_markdown):
+        if not has_execution_completed(execution):
+            return
+        with self.lock:
+            self.entries[execution_arn] = {
+                "execution": execution,
+                "status_markdown": status_markdown,
+            }
+            self.entries.move_to_end(execution_arn)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+completed_execution_cache = CompletedExecutionCache()
+
+
+def describe_execution(
+    execution_arn, client=sfn_client, cache=completed_execution_cache
+):
+    cached_execution = cache.get(execution_arn)
+    if cached_execution is not None:
+        return cached_execution["status_markdown"]
+
+    if is_express_execution_arn(execution_arn):
+        return describe_express_execution(execution_arn, cache=cache)
+
     execution = client.describe_execution(executionArn=execution_arn)
-    execution_events = []
-    paginator = client.get_paginator("get_execution_history")
-    for page in paginator.paginate(
-        executionArn=execution_arn, includeExecutionData=False
+    history = ExecutionHistory(execution_arn, client)
+    history.fetch_new_events()
+    status_markdown = history.get_status_markdown(execution)
+    cache.put(execution_arn, execution, status_markdown)
+    return status_markdown
+
+
+# An execution tracked by the execution poller, along with the sessions subscribed to its updates
+class TrackedExecution:
+    def __init__(self, execution_arn, client):
+        self.execution_arn = execution_arn
+        self.history = ExecutionHistory(execution_arn, client)
+        self.subscriptions = []
+        self.tracking_start_time = time.monotonic()
+        self.next_poll_time = self.tracking_start_time
+        self.execution = None
+        self.pushed_execution = None
+        self.pushed_events = []
+        self.received_pushed_updates = False
+
+    def has_pushed_updates(self):
+        return self.pushed_execution is not None or len(self.pushed_events) > 0
+
+
+# A single background poller for all the executions started by the webapp process.
+# Streamlit sessions subscribe to an execution and receive its status updates on a queue,
+# instead of every session polling Step Functions in its own loop.
+# All subscribers of an execution share one DescribeExecution and GetExecutionHistory call per poll,
+# and the calls are rate limited by the rate governor across all executions.
+# Each execution is polled on an adaptive interval with jitter: quickly while it is making progress,
+# and more slowly when it has been running for a long time or is waiting on a task token.
+# All poll intervals are stretched out further as the rate governor's buckets run low.
+# When execution updates are pushed to the webapp, the poller uses the pushed updates and only
+# polls Step Functions on a slow fallback interval, in case a pushed update was missed.
+# Executions that haven't received any pushed updates yet keep the regular poll intervals.
+class ExecutionPoller:
+    def __init__(
+        self,
+        client=sfn_client,
+        governor=rate_governor,
+        cache=completed_execution_cache,
+        min_poll_interval=1,
+        max_poll_interval=5,
+        paused_poll_interval=10,
+        pushed_updates_poll_interval=30,
+    ):
+        self.client = client
+        self.governor = governor
+        self.cache = cache
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.paused_poll_interval = paused_poll_interval
+        self.pushed_updates_poll_interval = pushed_updates_poll_interval
+        self.receives_pushed_updates = False
+        self.executions = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def subscribe(self, execution_arn):
+        subscription = queue.Queue()
+        with self.condition:
+            if execution_arn not in self.executions:
+                self.executions[execution_arn] = TrackedExecution(
+                    execution_arn, self.client
+                )
+            tracked_execution = self.executions[execution_arn]
+            tracked_execution.subscriptions.append(subscription)
+            # A new subscriber may be waiting on a state change, such as a continued task, so poll right away
+            tracked_execution.next_poll_time = time.monotonic()
+
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="ExecutionPoller", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+        return subscription
+
+    def unsubscribe(self, execution_arn, subscription):
+        with self.condition:
+            tracked_execution = self.executions.get(execution_arn)
+            if tracked_execution is None:
+                return
+            if subscription in tracked_execution.subscriptions:
+                tracked_execution.subscriptions.remove(subscription)
+            if not tracked_execution.subscriptions:
+                del self.executions[execution_arn]
+
+    def push_update(self, execution_arn, execution=None, events=None):
+        with self.condition:
+            tracked_execution = self.executions.get(execution_arn)
+            if tracked_execution is None:
+                return
+            tracked_execution.received_pushed_updates = True
+            if execution is not None:
+                tracked_execution.pushed_execution = execution
+            if events:
+                tracked_execution.pushed_events += [
+                    EventRecord.from_history_event(event) for event in events
+                ]
+            if tracked_execution.next_poll_time != float("inf"):
+                tracked_execution.next_poll_time = time.monotonic()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.executions:
+                    self.condition.wait()
+                tracked_execution = min(
+                    self.executions.values(),
+                    key=lambda execution: execution.next_poll_time,
+                )
+                wait_time = tracked_execution.next_poll_time - time.monotonic()
+                if wait_time > 0:
+                    self.condition.wait(wait_time)
+                    continue
+                # Don't poll this execution again until the current poll is complete
+                tracked_execution.next_poll_time = float("inf")
+
+            self.poll(tracked_execution)
+
+    def poll(self, tracked_execution):
+        with self.condition:
+            pushed_execution = tracked_execution.pushed_execution
+            pushed_events = tracked_execution.pushed_events
+            tracked_execution.pushed_execution = None
+            tracked_execution.pushed_events = []
+
+        try:
+            execution, new_events = self.get_execution_and_new_events(
+                tracked_execution, pushed_execution, pushed_events
+            )
+            tracked_execution.execution = execution
+            update = {
+                "execution": execution,
+                "status_markdown": tracked_execution.history.get_status_markdown(
+                    execution
+                ),
+                "task_token_event_id": tracked_execution.history.get_task_token_event_id(),
+            }
+        except Exception as e:
+            update = {"error": e}
+
+        with self.condition:
+            for subscription in tracked_execution.subscriptions:
+                subscription.put(update)
+
+            is_completed = "error" in update or has_execution_completed(
+                update["execution"]
+            )
+            if is_completed:
+                if "error" not in update:
+                    self.cache.put(
+                        tracked_execution.execution_arn,
+                        update["execution"],
+                        update["status_markdown"],
+                    )
+                if (
+                    self.executions.get(tracked_execution.execution_arn)
+                    is tracked_execution
+                ):
+                    del self.executions[tracked_execution.execution_arn]
+            else:
+                tracked_execution.next_poll_time = (
+                    time.monotonic()
+                    + self.get_poll_interval(
+                        tracked_execution,
+                        update["task_token_event_id"] is not None,
+                        new_events,
+                    )
+                )
+                # Updates that were pushed while polling are handled right away
+                if tracked_execution.has_pushed_updates():
+                    tracked_execution.next_poll_time = time.monotonic()
+
+    def get_execution_and_new_events(
+        self, tracked_execution, pushed_execution, pushed_events
+    ):
+        is_polling = pushed_execution is None and not pushed_events
+        execution = pushed_execution or tracked_execution.execution
+
+        # Pushed status changes don't include the output when it is too large
+        if (
+            is_polling
+            or execution is None
+            or (execution["status"] == "SUCCEEDED" and execution.get("output") is None)
+        ):
+            execution = self.client.describe_execution(
+                executionArn=tracked_execution.execution_arn
+            )
+
+        # Pushed history events may still be in flight when the execution completes,
+        # so read the rest of the history once the execution has completed
+        new_events = None
+        if not is_polling and not has_execution_completed(execution):
+            new_events = tracked_execution.history.add_pushed_events(pushed_events)
+        if new_events is None:
+            new_events = tracked_execution.history.fetch_new_events()
+
+        return execution, new_events
+
+    def get_poll_interval(
+        self, tracked_execution, is_waiting_for_task_token, new_events
     ):
-        execution_events += page["events"]
-    return get_workflow_status_markdown(execution, execution_events)
+        if is_waiting_for_task_token:
+            interval = self.paused_poll_interval
+        elif self.receives_pushed_updates and tracked_execution.received_pushed_updates:
+            interval = self.pushed_updates_poll_interval
+        elif new_events:
+            interval = self.min_poll_interval
+        else:
+            # Back off by one second for every 30 seconds that the execution has been running
+            running_time = time.monotonic() - tracked_execution.tracking_start_time
+            interval = min(
+                self.max_poll_interval, self.min_poll_interval + running_time / 30
+            )
+        interval *= self.governor.get_backoff_factor()
+        # Add jitter so that executions started at the same time don't stay in lockstep
+        return interval * random.uniform(0.8, 1.2)
+
+
+execution_poller = ExecutionPoller()
+
+
+# Receives execution updates from an SQS queue and hands them to the execution poller.
+# Execution status changes are sent to the queue by an EventBridge rule, and execution history events
+# are forwarded to the queue from the state machines' execution logs by a Lambda function.
+# Set SQS_ENDPOINT_URL to consume the updates from a local queue instead, such as ElasticMQ.
+class ExecutionEventConsumer:
+    def __init__(self, queue_url, poller=execution_poller, sqs_client=None):
+        self.queue_url = queue_url
+        self.poller = poller
+        self.sqs_client = sqs_client or boto3.client(
+            "sqs", endpoint_url=os.environ.get("SQS_ENDPOINT_URL") or None
+        )
+        self.thread = None
+
+    def start(self):
+        self.poller.receives_pushed_updates = True
+        self.thread = threading.Thread(
+            target=self.run, name="ExecutionEventConsumer", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.receive_messages()
+            except Exception:
+                logger.exception("Failed to receive execution events")
+                time.sleep(5)
+
+    # Each message is deleted as soon as it has been handled. A message that fails is left on the queue
+    # to be received again, until the queue moves it to its dead-letter queue. The updates of each execution
+    # are in their own message group, so the rest of the failed message's group is left on the queue too,
+    # to keep that execution's updates in order.
+    def receive_messages(self):
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=20,
+            MessageSystemAttributeNames=["MessageGroupId"],
+        )
+        failed_message_groups = set()
+        for message in response.get("Messages", []):
+            message_group_id = message.get("Attributes", {}).get("MessageGroupId")
+            if message_group_id in failed_message_groups:
+                continue
+            try:
+                self.handle_message(json.loads(message["Body"]))
+            except Exception:
+                logger.exception(
+                    "Failed to handle execution events message %s", message["MessageId"]
+                )
+                failed_message_groups.add(message_group_id)
+                continue
+            self.sqs_client.delete_message(
+                QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"]
+            )
+
+    def handle_message(self, message):
+        if message.get("detail-type") == "Step Functions Execution Status Change":
+            execution = message["detail"]
+            self.poller.push_update(execution["executionArn"], execution=execution)
+        else:
+            self.poller.push_update(message["execution_arn"], events=message["events"])
 
 
-def poll_for_execution_completion(execution_arn, callback_fn=None, client=sfn_client):
-    while True:
-        execution = client.describe_execution(executionArn=execution_arn)
+# Wait on the execution poller's updates for the given execution.
+# With a timeout, None is yielded whenever no update arrived within the timeout,
+# so that the caller can do other work while it waits, like reading a response stream.
+def get_execution_updates(execution_arn, poller=execution_poller, timeout=None):
+    subscription = poller.subscribe(execution_arn)
+    try:
+        while True:
+            try:
+                update = subscription.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+                continue
+            if "error" in update:
+                raise update["error"]
+            yield update
+    finally:
+        poller.unsubscribe(execution_arn, subscription)
+
+
+def poll_for_execution_completion(
+    execution_arn,
+    callback_fn=None,
+    poller=execution_poller,
+    response_stream_callback_fn=None,
+):
+    response_stream = get_response_stream(execution_arn, response_stream_callback_fn)
+    for update in get_execution_updates(
+        execution_arn, poller, get_response_stream_timeout(response_stream)
+    ):
+        read_response_stream(response_stream, response_stream_callback_fn)
+        if update is None:
+            continue
 
         if callback_fn:
-            execution_events = []
-            paginator = client.get_paginator("get_execution_history")
-            for page in paginator.paginate(
-                executionArn=execution_arn, includeExecutionData=False
-            ):
-                execution_events += page["events"]
-            callback_fn(get_workflow_status_markdown(execution, execution_events))
+            callback_fn(update["status_markdown"])
 
+        execution = update["execution"]
         if execution["status"] and execution["status"] != "RUNNING":
             return execution
-        time.sleep(1)
+
+
+# Get the payload that was sent to the task that is waiting on a task token.
+# The payload is only included in the execution history when requesting the execution data,
+# so the execution data is only fetched for this one event.
+def get_task_token_payload(execution_arn, task_token_event_id, client=sfn_client):
+    response = client.get_execution_history(
+        executionArn=execution_arn,
+        reverseOrder=True,
+        maxResults=1,
+        includeExecutionData=True,
+    )
+    most_recent_event = response["events"][0]
+    if most_recent_event["id"] != task_token_event_id:
+        # The execution has moved on since the task was submitted
+        return None
+    output = json.loads(most_recent_event["taskSubmittedEventDetails"]["output"])
+    return output["Payload"]
 
 
 def poll_for_execution_task_token_or_completion(
-    execution_arn, callback_fn=None, client=sfn_client
+    execution_arn,
+    callback_fn=None,
+    client=sfn_client,
+    poller=execution_poller,
+    response_stream_callback_fn=None,
 ):
-    while True:
-        # Check if execution is still running
-        # When the execution is waiting on a task token, its status is still RUNNING.
-        response = client.describe_execution(executionArn=execution_arn)
+    response_stream = get_response_stream(execution_arn, response_stream_callback_fn)
+    for update in get_execution_updates(
+        execution_arn, poller, get_response_stream_timeout(response_stream)
+    ):
+        read_response_stream(response_stream, response_stream_callback_fn)
+        if update is None:
+            continue
 
         if callback_fn:
-            execution_events = []
-            paginator = client.get_paginator("get_execution_history")
-            for page in paginator.paginate(
-                executionArn=execution_arn, includeExecutionData=False
-            ):
-                execution_events += page["events"]
-            callback_fn(get_workflow_status_markdown(response, execution_events))
+            callback_fn(update["status_markdown"])
 
-        if response["status"] and response["status"] != "RUNNING":
-            return response
+        # Check if execution is still running
+        # When the execution is waiting on a task token, its status is still RUNNING.
+        execution = update["execution"]
+        if execution["status"] and execution["status"] != "RUNNING":
+            return execution
 
         # Check if execution is waiting on a task token
-        response = client.get_execution_history(
-            executionArn=execution_arn,
-            reverseOrder=True,
-            maxResults=1,
-            includeExecutionData=True,
-        )
-
-        most_recent_event = response["events"][0]
-        if (
-            most_recent_event["type"] == "TaskSubmitted"
-            and most_recent_event["taskSubmittedEventDetails"]["resource"]
-            == "invoke.waitForTaskToken"
-        ):
-            output = json.loads(
-                most_recent_event["taskSubmittedEventDetails"]["output"]
+        if update["task_token_event_id"] is not None:
+            task_payload = get_task_token_payload(
+                execution_arn, update["task_token_event_id"], client
             )
-            return {
-                "status": "PAUSED",
-                "task_payload": output["Payload"],
-            }
+            if task_payload is not None:
+                return {
+                    "status": "PAUSED",
+                    "task_payload": task_payload,
+                }
+
 
-        time.sleep(1)
+def has_execution_completed(execution):
+    return bool(execution["status"]) and execution["status"] != "RUNNING"
 
 
-def is_execution_completed(execution_arn, client=sfn_client):
+def is_execution_completed(
+    execution_arn, client=sfn_client, cache=completed_execution_cache
+):
+    if cache.get(execution_arn) is not None:
+        return True
     response = client.describe_execution(executionArn=execution_arn)
     return response["status"] and response["status"] != "RUNNING"
+
+
+# Response streams
+# Some demo state machines stream the model's final response to a DynamoDB table as it is generated,
+# in chunks keyed by the execution name. While waiting on the execution, the webapp reads the new chunks
+# more often than it polls the execution, so the response shows up as soon as the model starts writing it.
+response_stream_read_interval = 0.5
+
+
+# The table that the demo stacks create for each streaming state machine
+def get_response_stream_table_name(state_machine_name):
+    return f"{state_machine_name}-ResponseStream"
+
+
+class ResponseStream:
+    def __init__(self, state_machine_name, execution_name, client=dynamodb_client):
+        self.table_name = get_response_stream_table_name(state_machine_name)
+        self.execution_name = execution_name
+        self.client = client
+        self.chunks = []
+        self.next_chunk_index = 0
+        self.done = False
+
+    # Returns whether any new chunks were read
+    def fetch_new_chunks(self):
+        if self.done:
+            return False
+        paginator = self.client.get_paginator("query")
+        pages = paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression="execution_name = :execution_name AND chunk_index >= :next_chunk_index",
+            ExpressionAttributeValues={
+                ":execution_name": {"S": self.execution_name},
+                ":next_chunk_index": {"N": str(self.next_chunk_index)},
+            },
+            ConsistentRead=True,
+        )
+        new_chunk_count = 0
+        for item in itertools.chain.from_iterable(page["Items"] for page in pages):
+            # Only add chunks that continue the response without a gap
+            if int(item["chunk_index"]["N"]) != self.next_chunk_index:
+                break
+            # A retried model invocation streams the response again from the start
+            if item.get("reset", {}).get("BOOL"):
+                self.chunks = []
+            self.chunks.append(item["text"]["S"])
+            self.next_chunk_index += 1
+            self.done = item["done"]["BOOL"]
+            new_chunk_count += 1
+        return new_chunk_count > 0
+
+    def get_text(self):
+        return "".join(self.chunks)
+
+
+# Execution ARNs end with <state machine>:<execution name> for Standard workflows,
+# and with <state machine>:<execution name>:<id> for Express workflows
+def get_response_stream(execution_arn, callback_fn, client=dynamodb_client):
+    if callback_fn is None:
+        return None
+    arn_parts = execution_arn.split(":")
+    return ResponseStream(arn_parts[6], arn_parts[7], client)
+
+
+def get_response_stream_timeout(response_stream):
+    return None if response_stream is None else response_stream_read_interval
+
+
+def read_response_stream(response_stream, callback_fn):
+    if response_stream is not None and response_stream.fetch_new_chunks():
+        if callback_fn:
+            callback_fn(response_stream.get_text())
+
+
+# Express workflows
+# The demo stacks can optionally deploy some of the demo state machines as Express workflows,
+# which are listed in the EXPRESS_STATE_MACHINES environment variable.
+# The webapp starts an Express workflow execution with StartSyncExecution, which returns the result of the
+# execution in a single call, instead of polling the execution until it completes.
+# Express executions don't have an execution history in Step Functions, so the status panel is built from
+# the execution history events in the state machine's execution logs instead.
+express_state_machine_names = [
+    name
+    for name in os.environ.get("EXPRESS_STATE_MACHINES", "").split(",")
+    if name.strip()
+]
+
+
+def is_express_state_machine(state_machine_name):
+    return state_machine_name in express_state_machine_names
+
+
+# Express execution ARNs look like arn:aws:states:<region>:<account>:express:<state machine>:<execution>:<id>
+def is_express_execution_arn(execution_arn):
+    return execution_arn.split(":")[5] == "express"
+
+
+# The log group that the demo stacks create for each state machine's execution logs
+def get_state_machine_log_group_name(state_machine_name):
+    return f"/aws/vendedlogs/states/{state_machine_name}"
+
+
+execution_status_by_event_type = {
+    "ExecutionSucceeded": "SUCCEEDED",
+    "ExecutionFailed": "FAILED",
+    "ExecutionTimedOut": "TIMED_OUT",
+    "ExecutionAborted": "ABORTED",
+}
+
+
+# Reads the execution history events of an execution from its state machine's execution logs
+class ExecutionLogs:
+    def __init__(
+        self, state_machine_name, execution_name, start_time=None, client=logs_client
+    ):
+        self.log_group_name = get_state_machine_log_group_name(state_machine_name)
+        self.execution_name = execution_name
+        # Only search the logs after the start time (milliseconds since the epoch), if it is known
+        self.start_time = start_time
+        self.client = client
+        self.history = ExecutionHistory(None)
+        self.status = "RUNNING"
+        self.pending_events = {}
+
+    def fetch_new_events(self):
+        request = {
+            "logGroupName": self.log_group_name,
+            # The execution name is unique, and is part of the execution ARN in every log entry
+            "filterPattern": f'"{self.execution_name}"',
+        }
+        if self.start_time is not None:
+            request["startTime"] = self.start_time
+        paginator = self.client.get_paginator("filter_log_events")
+        for page in paginator.paginate(**request):
+            for log_event in page["events"]:
+                event = EventRecord.from_log_entry(json.loads(log_event["message"]))
+                if event.id > self.history.last_event_id:
+                    self.pending_events[event.id] = event
+
+        # Log entries can be delivered out of order, so only add events that continue the history without a gap
+        new_events = []
+        next_event_id = self.history.last_event_id + 1
+        while next_event_id in self.pending_events:
+            event = self.pending_events.pop(next_event_id)
+            new_events.append(event)
+            if event.type in execution_status_by_event_type:
+                self.status = execution_status_by_event_type[event.type]
+            next_event_id += 1
+        self.history.add_events(new_events)
+        return new_events
+
+    def get_status_markdown(self, execution=None):
+        return self.history.get_status_markdown(execution or {"status": self.status})
+
+
+# Start an Express workflow execution and wait for it to complete.
+# While waiting on the StartSyncExecution call, the status panel is updated from the execution logs.
+def start_sync_execution(
+    state_machine_name,
+    session_id,
+    input,
+    callback_fn=None,
+    client=sync_sfn_client,
+    logs_client=logs_client,
+    resolver=arn_resolver,
+    cache=completed_execution_cache,
+    poll_interval=2,
+    response_stream_callback_fn=None,
+):
+    execution_name = get_execution_name(session_id)
+    response_stream = None
+    if response_stream_callback_fn:
+        response_stream = ResponseStream(state_machine_name, execution_name)
+    execution_logs = ExecutionLogs(
+        state_machine_name,
+        execution_name,
+        # Allow for some clock skew
+        start_time=int((time.time() - 30) * 1000),
+        client=logs_client,
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        response_future = executor.submit(
+            client.start_sync_execution,
+            stateMachineArn=get_state_machine_arn(
+                state_machine_name, resolver=resolver
+            ),
+            name=execution_name,
+            input=input,
+        )
+        next_logs_fetch_time = time.monotonic() + poll_interval
+        while True:
+            try:
+                execution = response_future.result(
+                    timeout=get_response_stream_timeout(response_stream)
+                    or poll_interval
+                )
+                break
+            except concurrent.futures.TimeoutError:
+                read_response_stream(response_stream, response_stream_callback_fn)
+                if callback_fn and time.monotonic() >= next_logs_fetch_time:
+                    execution_logs.fetch_new_events()
+                    callback_fn(execution_logs.get_status_markdown())
+                    next_logs_fetch_time = time.monotonic() + poll_interval
+
+    # The final log entries may not have been delivered yet, but the execution's status is known
+    execution_logs.fetch_new_events()
+    status_markdown = execution_logs.get_status_markdown(execution)
+    cache.put(execution["executionArn"], execution, status_markdown)
+    if callback_fn:
+        callback_fn(status_markdown)
+    return execution
+
+
+def describe_express_execution(
+    execution_arn, logs_client=logs_client, cache=completed_execution_cache
+):
+    arn_parts = execution_arn.split(":")
+    # The execution's start time isn't known here, so search the whole log group
+    execution_logs = ExecutionLogs(arn_parts[6], arn_parts[7], client=logs_client)
+    execution_logs.fetch_new_events()
+    status_markdown = execution_logs.get_status_markdown()
+    cache.put(
+        execution_arn,
+        {"executionArn": execution_arn, "status": execution_logs.status},
+        status_markdown,
+    )
+    return status_markdown
+
+
+if os.environ.get("EXECUTION_EVENTS_QUEUE_URL"):
+    ExecutionEventConsumer(os.environ["EXECUTION_EVENTS_QUEUE_URL"]).start()